@@ -0,0 +1,170 @@
+""" Background monitor of the health of the devices """
+
+import logging
+import os
+import time
+
+from eventlet import sleep, spawn, tpool
+from swift.common.constraints import check_drive
+
+
+class DeviceHealth:
+    """
+    Last known state of a device.
+
+    :param mounted: whether the device passed check_drive
+    :param free_bytes: bytes available to unprivileged users
+    :param free_inodes: inodes available to unprivileged users
+    :param latency: seconds taken by the probe of the device
+    :param checked: monotonic time of the end of the probe
+    """
+
+    __slots__ = ("mounted", "free_bytes", "free_inodes", "latency", "checked")
+
+    def __init__(self, mounted, free_bytes, free_inodes, latency, checked):
+        self.mounted = mounted
+        self.free_bytes = free_bytes
+        self.free_inodes = free_inodes
+        self.latency = latency
+        self.checked = checked
+
+
+class DeviceMonitor:
+    """
+    Probes every interval seconds each device under devices: check_drive (a
+    mount check with mount_check, a directory check otherwise) and statvfs,
+    timed. The probes run in the eventlet thread pool, one device after the
+    other, from a green thread, so that a hung device does not block the
+    hub.
+
+    The requests read the state of the devices from memory instead of
+    checking them: see available() and free_bytes(). A device whose probe
+    has not returned for probe_timeout seconds is unavailable. A state older
+    than max_age seconds, as when the monitor is behind, is not used.
+
+    The latency of the probes is sent as the device_probe.<device> timing.
+
+    :param devices: path of the devices
+    :param mount_check: whether the devices must be mount points
+    :param interval: seconds between two probes of the devices
+    :param probe_timeout: seconds after which a probe not returned makes the
+                          device unavailable
+    :param logger: logger used for metrics
+    """
+
+    def __init__(self, devices, mount_check, interval, probe_timeout, logger):
+        self.devices = devices
+        self.mount_check = mount_check
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.max_age = 3 * interval + probe_timeout
+        self.logger = logger
+        self.health = {}
+        self._probing = None
+        self._probe_start = None
+        self._pid = None
+
+    def start(self):
+        """
+        Start monitoring in the current process, if not already done. It is
+        called by each request, the workers being forked after the application
+        is loaded.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._pid = pid
+        self.health = {}
+        self._probing = None
+        spawn(self._run, pid)
+
+    def stop(self):
+        self._pid = None
+
+    def _run(self, pid):
+        while self._pid == pid:
+            self.probe_all()
+            sleep(self.interval)
+
+    def probe_all(self):
+        try:
+            devices = tpool.execute(os.listdir, self.devices)
+        except OSError as err:
+            logging.error("Could not list the devices in %s: %s", self.devices, err)
+            return
+        for device in devices:
+            self.probe(device)
+        for device in set(self.health) - set(devices):
+            del self.health[device]
+
+    def probe(self, device):
+        """Probe a device and record its state, returned."""
+        self._probing = device
+        self._probe_start = time.monotonic()
+        try:
+            mounted, free_bytes, free_inodes = tpool.execute(self._probe, device)
+        except Exception as err:
+            logging.error("Could not probe the device %s: %s", device, err)
+            mounted, free_bytes, free_inodes = False, None, None
+        finally:
+            self._probing = None
+        now = time.monotonic()
+        latency = now - self._probe_start
+        previous = self.health.get(device)
+        if previous is not None and previous.mounted != mounted:
+            logging.warning(
+                "Device %s is now %s",
+                device,
+                "available" if mounted else "unavailable",
+            )
+        health = DeviceHealth(mounted, free_bytes, free_inodes, latency, now)
+        self.health[device] = health
+        self.logger.timing("device_probe.%s" % device, latency * 1000)
+        return health
+
+    def _probe(self, device):
+        try:
+            path = check_drive(self.devices, device, self.mount_check)
+        except ValueError:
+            return False, None, None
+        st = os.statvfs(path)
+        # Some filesystems do not count inodes
+        free_inodes = st.f_favail if st.f_files else None
+        return True, st.f_bavail * st.f_frsize, free_inodes
+
+    def _fresh(self, device):
+        health = self.health.get(device)
+        if health is not None and time.monotonic() - health.checked < self.max_age:
+            return health
+        return None
+
+    def available(self, device):
+        """
+        Return whether a device is available, or None if its state is not
+        known.
+        """
+        if (
+            self._probing == device
+            and time.monotonic() - self._probe_start > self.probe_timeout
+        ):
+            return False
+        health = self._fresh(device)
+        if health is None:
+            return None
+        return health.mounted
+
+    def free_bytes(self, device):
+        """
+        Return the bytes available on a device, or None if not known. No
+        inodes available counts as no bytes available.
+        """
+        health = self._fresh(device)
+        if health is None or health.free_bytes is None:
+            return None
+        if health.free_inodes == 0:
+            return 0
+        return health.free_bytes
+
+
+# Monitor of the devices of the object server, None when disabled
+monitor = None
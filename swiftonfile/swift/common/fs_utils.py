@@ -20,32 +20,234 @@ import stat
 import random
 import time
 import xattr
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
 from itertools import repeat
 import ctypes
-from eventlet import sleep
+from eventlet import patcher, sleep
 from swift.common.utils import load_libc_function
 from swiftonfile.swift.common.exceptions import SwiftOnFileSystemOSError
 from swift.common.exceptions import DiskFileNoSpace
-from functools import partial
+from bisect import bisect_left
+from functools import partial, wraps
 
+_threading = patcher.original("threading")
 
-def do_getxattr(path, key):
-    return xattr.getxattr(path, key).decode()
+# Upper bounds in microseconds of the latency histogram buckets of SyscallStats
+SYSCALL_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+_SYSCALL_LABELS = tuple("le_%dus" % bucket for bucket in SYSCALL_BUCKETS) + ("le_inf",)
 
 
+class SyscallStats:
+    """
+    Latency histograms and error counters of the filesystem calls made
+    through fs_utils. They are aggregated in the process and sent to statsd as
+    counters every interval seconds, on the first call made after it elapsed:
+
+    - fs.<call>.latency.le_<us>us, cumulative count of the calls that took at
+      most <us> microseconds, the last bucket being le_inf
+    - fs.<call>.latency.count and fs.<call>.latency.sum_us
+    - fs.<call>.errors.<errno> for the calls that failed
+    - fs.stat.eio_retries for the EIO retries of do_stat()
+
+    The device follows the call name (fs.<call>.<device>.latency...) for the
+    calls on a path under devices, not for those on a fd.
+
+    The calls made in the eventlet thread pool are recorded too, but only
+    the thread which created the statistics, the one running the eventlet
+    hub, sends them to statsd.
+
+    :param logger: logger with statsd support
+    :param devices: path of the devices
+    :param sample_rate: fraction of the calls timed, their counts being scaled
+                        accordingly. Errors are always counted.
+    :param interval: seconds between two flushes to statsd
+    """
+
+    def __init__(self, logger, devices, sample_rate=1.0, interval=10):
+        self.logger = logger
+        self.devices = devices.rstrip(os.path.sep) + os.path.sep
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self._histograms = {}
+        self._counters = defaultdict(int)
+        self._next_flush = time.monotonic() + interval
+        self._lock = _threading.Lock()
+        self._ident = _threading.get_ident()
+
+    def _device(self, path):
+        if path.__class__ is not str or not path.startswith(self.devices):
+            return None
+        start = len(self.devices)
+        end = path.find(os.path.sep, start)
+        return path[start:end] if end >= 0 else path[start:]
+
+    @staticmethod
+    def _metric(call, device):
+        return "fs.%s.%s" % (call, device) if device else "fs.%s" % call
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def timing(self, call, path, start):
+        """Record a call started at start, from time.monotonic()."""
+        now = time.monotonic()
+        elapsed = int((now - start) * 1000000)
+        key = (call, self._device(path))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(SYSCALL_BUCKETS) + 2)
+            histogram[bisect_left(SYSCALL_BUCKETS, elapsed)] += 1
+            histogram[-1] += elapsed
+        if now >= self._next_flush and _threading.get_ident() == self._ident:
+            self.flush(now)
+
+    def error(self, call, path, err):
+        code = errno.errorcode.get(getattr(err, "errno", None), type(err).__name__)
+        key = (call, self._device(path), "errors." + code)
+        with self._lock:
+            self._counters[key] += 1
+
+    def increment(self, call, path, name):
+        key = (call, self._device(path), name)
+        with self._lock:
+            self._counters[key] += 1
+
+    def flush(self, now=None):
+        """Send the statistics recorded since the last flush to statsd."""
+        self._next_flush = (now or time.monotonic()) + self.interval
+        with self._lock:
+            histograms, self._histograms = self._histograms, {}
+            counters, self._counters = self._counters, defaultdict(int)
+        scale = 1 / min(self.sample_rate, 1)
+        for (call, device), histogram in histograms.items():
+            metric = self._metric(call, device)
+            total = 0
+            for label, count in zip(_SYSCALL_LABELS, histogram):
+                total += count
+                if total:
+                    self.logger.update_stats(
+                        "%s.latency.%s" % (metric, label),
+                        int(round(total * scale)),
+                    )
+            self.logger.update_stats(
+                metric + ".latency.count", int(round(total * scale))
+            )
+            self.logger.update_stats(
+                metric + ".latency.sum_us", int(round(histogram[-1] * scale))
+            )
+        for (call, device, name), count in counters.items():
+            self.logger.update_stats(
+                "%s.%s" % (self._metric(call, device), name), count
+            )
+
+
+# SyscallStats of the calls of fs_utils, set by the object server
+syscall_stats = None
+
+
+def timed(call, path_arg=0):
+    """
+    Decorator recording the latency and errors of a filesystem call in
+    syscall_stats, path_arg being the position of the path or fd argument.
+    """
+
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = syscall_stats
+            if stats is None:
+                return func(*args, **kwargs)
+            path = args[path_arg] if len(args) > path_arg else None
+            start = time.monotonic() if stats.sampled() else None
+            try:
+                return func(*args, **kwargs)
+            except Exception as err:
+                stats.error(call, path, err)
+                raise
+            finally:
+                if start is not None:
+                    stats.timing(call, path, start)
+
+        return wrapper
+
+    return decorate
+
+
+@timed("getxattr")
+def do_getxattr(path, key, decode=True):
+    value = xattr.getxattr(path, key)
+    return value.decode() if decode else value
+
+
+@timed("listxattr")
+def do_listxattr(path):
+    return xattr.listxattr(path)
+
+
+_fgetxattr = None
+
+
+@timed("getxattr")
+def do_getxattr_into(path, key, buf, offset=0):
+    """
+    Read the value of an xattr into a bytearray at offset and return its
+    length. The value of an xattr of a fd is read straight into buf with
+    fgetxattr(), which fails with ERANGE if it doesn't fit.
+    """
+    global _fgetxattr
+    if _fgetxattr is None:
+        try:
+            _fgetxattr = load_libc_function(
+                "fgetxattr", fail_if_missing=True, errcheck=True
+            )
+        except AttributeError:
+            _fgetxattr = False
+        else:
+            _fgetxattr.argtypes = [
+                ctypes.c_int,
+                ctypes.c_char_p,
+                ctypes.c_void_p,
+                ctypes.c_size_t,
+            ]
+            _fgetxattr.restype = ctypes.c_ssize_t
+    if _fgetxattr and isinstance(path, int):
+        size = len(buf) - offset
+        value = (ctypes.c_char * size).from_buffer(buf, offset)
+        try:
+            return _fgetxattr(path, os.fsencode(key), value, size)
+        finally:
+            del value
+    value = xattr.getxattr(path, key)
+    buf[offset : offset + len(value)] = value
+    return len(value)
+
+
+@timed("setxattr")
 def do_setxattr(path, key, value):
     xattr.setxattr(path, key, value)
 
 
+@timed("removexattr")
 def do_removexattr(path, key):
     xattr.removexattr(path, key)
 
 
+@timed("walk")
 def do_walk(*args, **kwargs):
+    """
+    os.walk() lists the directories while it is iterated: the walks are
+    counted, their time is not.
+    """
     return os.walk(*args, **kwargs)
 
 
+@timed("scandir")
+def do_scandir(path):
+    return os.scandir(path)
+
+
+@timed("write")
 def do_write(fd, buf):
     try:
         cnt = os.write(fd, buf)
@@ -63,6 +265,7 @@ def do_write(fd, buf):
     return cnt
 
 
+@timed("read")
 def do_read(fd, n):
     try:
         buf = os.read(fd, n)
@@ -73,6 +276,18 @@ def do_read(fd, n):
     return buf
 
 
+@timed("pread")
+def do_pread(fd, n, offset):
+    try:
+        buf = os.pread(fd, n, offset)
+    except OSError as err:
+        raise SwiftOnFileSystemOSError(
+            err.errno, '%s, os.pread("%s", ..., %d)' % (err.strerror, fd, offset)
+        )
+    return buf
+
+
+@timed("ismount")
 def do_ismount(path):
     """
     Test whether a path is a mount point.
@@ -117,19 +332,182 @@ def do_ismount(path):
     return False
 
 
+class DirFdCache:
+    """
+    Bounded LRU cache of open fds of the container directories, so that the
+    operations on objects run relative to them with the *at() syscalls
+    instead of walking the whole path from the root each time.
+
+    A cached fd keeps pointing to its directory after it is removed or
+    replaced: an ENOENT or ESTALE error of an operation made relative to a
+    removed directory invalidates its fd, and the operation is retried with
+    the full path.
+
+    The cache belongs to the thread which created it, the one running the
+    eventlet hub. The operations made in other threads, like those of the
+    eventlet thread pool, use the full path, and their invalidations are
+    deferred to the next lookup of the hub thread: an fd is never closed
+    while the hub may use it.
+
+    :param devices: path of the devices
+    :param size: maximum number of fds kept open
+    :param depth: number of path components of the cached directories below
+                  devices, 3 for containers (device/account/container)
+    """
+
+    def __init__(self, devices, size=1024, depth=3):
+        self.devices = devices.rstrip(os.path.sep) + os.path.sep
+        self.size = size
+        self.depth = depth
+        self._fds = OrderedDict()
+        self._ident = _threading.get_ident()
+        self._invalidated = deque()
+
+    def _split(self, path):
+        """
+        Return the cached directory of path and the path relative to it, or
+        (None, path) if path is not below a directory to cache.
+        """
+        if not path.startswith(self.devices):
+            return None, path
+        parts = path[len(self.devices) :].split(os.path.sep, self.depth)
+        if len(parts) <= self.depth or not parts[-1] or not all(parts[:-1]):
+            return None, path
+        return self.devices + os.path.sep.join(parts[:-1]), parts[-1]
+
+    def lookup(self, path):
+        """
+        Return the fd of the cached directory of path and the path relative
+        to it, or (None, path) to use the full path.
+        """
+        if _threading.get_ident() != self._ident:
+            return None, path
+        while self._invalidated:
+            self._invalidate(self._invalidated.popleft())
+        dir_path, name = self._split(path)
+        if dir_path is None:
+            return None, path
+        fd = self._fds.get(dir_path)
+        if fd is not None:
+            self._fds.move_to_end(dir_path)
+            return fd, name
+        try:
+            fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+        except OSError:
+            return None, path
+        self._fds[dir_path] = fd
+        while len(self._fds) > self.size:
+            os.close(self._fds.popitem(last=False)[1])
+        return fd, name
+
+    def stale(self, path, fd, err):
+        """
+        Return True, invalidating the fd, if err was raised because the
+        directory of fd was removed, and the operation on path should be
+        retried with the full path.
+        """
+        if err.errno == errno.ENOENT:
+            try:
+                if os.fstat(fd).st_nlink:
+                    return False
+            except OSError:
+                pass
+        elif err.errno != errno.ESTALE:
+            return False
+        self._invalidate(self._split(path)[0])
+        return True
+
+    def invalidate(self, path):
+        """
+        Close the fds of path and of the cached directories below it, at the
+        next lookup if not called by the hub thread.
+        """
+        if _threading.get_ident() != self._ident:
+            self._invalidated.append(path)
+        else:
+            self._invalidate(path)
+
+    def _invalidate(self, path):
+        path = path.rstrip(os.path.sep)
+        if path.startswith(self.devices) and (
+            path[len(self.devices) :].count(os.path.sep) >= self.depth
+        ):
+            # Below the cached directories
+            return
+        for dir_path in list(self._fds):
+            if dir_path == path or dir_path.startswith(path + os.path.sep):
+                os.close(self._fds.pop(dir_path))
+
+    def close(self):
+        self._invalidated.clear()
+        while self._fds:
+            os.close(self._fds.popitem()[1])
+
+
+# DirFdCache of the operations on paths, set by the object server
+dir_fd_cache = None
+
+
+def _call_at(func, path, *args):
+    """
+    Call func(path, *args), relative to the cached fd of the directory of
+    path when there is one.
+    """
+    cache = dir_fd_cache
+    if cache is not None:
+        fd, name = cache.lookup(path)
+        if fd is not None:
+            try:
+                return func(name, *args, dir_fd=fd)
+            except OSError as err:
+                if not cache.stale(path, fd, err):
+                    raise
+    return func(path, *args)
+
+
+def _rename_at(old_path, new_path):
+    cache = dir_fd_cache
+    if cache is not None:
+        old_fd, old_name = cache.lookup(old_path)
+        new_fd, new_name = cache.lookup(new_path)
+        if old_fd is not None or new_fd is not None:
+            try:
+                return os.rename(
+                    old_name, new_name, src_dir_fd=old_fd, dst_dir_fd=new_fd
+                )
+            except OSError as err:
+                old_stale = old_fd is not None and cache.stale(old_path, old_fd, err)
+                new_stale = new_fd is not None and cache.stale(new_path, new_fd, err)
+                if not (old_stale or new_stale):
+                    raise
+    return os.rename(old_path, new_path)
+
+
+def _invalidate_dir_fds(path):
+    cache = dir_fd_cache
+    if cache is not None:
+        cache.invalidate(path)
+
+
+@timed("mkdir")
 def do_mkdir(path):
-    os.mkdir(path)
+    _invalidate_stat(path)
+    _call_at(os.mkdir, path)
 
 
+@timed("rmdir")
 def do_rmdir(path):
+    _invalidate_stat(path)
+    _invalidate_dir_fds(path)
     try:
-        os.rmdir(path)
+        _call_at(os.rmdir, path)
     except OSError as err:
         raise SwiftOnFileSystemOSError(
             err.errno, '%s, os.rmdir("%s")' % (err.strerror, path)
         )
 
 
+@timed("chown")
 def do_chown(path, uid, gid):
     try:
         os.chown(path, uid, gid)
@@ -139,6 +517,7 @@ def do_chown(path, uid, gid):
         )
 
 
+@timed("fchown")
 def do_fchown(fd, uid, gid):  # pragma: no cover
     try:
         os.fchown(fd, uid, gid)
@@ -151,16 +530,146 @@ def do_fchown(fd, uid, gid):  # pragma: no cover
 _STAT_ATTEMPTS = 10
 
 
-def do_stat(path):
+class StatCache:
+    """
+    Short lived cache of the stat of paths, including negative entries for
+    the paths that don't exist, so that repeated lookups of missing or
+    unchanged paths don't reach the filesystem. Entries are invalidated by the
+    changes made through fs_utils in this process only: changes made by other
+    workers or outside of Swift are seen once the entry expires.
+
+    :param ttl: seconds an entry is used, 0 disables the cache
+    :param device_ttls: optional dict of ttl by device path, overriding ttl
+    :param size: maximum number of entries
+    :param logger: optional logger, stat_cache.{hits,misses} are incremented
+                   on it
+    """
+
+    def __init__(self, ttl, device_ttls=None, size=10000, logger=None):
+        self.ttl = ttl
+        self.device_ttls = dict(
+            (path.rstrip(os.path.sep) + os.path.sep, ttl)
+            for path, ttl in (device_ttls or {}).items()
+        )
+        self.size = size
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def _count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+        if self.logger:
+            self.logger.increment("stat_cache.%s" % name)
+
+    def _ttl(self, path):
+        for device_path, ttl in self.device_ttls.items():
+            if path.startswith(device_path):
+                return ttl
+        return self.ttl
+
+    def get(self, path):
+        """
+        Return (True, stat) if the stat of path is cached, stat being None if
+        the path doesn't exist, else (False, None).
+        """
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] > time.monotonic():
+            self._count("hits")
+            return True, entry[1]
+        if entry is not None:
+            del self._entries[path]
+        self._count("misses")
+        return False, None
+
+    def set(self, path, stats):
+        ttl = self._ttl(path)
+        if ttl <= 0:
+            return
+        self._entries[path] = (time.monotonic() + ttl, stats)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, path):
+        self._entries.pop(path, None)
+
+
+# StatCache of do_stat(path, cached=True) and do_open(..., cached=True), set
+# by the object server
+stat_cache = None
+
+
+def _invalidate_stat(*paths):
+    cache = stat_cache
+    if cache is not None:
+        for path in paths:
+            cache.invalidate(path)
+
+
+def get_cached_stat(path):
+    """
+    Return (True, stat) if the stat of path is cached, stat being None if the
+    path doesn't exist, else (False, None). Never calls stat().
+    """
+    cache = stat_cache
+    if cache is None:
+        return False, None
+    return cache.get(path)
+
+
+def invalidate_cached_parents(path):
+    """
+    Drop the cached stats of the directories above path, as when a call on
+    path failed with ENOENT: one of them was removed meanwhile.
+    """
+    cache = stat_cache
+    if cache is not None:
+        parent = os.path.dirname(path)
+        while parent != os.path.dirname(parent):
+            cache.invalidate(parent)
+            parent = os.path.dirname(parent)
+
+
+def set_cached_stat(path, stats):
+    """
+    Cache the stat of path, None if it doesn't exist.
+    """
+    cache = stat_cache
+    if cache is not None:
+        cache.set(path, stats)
+
+
+def do_stat(path, cached=False):
+    """
+    stat() a path, returning None if it doesn't exist.
+
+    :param cached: use and fill the stat cache
+    """
+    cache = stat_cache if cached else None
+    if cache is not None:
+        found, stats = cache.get(path)
+        if found:
+            return stats
+    stats = _do_stat(path)
+    if cache is not None:
+        cache.set(path, stats)
+    return stats
+
+
+@timed("stat")
+def _do_stat(path):
     serr = None
     for i in range(0, _STAT_ATTEMPTS):
         try:
-            stats = os.stat(path)
+            stats = _call_at(os.stat, path)
         except OSError as err:
             if err.errno == errno.EIO:
                 # Retry EIO assuming it is a transient error from FUSE after a
                 # short random sleep
                 serr = err
+                if syscall_stats is not None:
+                    syscall_stats.increment("stat", path, "eio_retries")
                 sleep(random.uniform(0.001, 0.005))
                 continue
             if err.errno == errno.ENOENT:
@@ -185,6 +694,7 @@ def do_stat(path):
         )
 
 
+@timed("fstat")
 def do_fstat(fd):
     try:
         stats = os.fstat(fd)
@@ -195,20 +705,37 @@ def do_fstat(fd):
     return stats
 
 
-def do_open(path, flags, mode=0o777):
+@timed("open")
+def do_open(path, flags, mode=0o777, cached=False):
+    """
+    :param cached: fail at once with ENOENT if the stat cache knows the path
+                   doesn't exist, and cache it when it is not found
+    """
+    cache = stat_cache if cached else None
+    if cache is not None and cache.get(path) == (True, None):
+        raise SwiftOnFileSystemOSError(
+            errno.ENOENT,
+            '%s, os.open("%s") [cached]' % (os.strerror(errno.ENOENT), path),
+        )
+    if flags & os.O_CREAT:
+        _invalidate_stat(path)
     try:
-        fd = os.open(path, flags, mode)
+        fd = _call_at(os.open, path, flags, mode)
     except OSError as err:
+        if cache is not None and err.errno == errno.ENOENT:
+            cache.set(path, None)
         raise SwiftOnFileSystemOSError(
             err.errno, '%s, os.open("%s", %x, %o)' % (err.strerror, path, flags, mode)
         )
     return fd
 
 
+@timed("dup")
 def do_dup(fd):
     return os.dup(fd)
 
 
+@timed("close")
 def do_close(fd):
     try:
         os.close(fd)
@@ -223,9 +750,11 @@ def do_close(fd):
             )
 
 
+@timed("unlink")
 def do_unlink(path, log=True):
+    _invalidate_stat(path)
     try:
-        os.unlink(path)
+        _call_at(os.unlink, path)
     except OSError as err:
         if err.errno != errno.ENOENT:
             raise SwiftOnFileSystemOSError(
@@ -235,15 +764,52 @@ def do_unlink(path, log=True):
             logging.warn("fs_utils: os.unlink failed on non-existent path: %s", path)
 
 
+@timed("unlinkat", path_arg=2)
+def do_unlinkat(dir_fd, name, path):
+    """
+    Unlink name relative to the directory fd dir_fd, path being its full
+    path. A missing file is ignored.
+    """
+    _invalidate_stat(path)
+    try:
+        os.unlink(name, dir_fd=dir_fd)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise SwiftOnFileSystemOSError(
+                err.errno, '%s, os.unlink("%s")' % (err.strerror, path)
+            )
+
+
+@timed("rmdirat", path_arg=2)
+def do_rmdirat(dir_fd, name, path):
+    """
+    Remove the empty directory name relative to the directory fd dir_fd,
+    path being its full path.
+    """
+    _invalidate_stat(path)
+    _invalidate_dir_fds(path)
+    try:
+        os.rmdir(name, dir_fd=dir_fd)
+    except OSError as err:
+        raise SwiftOnFileSystemOSError(
+            err.errno, '%s, os.rmdir("%s")' % (err.strerror, path)
+        )
+
+
+@timed("rename")
 def do_rename(old_path, new_path):
+    _invalidate_stat(old_path, new_path)
+    _invalidate_dir_fds(old_path)
+    _invalidate_dir_fds(new_path)
     try:
-        os.rename(old_path, new_path)
+        _rename_at(old_path, new_path)
     except OSError as err:
         raise SwiftOnFileSystemOSError(
             err.errno, '%s, os.rename("%s", "%s")' % (err.strerror, old_path, new_path)
         )
 
 
+@timed("fsync")
 def do_fsync(fd):
     try:
         os.fsync(fd)
@@ -253,6 +819,7 @@ def do_fsync(fd):
         )
 
 
+@timed("fdatasync")
 def do_fdatasync(fd):
     try:
         os.fdatasync(fd)
@@ -267,6 +834,7 @@ def do_fdatasync(fd):
 _posix_fadvise = None
 
 
+@timed("fadvise64")
 def do_fadvise64(fd, offset, length):
     global _posix_fadvise
     if _posix_fadvise is None:
@@ -275,6 +843,7 @@ def do_fadvise64(fd, offset, length):
     _posix_fadvise(fd, ctypes.c_uint64(offset), ctypes.c_uint64(length), 4)
 
 
+@timed("lseek")
 def do_lseek(fd, pos, how):
     try:
         os.lseek(fd, pos, how)
@@ -0,0 +1,124 @@
+""" Sampling profiler writing collapsed stacks, for production processes """
+
+import logging
+import os
+import random
+import signal
+import time
+from collections import defaultdict
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of the main thread of a process. A SIGPROF timer
+    samples its stack every interval seconds of CPU time, and the number of
+    samples of each stack is written to a file in the collapsed format of
+    flamegraph.pl and speedscope: one line per stack, with the frames from
+    the outermost separated by ";", followed by the number of samples.
+
+    Each profile covers duration seconds and is written at the first sample
+    after it elapsed, to <output_dir>/<name>-<pid>-<time>.collapsed. Either a
+    single profile is taken, on demand, or profiles are taken one after the
+    other.
+
+    Samples are only taken while the process uses CPU, and the cost of a
+    sample is that of walking the stack, so the overhead stays low at the
+    default interval of 10ms.
+
+    :param output_dir: directory of the profiles
+    :param name: name of the process, prefix of the profiles
+    :param interval: seconds of CPU time between two samples
+    :param duration: seconds covered by a profile
+    :param fraction: fraction of the processes profiled all the time, see
+                     attach()
+    """
+
+    def __init__(self, output_dir, name, interval=0.01, duration=60, fraction=0):
+        self.output_dir = output_dir
+        self.name = name
+        self.interval = interval
+        self.duration = duration
+        self.fraction = fraction
+        self.running = False
+        self._continuous = False
+        self._deadline = None
+        self._samples = defaultdict(int)
+        self._pid = None
+
+    def attach(self):
+        """
+        Start profiling all the time with a probability of fraction, once per
+        process: called by each request of the object server workers.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._pid = pid
+        if random.random() < self.fraction:
+            self.start(continuous=True)
+
+    def install_signal(self, signum=signal.SIGUSR2):
+        """
+        Toggle profiling with signum: a profile is taken until the signal
+        is received again or duration elapsed.
+        """
+        signal.signal(signum, self._toggle)
+
+    def _toggle(self, signum, frame):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self, continuous=False):
+        if self.running:
+            return
+        self.running = True
+        self._continuous = continuous
+        self._samples = defaultdict(int)
+        self._deadline = time.monotonic() + self.duration
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        """Stop profiling and write the profile, whose path is returned."""
+        if not self.running:
+            return None
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        self.running = False
+        return self._write(self._take_samples())
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("%s:%s" % (code.co_filename, code.co_name))
+            frame = frame.f_back
+        self._samples[";".join(reversed(stack))] += 1
+        if time.monotonic() >= self._deadline:
+            if self._continuous:
+                self._write(self._take_samples())
+                self._deadline = time.monotonic() + self.duration
+            else:
+                self.stop()
+
+    def _take_samples(self):
+        samples, self._samples = self._samples, defaultdict(int)
+        return samples
+
+    def _write(self, samples):
+        path = os.path.join(
+            self.output_dir,
+            "%s-%d-%s.collapsed"
+            % (self.name, os.getpid(), time.strftime("%Y%m%dT%H%M%S")),
+        )
+        try:
+            with open(path, "w") as f:
+                for stack, count in sorted(samples.items()):
+                    f.write("%s %d\n" % (stack, count))
+        except OSError as err:
+            logging.error("Could not write the profile %s: %s", path, err)
+            return None
+        logging.info("Profile of %d samples written to %s", sum(samples.values()), path)
+        return path
@@ -0,0 +1,275 @@
+""" Object metadata cache shared by the workers of the object server """
+
+import errno
+import fcntl
+import json
+import mmap
+import os
+import struct
+
+from eventlet import patcher
+
+_threading = patcher.original("threading")
+
+MAGIC = b"SOFMDC\0\0"
+VERSION = 1
+# Number of slots of a set: an entry can only be stored in one of the slots of
+# the set its (st_dev, st_ino) hashes to
+WAYS = 8
+DEFAULT_SLOT_SIZE = 4096
+
+# magic, version, number of slots, slot size
+HEADER = struct.Struct("<8sIII")
+HEADER_SIZE = 64
+# Clock hand of a set
+HAND = struct.Struct("<I")
+# seq, st_dev, st_ino, st_mtime_ns, st_ctime_ns, st_size, referenced, length
+# of the serialized metadata following the slot header
+SLOT = struct.Struct("<QQQqqqII")
+SEQ = struct.Struct("<Q")
+REF = struct.Struct("<I")
+REF_OFFSET = 48
+
+
+class SharedMetadataCache:
+    """
+    Cache of the metadata of files and directories shared by the worker
+    processes, stored in a memory mapped file (in /dev/shm). It has the same
+    interface as :class:`swiftonfile.swift.common.utils.MetadataCache`.
+
+    The file is a hash table of fixed size slots, grouped in sets of WAYS
+    slots. An entry is keyed by (st_dev, st_ino) and is only valid while the
+    (st_mtime_ns, st_ctime_ns, st_size) of the file are unchanged. The
+    metadata as stored is not shared: get_stored() returns it as unknown.
+
+    Readers take no lock. Each slot has a sequence number, odd while the slot
+    is written, and a reader misses if the sequence number was odd or changed
+    during its read. Writers of a set hold a fcntl lock on a byte
+    of the file, and before it a lock of the set in the process, since fcntl
+    locks do not exclude the threads of a process (the eventlet thread pool).
+    They never wait for them: an entry is simply not cached when a lock is
+    held by another worker or thread. When a set is full, the entry to
+    replace is chosen by the clock algorithm.
+
+    :param path: path of the file, created if needed
+    :param size: number of entries, rounded up to a multiple of WAYS
+    :param slot_size: size of a slot in bytes, metadata larger than the slot
+                      is not cached
+    :param logger: optional logger, metadata_cache.{hits,misses,evictions}
+                   are incremented on it
+    """
+
+    def __init__(self, path, size, slot_size=DEFAULT_SLOT_SIZE, logger=None):
+        self.path = path
+        self.nsets = max(1, -(-size // WAYS))
+        self.size = self.nsets * WAYS
+        self.slot_size = slot_size
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._slots_offset = HEADER_SIZE + (
+            -(-(self.nsets * HAND.size) // HEADER_SIZE) * HEADER_SIZE
+        )
+        self._file_size = self._slots_offset + self.size * slot_size
+        self._fd = None
+        self._mmap = None
+        self._locks = [_threading.Lock() for _ in range(self.nsets)]
+        self._open()
+
+    def _open(self):
+        """
+        Map the cache file, creating it if needed. A file created with another
+        geometry is replaced: workers still using it keep their mapping of the
+        unlinked file.
+        """
+        header = HEADER.pack(MAGIC, VERSION, self.size, self.slot_size)
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.stat(self.path).st_ino != os.fstat(fd).st_ino:
+                        # Replaced by another worker meanwhile
+                        continue
+                except FileNotFoundError:
+                    continue
+                file_size = os.fstat(fd).st_size
+                if file_size == 0:
+                    os.ftruncate(fd, self._file_size)
+                    os.pwrite(fd, header, 0)
+                elif (
+                    file_size != self._file_size
+                    or os.pread(fd, HEADER.size, 0) != header
+                ):
+                    os.unlink(self.path)
+                    continue
+                self._mmap = mmap.mmap(fd, self._file_size)
+                self._fd, fd = fd, None
+                return
+            finally:
+                if fd is not None:
+                    os.close(fd)
+                else:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+        if self.logger:
+            self.logger.increment("metadata_cache.%s" % name)
+
+    def _set_index(self, key):
+        return hash(key) % self.nsets
+
+    def _slot_offsets(self, set_index):
+        first = self._slots_offset + set_index * WAYS * self.slot_size
+        return range(first, first + WAYS * self.slot_size, self.slot_size)
+
+    def get(self, stats):
+        """
+        Return the cached metadata of a file, or None.
+
+        :param stats: current stat of the file
+        """
+        key = (stats.st_dev, stats.st_ino)
+        version = (stats.st_mtime_ns, stats.st_ctime_ns, stats.st_size)
+        mm = self._mmap
+        for offset in self._slot_offsets(self._set_index(key)):
+            seq, dev, ino, mtime, ctime, size, ref, length = SLOT.unpack_from(
+                mm, offset
+            )
+            if (dev, ino) != key:
+                continue
+            if seq & 1 or (mtime, ctime, size) != version:
+                break
+            data = mm[offset + SLOT.size : offset + SLOT.size + length]
+            if SEQ.unpack_from(mm, offset)[0] != seq:
+                # Written meanwhile
+                break
+            if not ref:
+                REF.pack_into(mm, offset + REF_OFFSET, 1)
+            self._count("hits")
+            return json.loads(data)
+        self._count("misses")
+        return None
+
+    def get_stored(self, stats):
+        """
+        Return the cached metadata of a file and None, the metadata as stored
+        being unknown, or None.
+
+        :param stats: current stat of the file
+        """
+        metadata = self.get(stats)
+        if metadata is None:
+            return None
+        return metadata, None
+
+    def _lock(self, set_index):
+        lock = self._locks[set_index]
+        if not lock.acquire(False):
+            return False
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, set_index)
+        except BaseException as err:
+            lock.release()
+            if isinstance(err, OSError) and err.errno in (errno.EAGAIN, errno.EACCES):
+                return False
+            raise
+        return True
+
+    def _unlock(self, set_index):
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, set_index)
+        finally:
+            self._locks[set_index].release()
+
+    def _write_slot(self, offset, fields, data=b""):
+        mm = self._mmap
+        seq = SEQ.unpack_from(mm, offset)[0] | 1
+        SEQ.pack_into(mm, offset, seq)
+        SLOT.pack_into(mm, offset, seq, *fields, len(data))
+        mm[offset + SLOT.size : offset + SLOT.size + len(data)] = data
+        SEQ.pack_into(mm, offset, seq + 1)
+
+    def _find_slot(self, set_index, key):
+        """
+        Return the offset of the slot of key in its set, else of a free slot,
+        else of the slot chosen by the clock.
+        """
+        mm = self._mmap
+        free = None
+        for offset in self._slot_offsets(set_index):
+            dev, ino = SLOT.unpack_from(mm, offset)[1:3]
+            if (dev, ino) == key:
+                return offset
+            if free is None and not ino:
+                free = offset
+        if free is not None:
+            return free
+        hand_offset = HEADER_SIZE + set_index * HAND.size
+        hand = HAND.unpack_from(mm, hand_offset)[0]
+        offsets = self._slot_offsets(set_index)
+        while True:
+            offset = offsets[hand % WAYS]
+            hand = (hand + 1) % WAYS
+            if REF.unpack_from(mm, offset + REF_OFFSET)[0]:
+                REF.pack_into(mm, offset + REF_OFFSET, 0)
+            else:
+                HAND.pack_into(mm, hand_offset, hand)
+                self._count("evictions")
+                return offset
+
+    def set(self, stats, metadata, stored=None):
+        """
+        Cache the metadata of a file, unless the set of the file is being
+        written by another worker or the metadata does not fit in a slot.
+
+        :param stats: stat of the file, taken after the metadata was written
+                      or before it was read
+        :param stored: metadata as stored, not cached
+        """
+        data = json.dumps(metadata, separators=(",", ":")).encode("utf-8")
+        if len(data) > self.slot_size - SLOT.size:
+            return
+        key = (stats.st_dev, stats.st_ino)
+        set_index = self._set_index(key)
+        if not self._lock(set_index):
+            return
+        try:
+            offset = self._find_slot(set_index, key)
+            self._write_slot(
+                offset,
+                (
+                    stats.st_dev,
+                    stats.st_ino,
+                    stats.st_mtime_ns,
+                    stats.st_ctime_ns,
+                    stats.st_size,
+                    1,
+                ),
+                data,
+            )
+        finally:
+            self._unlock(set_index)
+
+    def invalidate(self, stats):
+        key = (stats.st_dev, stats.st_ino)
+        set_index = self._set_index(key)
+        if not self._lock(set_index):
+            # The entry is still checked against the stat of the file
+            return
+        try:
+            for offset in self._slot_offsets(set_index):
+                if SLOT.unpack_from(self._mmap, offset)[1:3] == key:
+                    self._write_slot(offset, (0, 0, 0, 0, 0, 0))
+        finally:
+            self._unlock(set_index)
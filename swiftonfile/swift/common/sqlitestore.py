@@ -0,0 +1,167 @@
+""" Object metadata stored in SQLite databases instead of xattrs """
+
+import errno
+import os
+from collections import OrderedDict
+from contextlib import closing
+
+from swift.common.db import get_db_connection
+from swift.common.utils import mkdirs
+
+from swiftonfile.swift.common.fs_utils import (
+    do_fstat,
+    do_stat,
+    get_filename_from_fd,
+)
+from swiftonfile.swift.common.utils import (
+    MetadataStore,
+    deserialize_metadata,
+    serialize_metadata,
+)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS metadata (
+        path TEXT PRIMARY KEY,
+        ino INTEGER NOT NULL,
+        metadata BLOB NOT NULL
+    )
+"""
+
+
+class SqliteMetadataStore(MetadataStore):
+    """
+    Metadata of the files and directories of a device stored in SQLite
+    databases, for filesystems where xattrs are slow or size limited. Each
+    container has its own database, in WAL mode, where the metadata is keyed
+    by the path of the file relative to the container. The metadata of
+    accounts and containers is in a database per account.
+
+    An entry is only valid for the inode it was written for: as with xattrs,
+    a file replaced outside of Swift has no metadata. Files modified in place
+    keep their metadata, which validate_object() finds stale.
+
+    :param device_path: path of the device
+    :param db_dir: directory of the databases, preferably on a local disk
+    :param max_connections: number of databases kept open
+    :param timeout: seconds to wait for a database locked by another worker
+    """
+
+    def __init__(self, device_path, db_dir, max_connections=64, timeout=25):
+        self.device_path = device_path.rstrip(os.path.sep) + os.path.sep
+        self.db_dir = db_dir
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._connections = OrderedDict()
+
+    def _locate(self, path_or_fd):
+        """
+        Return the path of the database of a file and the key of the file in
+        this database.
+        """
+        if isinstance(path_or_fd, int):
+            path = get_filename_from_fd(path_or_fd)
+            if path is None:
+                raise IOError(
+                    errno.ENOENT, "Could not find the path of fd %d" % path_or_fd
+                )
+        else:
+            path = os.path.normpath(path_or_fd)
+        if not path.startswith(self.device_path):
+            raise IOError(errno.ENOENT, "%s is not on %s" % (path, self.device_path))
+        parts = path[len(self.device_path) :].split(os.path.sep, 2)
+        if len(parts) == 1:
+            return os.path.join(self.db_dir, parts[0] + ".db"), ""
+        db_path = os.path.join(self.db_dir, parts[0], parts[1] + ".db")
+        return db_path, parts[2] if len(parts) == 3 else ""
+
+    def _connect(self, db_path):
+        conn = self._connections.get(db_path)
+        if conn is not None:
+            self._connections.move_to_end(db_path)
+            return conn
+        mkdirs(os.path.dirname(db_path))
+        conn = get_db_connection(db_path, self.timeout, okay_to_create=True)
+        with closing(conn.cursor()) as cur:
+            cur.execute("PRAGMA journal_mode = WAL")
+            cur.execute(SCHEMA)
+        conn.commit()
+        self._connections[db_path] = conn
+        while len(self._connections) > self.max_connections:
+            self._connections.popitem(last=False)[1].close()
+        return conn
+
+    def _stat(self, path_or_fd):
+        if isinstance(path_or_fd, int):
+            return do_fstat(path_or_fd)
+        stats = do_stat(path_or_fd)
+        if not stats:
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path_or_fd)
+        return stats
+
+    def _delete(self, conn, key):
+        conn.execute("DELETE FROM metadata WHERE path = ?", (key,))
+        conn.commit()
+
+    def read(self, path_or_fd, stats=None):
+        if stats is None:
+            stats = self._stat(path_or_fd)
+        db_path, key = self._locate(path_or_fd)
+        conn = self._connect(db_path)
+        row = conn.execute(
+            "SELECT ino, metadata FROM metadata WHERE path = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return {}
+        metadata = deserialize_metadata(row["metadata"])
+        if row["ino"] != stats.st_ino or not metadata:
+            self._delete(conn, key)
+            return {}
+        return metadata
+
+    def write(self, path_or_fd, metadata, stored=None):
+        assert isinstance(metadata, dict)
+        stats = self._stat(path_or_fd)
+        db_path, key = self._locate(path_or_fd)
+        conn = self._connect(db_path)
+        conn.execute(
+            "INSERT OR REPLACE INTO metadata (path, ino, metadata) VALUES (?, ?, ?)",
+            (key, stats.st_ino, serialize_metadata(metadata)),
+        )
+        conn.commit()
+
+    def clean(self, path_or_fd):
+        db_path, key = self._locate(path_or_fd)
+        self._delete(self._connect(db_path), key)
+
+    def renamed(self, src, dst):
+        src_db_path, src_key = self._locate(src)
+        dst_db_path, dst_key = self._locate(dst)
+        src_conn = self._connect(src_db_path)
+        if src_db_path == dst_db_path:
+            src_conn.execute("DELETE FROM metadata WHERE path = ?", (dst_key,))
+            src_conn.execute(
+                "UPDATE metadata SET path = ? WHERE path = ?", (dst_key, src_key)
+            )
+            src_conn.commit()
+            return
+        row = src_conn.execute(
+            "SELECT ino, metadata FROM metadata WHERE path = ?", (src_key,)
+        ).fetchone()
+        dst_conn = self._connect(dst_db_path)
+        if row is None:
+            self._delete(dst_conn, dst_key)
+        else:
+            dst_conn.execute(
+                "INSERT OR REPLACE INTO metadata (path, ino, metadata) "
+                "VALUES (?, ?, ?)",
+                (dst_key, row["ino"], row["metadata"]),
+            )
+            dst_conn.commit()
+            self._delete(src_conn, src_key)
+
+    def unlinked(self, path):
+        self.clean(path)
+
+    def close(self):
+        while self._connections:
+            self._connections.popitem()[1].close()
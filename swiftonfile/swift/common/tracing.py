@@ -0,0 +1,327 @@
+""" Tracing of the object server requests as spans written to NDJSON files """
+
+import json
+import logging
+import os
+import socket
+import time
+from contextlib import nullcontext
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+from eventlet import corolocal, spawn_after
+from swift.common.utils import md5
+
+_NO_SPAN = nullcontext()
+
+SPAN_KIND_SERVER = "SPAN_KIND_SERVER"
+SPAN_KIND_INTERNAL = "SPAN_KIND_INTERNAL"
+
+
+def _attribute(key, value):
+    """Return an attribute in the OTLP JSON encoding."""
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Span:
+    """
+    A timed operation of a traced request. Used as a context manager, it is
+    the current span of the green thread until it exits, the parent of the
+    spans started meanwhile.
+    """
+
+    def __init__(self, tracer, trace_id, parent_id, name, kind, attributes):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.start_time = time.time_ns()
+        self.end_time = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        """Record the end of the span, only the first call counts."""
+        if self.end_time is None:
+            self.end_time = time.time_ns()
+            self.tracer.export(self, error)
+
+    def __enter__(self):
+        self.tracer._stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack = self.tracer._stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        self.end(exc_value)
+
+
+class _ResponseIterable:
+    """
+    Response of a traced request, whose root span ends when the server
+    closes it, after the body is sent.
+    """
+
+    def __init__(self, app_iter, tracer, root):
+        self.app_iter = app_iter
+        self.tracer = tracer
+        self.root = root
+
+    def __iter__(self):
+        return iter(self.app_iter)
+
+    def close(self):
+        try:
+            close = getattr(self.app_iter, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self.tracer._local.stack = []
+            self.root.end()
+
+
+class Tracer:
+    """
+    Traces a sample of the requests as a tree of spans: a root span for the
+    request and a span for each step of interest (DiskFile phases, container
+    updates). Spans are written to a rotating file, one JSON object per line
+    with the fields of the OTLP JSON encoding of a span.
+
+    A rotating file can't be shared by processes, so each worker writes to
+    its own file: path with the pid of the worker before its extension,
+    opened by the first span of the worker. The spans are buffered and
+    written in one write, on the hub, once buffer_spans spans are buffered
+    or flush_interval seconds after the first one.
+
+    The trace id is derived from the Swift transaction id, so the spans of a
+    transaction are linked across servers. Sampling is decided when a request
+    starts, from the trace id: every server traces the same transactions.
+
+    :param path: path of the trace file
+    :param sample_rate: fraction of the transactions traced
+    :param max_bytes: size of the trace file before it is rotated
+    :param backups: number of rotated files kept
+    :param service: service.name of the spans
+    :param buffer_spans: number of spans buffered before they are written
+    :param flush_interval: seconds a span is buffered at most
+    """
+
+    def __init__(
+        self,
+        path,
+        sample_rate=1.0,
+        max_bytes=100 * 1024 * 1024,
+        backups=5,
+        service="object-server",
+        buffer_spans=256,
+        flush_interval=1.0,
+    ):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.service = service
+        self.buffer_spans = buffer_spans
+        self.flush_interval = flush_interval
+        self._local = corolocal.local()
+        # Trace file of the worker, see _open()
+        self.worker_path = None
+        self._pid = None
+        self._handler = None
+        self._resource = None
+        self._buffer = []
+        self._flush_timer = None
+
+    def _open(self):
+        """
+        Open the trace file of the current process, if not already done.
+        Workers are forked after the tracer is created: the state inherited
+        from the parent is dropped.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._pid = pid
+        self._buffer = []
+        self._flush_timer = None
+        root, ext = os.path.splitext(self.path)
+        self.worker_path = "%s.%d%s" % (root, pid, ext)
+        self._handler = RotatingFileHandler(
+            self.worker_path,
+            maxBytes=self.max_bytes,
+            backupCount=self.backups,
+            delay=True,
+        )
+        self._resource = {
+            "attributes": [
+                _attribute("service.name", self.service),
+                _attribute("host.name", socket.gethostname()),
+                _attribute("process.pid", pid),
+            ]
+        }
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def sampled(self, trace_id):
+        return int(trace_id[:8], 16) < self.sample_rate * 0x100000000
+
+    def current_span(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def span(self, name, attributes=None):
+        """
+        Return a child span of the current span to use as a context manager,
+        or a null context if the request isn't traced.
+        """
+        parent = self.current_span()
+        if parent is None:
+            return _NO_SPAN
+        return Span(
+            self,
+            parent.trace_id,
+            parent.span_id,
+            name,
+            SPAN_KIND_INTERNAL,
+            attributes or {},
+        )
+
+    def request(self, env, start_response, app):
+        """Call the WSGI app, tracing the request if it is sampled."""
+        trans_id = env.get("HTTP_X_TRANS_ID")
+        if trans_id:
+            trace_id = md5(trans_id.encode(), usedforsecurity=False).hexdigest()
+        else:
+            trace_id = os.urandom(16).hex()
+        if not self.sampled(trace_id):
+            return app(env, start_response)
+        root = Span(
+            self,
+            trace_id,
+            None,
+            env["REQUEST_METHOD"],
+            SPAN_KIND_SERVER,
+            {
+                "http.method": env["REQUEST_METHOD"],
+                "http.target": env.get("PATH_INFO", ""),
+                "swift.trans_id": trans_id or "",
+            },
+        )
+        self._local.stack = [root]
+
+        def traced_start_response(status, headers, *args):
+            root.set("http.status_code", int(status.split(" ", 1)[0]))
+            return start_response(status, headers, *args)
+
+        try:
+            app_iter = app(env, traced_start_response)
+        except BaseException as err:
+            self._local.stack = []
+            root.end(err)
+            raise
+        return _ResponseIterable(app_iter, self, root)
+
+    def export(self, span, error=None):
+        self._open()
+        record = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or "",
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start_time),
+            "endTimeUnixNano": str(span.end_time),
+            "attributes": [_attribute(k, v) for k, v in span.attributes.items()],
+            "status": {"code": "STATUS_CODE_UNSET"},
+            "resource": self._resource,
+        }
+        if error is not None:
+            record["status"] = {
+                "code": "STATUS_CODE_ERROR",
+                "message": "%s: %s" % (type(error).__name__, error),
+            }
+        self._buffer.append(json.dumps(record))
+        if len(self._buffer) >= self.buffer_spans:
+            self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = spawn_after(self.flush_interval, self.flush)
+
+    def flush(self):
+        """Write the buffered spans to the trace file."""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._pid != os.getpid() or not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        self._handler.handle(
+            logging.makeLogRecord({"msg": "\n".join(lines), "levelno": logging.INFO})
+        )
+
+    def close(self):
+        self.flush()
+        if self._handler is not None:
+            self._handler.close()
+
+
+# Tracer of the object server, None when tracing is disabled
+tracer = None
+
+
+def span(name, **attributes):
+    """
+    Context manager timing a step of the current request as a span, doing
+    nothing if the request isn't traced.
+    """
+    if tracer is None:
+        return _NO_SPAN
+    return tracer.span(name, attributes)
+
+
+def start_span(name, **attributes):
+    """
+    Return a child span of the current span, not made current, to end()
+    explicitly, or None if the request isn't traced. For steps spanning
+    several calls, like the reading of an object.
+    """
+    if tracer is None or tracer.current_span() is None:
+        return None
+    return tracer.span(name, attributes)
+
+
+def traced(name):
+    """Decorator tracing the calls of a function as spans."""
+
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if tracer is None:
+                return func(*args, **kwargs)
+            with tracer.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def traced_request(env, start_response, app):
+    """Call the WSGI app, tracing the request if tracing is enabled."""
+    if tracer is None:
+        return app(env, start_response)
+    return tracer.request(env, start_response, app)
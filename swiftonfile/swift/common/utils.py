@@ -22,6 +22,9 @@ import random
 import logging
 import pwd
 import grp
+import struct
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from hashlib import md5
 from eventlet import sleep
 import pickle
@@ -32,12 +35,15 @@ from swift.common.exceptions import DiskFileNoSpace
 from swift.common.db import native_str_keys_and_values
 from swiftonfile.swift.common.fs_utils import (
     do_stat,
-    do_walk,
+    do_scandir,
     do_rmdir,
+    do_rmdirat,
     do_log_rl,
     get_filename_from_fd,
     do_open,
     do_getxattr,
+    do_getxattr_into,
+    do_listxattr,
     do_setxattr,
     do_removexattr,
     do_read,
@@ -58,7 +64,13 @@ X_OBJECT_TYPE = "X-Object-Type"
 X_MTIME = "X-Object-PUT-Mtime"
 DIR_TYPE = "application/directory"
 METADATA_KEY = "user.swift.metadata"
+# "keys" metadata layout: system metadata serialized in METADATA_SYS_KEY, and
+# each user metadata key in its own xattr
+METADATA_SYS_KEY = "user.swift.sys"
+METADATA_USER_KEY_PREFIX = "user.swift.meta."
+USER_METADATA_PREFIX = "X-Object-Meta-"
 MAX_XATTR_SIZE = 65536
+MAX_XATTR_NAME_SIZE = 255
 DIR_NON_OBJECT = "dir"
 DIR_OBJECT = "marker_dir"
 FILE = "file"
@@ -68,8 +80,52 @@ DEFAULT_UID = -1
 DEFAULT_GID = -1
 PICKLE_PROTOCOL = 2
 CHUNK_SIZE = 65536
+LUSTRE_LOV_KEY = "lustre.lov"
+LOV_USER_MAGIC_V1 = 0x0BD10BD0
+LOV_USER_MAGIC_V3 = 0x0BD30BD0
+# struct lov_user_md: lmm_magic, lmm_pattern, lmm_oi, lmm_stripe_size,
+# lmm_stripe_count
+LOV_USER_MD_FORMAT = "<II16sIH"
+# Binary metadata format: magic, version and, from version 2, the number of
+# MAX_XATTR_SIZE chunks it is stored in, then for each item its key (a byte
+# indexing BINARY_METADATA_KEYS, or 0 followed by the length and the UTF-8 of
+# the key) and its typed value
+BINARY_METADATA_MAGIC = b"\x00SOF"
+BINARY_METADATA_VERSION = 2
+# Append only: the index of a key is stored in the metadata
+BINARY_METADATA_KEYS = (
+    None,
+    X_CONTENT_TYPE,
+    X_CONTENT_LENGTH,
+    X_TIMESTAMP,
+    X_TYPE,
+    X_ETAG,
+    X_OBJECT_TYPE,
+    X_MTIME,
+    "name",
+    "Content-Encoding",
+    "Content-Disposition",
+    "X-Delete-At",
+    "X-Object-Manifest",
+    "X-Static-Large-Object",
+)
+_BINARY_METADATA_KEY_IDS = dict(
+    (key, i) for i, key in enumerate(BINARY_METADATA_KEYS) if key
+)
 
 read_pickled_metadata = False
+# Format of the metadata written by write_metadata(), "json" or "binary", set
+# by the object server. Both formats are always read.
+metadata_format = "json"
+# Layout of the metadata written by write_metadata(), "blob" or "keys", set by
+# the object server. Both layouts are always read.
+metadata_layout = "blob"
+# MetadataStore of the devices whose metadata is not stored in xattrs, by
+# device path ending with a separator, set by the object server
+metadata_stores = {}
+# MetadataCache of read_metadata() and write_metadata(), set by the object
+# server
+metadata_cache = None
 REGEX_TMP_FILE = re.compile(r".*\.[0-9a-f]{32}\Z", re.I)
 
 
@@ -122,10 +178,130 @@ class SafeUnpickler:
 pickle.loads = SafeUnpickler.loads
 
 
-def serialize_metadata(metadata):
+def serialize_metadata(metadata, format=None):
+    if (format or metadata_format) == "binary":
+        return serialize_binary_metadata(metadata)
     return os.fsencode(json.dumps(metadata, separators=(",", ":")))
 
 
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+# Magic, version and number of chunks
+_BINARY_METADATA_HEADER_SIZE = len(BINARY_METADATA_MAGIC) + 1 + _U16.size
+
+
+def serialize_binary_metadata(metadata):
+    """
+    Serialize metadata in the binary format: strings are length prefixed
+    UTF-8, well-known keys are stored as one byte, and int, float, bool and
+    None values keep their type. Other values are stored as JSON. The header
+    records the number of chunks, for read_serialized_metadata() to read
+    them without listing the xattrs.
+    """
+    parts = []
+    append = parts.append
+    for key, value in metadata.items():
+        key_id = _BINARY_METADATA_KEY_IDS.get(key)
+        if key_id:
+            append(bytes((key_id,)))
+        else:
+            data = key.encode("utf-8", "surrogateescape")
+            append(b"\x00" + _U16.pack(len(data)) + data)
+        if isinstance(value, str):
+            data = value.encode("utf-8", "surrogateescape")
+            append(b"s" + _U32.pack(len(data)) + data)
+        elif value is None:
+            append(b"n")
+        elif value is True or value is False:
+            append(b"t" if value else b"F")
+        elif isinstance(value, int) and -(2**63) <= value < 2**63:
+            append(b"i" + _I64.pack(value))
+        elif isinstance(value, float):
+            append(b"f" + _F64.pack(value))
+        else:
+            data = json.dumps(value).encode("utf-8")
+            append(b"j" + _U32.pack(len(data)) + data)
+    length = _BINARY_METADATA_HEADER_SIZE + sum(map(len, parts))
+    parts.insert(
+        0,
+        BINARY_METADATA_MAGIC
+        + bytes((BINARY_METADATA_VERSION,))
+        + _U16.pack(-(-length // MAX_XATTR_SIZE)),
+    )
+    return b"".join(parts)
+
+
+def _binary_metadata_count(metastr):
+    """
+    Return the number of chunks recorded in the header of binary metadata,
+    None if the metadata is not binary or of version 1.
+    """
+    if (
+        metastr.startswith(BINARY_METADATA_MAGIC)
+        and len(metastr) >= _BINARY_METADATA_HEADER_SIZE
+        and metastr[len(BINARY_METADATA_MAGIC)] >= 2
+    ):
+        return _U16.unpack_from(metastr, len(BINARY_METADATA_MAGIC) + 1)[0]
+    return None
+
+
+def deserialize_binary_metadata(metastr):
+    """
+    Returns dict populated with metadata serialized in the binary format.
+    Raises ValueError if the metadata is invalid or truncated.
+    """
+    version = metastr[len(BINARY_METADATA_MAGIC)]
+    end = len(metastr)
+    if version == 1:
+        offset = len(BINARY_METADATA_MAGIC) + 1
+    elif version == BINARY_METADATA_VERSION:
+        offset = _BINARY_METADATA_HEADER_SIZE
+        if _binary_metadata_count(metastr) != -(-end // MAX_XATTR_SIZE):
+            raise ValueError("truncated metadata")
+    else:
+        raise ValueError("unknown metadata version")
+    metadata = {}
+    while offset < end:
+        key_id = metastr[offset]
+        if key_id:
+            key = BINARY_METADATA_KEYS[key_id]
+            offset += 1
+        else:
+            length = _U16.unpack_from(metastr, offset + 1)[0]
+            offset += 3 + length
+            key = metastr[offset - length : offset].decode("utf-8", "surrogateescape")
+        kind = metastr[offset]
+        offset += 1
+        if kind == 0x73:  # s
+            length = _U32.unpack_from(metastr, offset)[0]
+            offset += 4 + length
+            value = metastr[offset - length : offset].decode("utf-8", "surrogateescape")
+        elif kind == 0x6E:  # n
+            value = None
+        elif kind == 0x74:  # t
+            value = True
+        elif kind == 0x46:  # F
+            value = False
+        elif kind == 0x69:  # i
+            value = _I64.unpack_from(metastr, offset)[0]
+            offset += 8
+        elif kind == 0x66:  # f
+            value = _F64.unpack_from(metastr, offset)[0]
+            offset += 8
+        elif kind == 0x6A:  # j
+            length = _U32.unpack_from(metastr, offset)[0]
+            offset += 4 + length
+            value = json.loads(metastr[offset - length : offset])
+        else:
+            raise ValueError("unknown metadata value type %r" % kind)
+        metadata[key] = value
+    if offset != end:
+        raise ValueError("truncated metadata")
+    return metadata
+
+
 def deserialize_metadata(metastr):
     """
     Returns dict populated with metadata if deserializing is successful.
@@ -133,7 +309,16 @@ def deserialize_metadata(metastr):
     """
     global read_pickled_metadata
 
-    if type(metastr) is bytes:
+    if isinstance(metastr, (bytes, bytearray)) and metastr.startswith(
+        BINARY_METADATA_MAGIC
+    ):
+        try:
+            return deserialize_binary_metadata(metastr)
+        except (IndexError, UnicodeDecodeError, ValueError, struct.error):
+            logging.warning("Invalid binary metadata.", exc_info=True)
+            return {}
+
+    if isinstance(metastr, (bytes, bytearray)):
         start1 = b"\x80\x02}"
         end1 = b"."
         start2 = b"{"
@@ -164,80 +349,350 @@ def deserialize_metadata(metastr):
         return {}
 
 
-def read_metadata(path_or_fd):
+class MetadataCache:
+    """
+    Bounded LRU cache of the metadata of files and directories, keyed by
+    (st_dev, st_ino). An entry is only valid while the (st_mtime_ns,
+    st_ctime_ns, st_size) of the file are unchanged: as writing an xattr bumps
+    the ctime, an entry can't outlive a change of the metadata, even when made
+    by another process.
+
+    :param size: maximum number of entries
+    :param logger: optional logger, metadata_cache.{hits,misses,evictions}
+                   are incremented on it
     """
-    Helper function to read the serialized metadata from a File/Directory.
 
-    :param path_or_fd: File/Directory path or fd from which to read metadata.
+    def __init__(self, size, logger=None):
+        self.size = size
+        self.logger = logger
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def _count(self, name):
+        setattr(self, name, getattr(self, name) + 1)
+        if self.logger:
+            self.logger.increment("metadata_cache.%s" % name)
+
+    def get(self, stats):
+        """
+        Return a copy of the cached metadata of a file, or None.
+
+        :param stats: current stat of the file
+        """
+        entry = self.get_stored(stats)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def get_stored(self, stats):
+        """
+        Return a copy of the cached metadata of a file and the metadata as
+        stored, see read_metadata_stored(), or None.
+
+        :param stats: current stat of the file
+        """
+        key = (stats.st_dev, stats.st_ino)
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != (
+            stats.st_mtime_ns,
+            stats.st_ctime_ns,
+            stats.st_size,
+        ):
+            self._count("misses")
+            return None
+        self._entries.move_to_end(key)
+        self._count("hits")
+        return entry[1].copy(), entry[2]
+
+    def set(self, stats, metadata, stored=None):
+        """
+        Cache a copy of the metadata of a file.
+
+        :param stats: stat of the file, taken after the metadata was written
+                      or before it was read
+        :param stored: metadata as stored, None if unknown
+        """
+        key = (stats.st_dev, stats.st_ino)
+        self._entries[key] = (
+            (stats.st_mtime_ns, stats.st_ctime_ns, stats.st_size),
+            metadata.copy(),
+            stored,
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self._count("evictions")
+
+    def invalidate(self, stats):
+        self._entries.pop((stats.st_dev, stats.st_ino), None)
+
+
+def _stat_path_or_fd(path_or_fd):
+    if isinstance(path_or_fd, int):
+        return do_fstat(path_or_fd)
+    return do_stat(path_or_fd)
 
-    :returns: dictionary of metadata
+
+def read_serialized_metadata(path_or_fd):
     """
-    metastr = ""
-    key = 0
+    Read the serialized metadata of a File/Directory into a bytearray. The
+    first chunk is read with one getxattr() call. Only when it is full, the
+    number of chunks is taken from its header, or from listxattr() for JSON
+    and version 1 binary metadata, to size the buffer and read the other
+    chunks straight into it.
+    """
+    buf = bytearray(MAX_XATTR_SIZE)
+    length = 0
     try:
-        while True:
-            metastr += do_getxattr(path_or_fd, "%s%s" % (METADATA_KEY, (key or "")))
-            key += 1
-            if len(metastr) < MAX_XATTR_SIZE:
-                # Prevent further getxattr calls
-                break
+        length = do_getxattr_into(path_or_fd, METADATA_KEY, buf)
+        if length == MAX_XATTR_SIZE:
+            count = _binary_metadata_count(buf)
+            if count is None:
+                names = set(do_listxattr(path_or_fd))
+                count = 1
+                while "%s%d" % (METADATA_KEY, count) in names:
+                    count += 1
+            buf += bytes((count - 1) * MAX_XATTR_SIZE)
+            for key in range(1, count):
+                chunk_length = do_getxattr_into(
+                    path_or_fd, "%s%d" % (METADATA_KEY, key), buf, length
+                )
+                length += chunk_length
+                if chunk_length < MAX_XATTR_SIZE:
+                    # Trailing chunks of a former larger metadata
+                    break
     except IOError as err:
         if err.errno != errno.ENODATA:
             raise
+    del buf[length:]
+    return buf
 
-    if not metastr:
-        return {}
 
-    metadata = deserialize_metadata(metastr)
+def _is_blob_key(name):
+    return name.startswith(METADATA_KEY) and (
+        name == METADATA_KEY or name[len(METADATA_KEY) :].isdigit()
+    )
+
+
+def _is_keys_layout_key(name):
+    return name == METADATA_SYS_KEY or name.startswith(METADATA_USER_KEY_PREFIX)
+
+
+def _read_metadata_keys(path_or_fd):
+    """
+    Read the metadata of a File/Directory stored with the "keys" layout: the
+    system metadata serialized in METADATA_SYS_KEY, and the value of each
+    X-Object-Meta-* key in its own xattr. Falls back to the blob layout.
+
+    :returns: dictionary of metadata, None if the metadata is invalid, and
+              the metadata as stored: the value of each xattr of the "keys"
+              layout, or the serialized metadata of the blob layout
+    """
+    names = do_listxattr(path_or_fd)
+    if METADATA_SYS_KEY not in names:
+        if METADATA_KEY not in names:
+            return {}, b""
+        metastr = bytes(read_serialized_metadata(path_or_fd))
+        return deserialize_metadata(metastr) or None, metastr
+    stored = {METADATA_SYS_KEY: do_getxattr(path_or_fd, METADATA_SYS_KEY, decode=False)}
+    metadata = deserialize_metadata(stored[METADATA_SYS_KEY])
     if not metadata:
-        # Empty dict i.e deserializing of metadata has failed, probably
-        # because it is invalid or incomplete or corrupt
-        clean_metadata(path_or_fd)
+        return None, None
+    for name in names:
+        if name.startswith(METADATA_USER_KEY_PREFIX):
+            try:
+                value = do_getxattr(path_or_fd, name, decode=False)
+            except IOError as err:
+                if err.errno != errno.ENODATA:
+                    raise
+                # Removed meanwhile
+                continue
+            stored[name] = value
+            metadata[name[len(METADATA_USER_KEY_PREFIX) :]] = value.decode(
+                "utf-8", "surrogateescape"
+            )
+    return metadata, stored
+
+
+def _read_xattr_metadata(path_or_fd, stats=None):
+    """
+    :returns: dictionary of metadata, and the metadata as stored, see
+              _read_metadata_keys(), None if unknown
+    """
+    cache = metadata_cache
+    if cache is not None:
+        if stats is None:
+            stats = _stat_path_or_fd(path_or_fd)
+        if stats:
+            entry = cache.get_stored(stats)
+            if entry is not None:
+                return entry
+
+    # Both layouts are read, starting with the one metadata is written with
+    if metadata_layout == "keys":
+        metadata, stored = _read_metadata_keys(path_or_fd)
+    else:
+        metastr = read_serialized_metadata(path_or_fd)
+        if metastr:
+            stored = bytes(metastr)
+            metadata = deserialize_metadata(stored) or None
+        else:
+            metadata, stored = _read_metadata_keys(path_or_fd)
+
+    if metadata is None:
+        # Deserializing of metadata has failed, probably because it is
+        # invalid or incomplete or corrupt
+        _clean_xattr_metadata(path_or_fd)
+        metadata = {}
+        stored = b""
+    elif metadata and stats and cache is not None:
+        cache.set(stats, metadata, stored)
 
     assert isinstance(metadata, dict)
-    return metadata
+    return metadata, stored
 
 
-def write_metadata(path_or_fd, metadata):
+def _set_metadata_xattr(path_or_fd, key, value):
+    try:
+        do_setxattr(path_or_fd, key, value)
+    except IOError as err:
+        if err.errno in (errno.ENOSPC, errno.EDQUOT):
+            if isinstance(path_or_fd, int):
+                filename = get_filename_from_fd(path_or_fd)
+                do_log_rl(
+                    "write_metadata(%d, metadata) failed: %s : %s",
+                    path_or_fd,
+                    err,
+                    filename,
+                )
+            else:
+                do_log_rl("write_metadata(%s, metadata) failed: %s", path_or_fd, err)
+            raise DiskFileNoSpace()
+        else:
+            raise SwiftOnFileSystemIOError(
+                err.errno,
+                '%s, setxattr("%s", %s, metastr)' % (err.strerror, path_or_fd, key),
+            )
+
+
+def _remove_metadata_xattr(path_or_fd, key):
+    try:
+        do_removexattr(path_or_fd, key)
+    except IOError as err:
+        if err.errno != errno.ENODATA:
+            raise SwiftOnFileSystemIOError(
+                err.errno, '%s, removexattr("%s", %s)' % (err.strerror, path_or_fd, key)
+            )
+
+
+def _write_metadata_keys(path_or_fd, metadata, stored):
     """
-    Helper function to write serialized metadata for a File/Directory.
+    Write metadata with the "keys" layout, setting only the xattrs whose
+    value differs from the stored one and removing the others, including the
+    blob layout ones. When the stored metadata is not known, the xattrs are
+    listed and all set.
 
-    :param path_or_fd: File/Directory path or fd to write the metadata
-    :param metadata: dictionary of metadata write
+    :returns: the metadata as stored, None if the system metadata is too
+              large for one xattr
     """
+    sys_metadata = {}
+    xattrs = {}
+    for key, value in metadata.items():
+        name = METADATA_USER_KEY_PREFIX + key
+        if (
+            key.startswith(USER_METADATA_PREFIX)
+            and isinstance(value, str)
+            and len(os.fsencode(name)) <= MAX_XATTR_NAME_SIZE
+        ):
+            xattrs[name] = value.encode("utf-8", "surrogateescape")
+        else:
+            sys_metadata[key] = value
+    xattrs[METADATA_SYS_KEY] = serialize_metadata(sys_metadata)
+    if len(xattrs[METADATA_SYS_KEY]) > MAX_XATTR_SIZE:
+        return None
+
+    if stored is None:
+        names = do_listxattr(path_or_fd)
+        stored = {}
+    elif isinstance(stored, dict):
+        names = list(stored)
+    else:
+        # Stored with the blob layout
+        names = [
+            "%s%s" % (METADATA_KEY, key or "")
+            for key in range(-(-len(stored) // MAX_XATTR_SIZE))
+        ]
+        stored = {}
+    for name, value in xattrs.items():
+        if stored.get(name) != value:
+            _set_metadata_xattr(path_or_fd, name, value)
+    for name in names:
+        if name not in xattrs and (_is_keys_layout_key(name) or _is_blob_key(name)):
+            _remove_metadata_xattr(path_or_fd, name)
+    return xattrs
+
+
+def _write_xattr_metadata(path_or_fd, metadata, stored=None):
     assert isinstance(metadata, dict)
-    metastr = serialize_metadata(metadata)
-    key = 0
-    while metastr:
-        try:
-            do_setxattr(
-                path_or_fd, "%s%s" % (METADATA_KEY, key or ""), metastr[:MAX_XATTR_SIZE]
-            )
-        except IOError as err:
-            if err.errno in (errno.ENOSPC, errno.EDQUOT):
-                if isinstance(path_or_fd, int):
-                    filename = get_filename_from_fd(path_or_fd)
-                    do_log_rl(
-                        "write_metadata(%d, metadata) failed: %s : %s",
-                        path_or_fd,
-                        err,
-                        filename,
-                    )
-                else:
-                    do_log_rl(
-                        "write_metadata(%s, metadata) failed: %s", path_or_fd, err
-                    )
-                raise DiskFileNoSpace()
-            else:
-                raise SwiftOnFileSystemIOError(
-                    err.errno,
-                    '%s, setxattr("%s", %s, metastr)' % (err.strerror, path_or_fd, key),
-                )
-        metastr = metastr[MAX_XATTR_SIZE:]
-        key += 1
+    written = None
+    if metadata_layout == "keys":
+        written = _write_metadata_keys(path_or_fd, metadata, stored)
+    if written is None:
+        written = _write_metadata_blob(path_or_fd, metadata, stored)
 
+    cache = metadata_cache
+    if cache is not None:
+        stats = _stat_path_or_fd(path_or_fd)
+        if stats:
+            cache.set(stats, metadata, written)
 
-def clean_metadata(path_or_fd):
+
+def _write_metadata_blob(path_or_fd, metadata, stored):
+    """
+    :returns: the serialized metadata written
+    """
+    metastr = serialize_metadata(metadata)
+    new_file = stored == b""
+    keys_stored = None
+    if isinstance(stored, dict):
+        # Stored with the "keys" layout
+        keys_stored, stored = stored, b""
+    elif stored is None:
+        stored = read_serialized_metadata(path_or_fd)
+    count = -(-len(metastr) // MAX_XATTR_SIZE)
+    for key in range(count):
+        start = key * MAX_XATTR_SIZE
+        chunk = metastr[start : start + MAX_XATTR_SIZE]
+        if chunk != stored[start : start + MAX_XATTR_SIZE]:
+            _set_metadata_xattr(path_or_fd, "%s%s" % (METADATA_KEY, key or ""), chunk)
+
+    # Readers stop at the first chunk shorter than MAX_XATTR_SIZE, so a
+    # leftover chunk is only read after a full last chunk
+    stored_count = -(-len(stored) // MAX_XATTR_SIZE)
+    if len(metastr) % MAX_XATTR_SIZE == 0:
+        stored_count = max(stored_count, count + 1)
+    for key in range(count, stored_count):
+        _remove_metadata_xattr(path_or_fd, "%s%d" % (METADATA_KEY, key))
+
+    if keys_stored is not None:
+        for name in keys_stored:
+            _remove_metadata_xattr(path_or_fd, name)
+    elif not stored and not new_file:
+        # The metadata may have been written with the "keys" layout
+        for name in do_listxattr(path_or_fd):
+            if _is_keys_layout_key(name):
+                _remove_metadata_xattr(path_or_fd, name)
+    return metastr
+
+
+def _clean_xattr_metadata(path_or_fd):
+    cache = metadata_cache
+    if cache is not None:
+        stats = _stat_path_or_fd(path_or_fd)
+        if stats:
+            cache.invalidate(stats)
     key = 0
     while True:
         try:
@@ -249,6 +704,148 @@ def clean_metadata(path_or_fd):
                 err.errno, '%s, removexattr("%s", %s)' % (err.strerror, path_or_fd, key)
             )
         key += 1
+    if metadata_layout == "keys" or not key:
+        for name in do_listxattr(path_or_fd):
+            if _is_keys_layout_key(name):
+                _remove_metadata_xattr(path_or_fd, name)
+
+
+class MetadataStore(ABC):
+    """
+    Storage of the metadata of files and directories, behind read_metadata(),
+    write_metadata() and clean_metadata().
+    """
+
+    @abstractmethod
+    def read(self, path_or_fd, stats=None):
+        pass
+
+    def read_stored(self, path_or_fd, stats=None):
+        """
+        Return the metadata and the metadata as stored, which write() is
+        given back as stored. The stored metadata is None if the store does
+        not use it.
+        """
+        return self.read(path_or_fd, stats), None
+
+    @abstractmethod
+    def write(self, path_or_fd, metadata, stored=None):
+        pass
+
+    @abstractmethod
+    def clean(self, path_or_fd):
+        pass
+
+    def renamed(self, src, dst):
+        """
+        Called once the file src has been renamed to dst.
+        """
+        pass
+
+    def unlinked(self, path):
+        """
+        Called once the file or directory path has been removed.
+        """
+        pass
+
+
+class XattrMetadataStore(MetadataStore):
+    """
+    Metadata stored in the extended attributes of the files and directories
+    """
+
+    def read(self, path_or_fd, stats=None):
+        return _read_xattr_metadata(path_or_fd, stats)[0]
+
+    def read_stored(self, path_or_fd, stats=None):
+        return _read_xattr_metadata(path_or_fd, stats)
+
+    def write(self, path_or_fd, metadata, stored=None):
+        _write_xattr_metadata(path_or_fd, metadata, stored)
+
+    def clean(self, path_or_fd):
+        _clean_xattr_metadata(path_or_fd)
+
+
+xattr_metadata_store = XattrMetadataStore()
+
+
+def get_metadata_store(path_or_fd):
+    """
+    Return the MetadataStore of the device of a file or directory.
+    """
+    if not metadata_stores:
+        return xattr_metadata_store
+    if isinstance(path_or_fd, int):
+        path = get_filename_from_fd(path_or_fd) or ""
+    else:
+        path = path_or_fd
+    for device_path, store in metadata_stores.items():
+        if path.startswith(device_path):
+            return store
+    return xattr_metadata_store
+
+
+def read_metadata(path_or_fd, stats=None):
+    """
+    Helper function to read the serialized metadata from a File/Directory.
+
+    :param path_or_fd: File/Directory path or fd from which to read metadata.
+    :param stats: stat of the File/Directory taken before the call, used to
+                  validate the cached metadata instead of a new stat
+
+    :returns: dictionary of metadata
+    """
+    return get_metadata_store(path_or_fd).read(path_or_fd, stats)
+
+
+def read_metadata_stored(path_or_fd, stats=None):
+    """
+    Like read_metadata(), also returning the metadata as stored, to be given
+    as stored to write_metadata() when the metadata is written back: it
+    spares write_metadata() a read of the current metadata.
+
+    :returns: dictionary of metadata, and the metadata as stored, None if
+              unknown
+    """
+    return get_metadata_store(path_or_fd).read_stored(path_or_fd, stats)
+
+
+def write_metadata(path_or_fd, metadata, stored=None):
+    """
+    Helper function to write serialized metadata for a File/Directory.
+
+    In xattrs, only the chunks differing from the metadata currently stored
+    are written, and the chunks left over from a larger metadata are removed.
+    With the "keys" layout, only the xattrs of the changed keys are written.
+
+    :param path_or_fd: File/Directory path or fd to write the metadata
+    :param metadata: dictionary of metadata write
+    :param stored: metadata currently stored, as returned by
+                   read_metadata_stored(), b"" for a new file. Read from the
+                   file when None.
+    """
+    get_metadata_store(path_or_fd).write(path_or_fd, metadata, stored)
+
+
+def clean_metadata(path_or_fd):
+    get_metadata_store(path_or_fd).clean(path_or_fd)
+
+
+def rename_metadata(src, dst):
+    """
+    Let the metadata store follow the rename of the file src to dst.
+    """
+    if metadata_stores:
+        get_metadata_store(dst).renamed(src, dst)
+
+
+def unlink_metadata(path):
+    """
+    Let the metadata store forget a removed file or directory.
+    """
+    if metadata_stores:
+        get_metadata_store(path).unlinked(path)
 
 
 def validate_object(metadata, statinfo=None):
@@ -283,13 +880,13 @@ def validate_object(metadata, statinfo=None):
     return False
 
 
-def _read_for_etag(fp):
+def _read_for_etag(fp, chunk_size=CHUNK_SIZE):
     etag = md5()
     while True:
-        chunk = do_read(fp, CHUNK_SIZE)
+        chunk = do_read(fp, chunk_size)
         if chunk:  # pragma: no cover
             etag.update(chunk)
-            if len(chunk) >= CHUNK_SIZE:
+            if len(chunk) >= chunk_size:
                 # It is likely that we have more data to be read from the
                 # file. Yield the co-routine cooperatively to avoid
                 # consuming the worker during md5sum() calculations on
@@ -300,7 +897,7 @@ def _read_for_etag(fp):
     return etag.hexdigest()
 
 
-def _get_etag(path_or_fd):
+def _get_etag(path_or_fd, chunk_size=CHUNK_SIZE):
     """
     FIXME: It would be great to have a translator that returns the md5sum() of
     the file as an xattr that can be simply fetched.
@@ -315,7 +912,7 @@ def _get_etag(path_or_fd):
         fd = path_or_fd
         dup_fd = do_dup(fd)
         try:
-            etag = _read_for_etag(dup_fd)
+            etag = _read_for_etag(dup_fd, chunk_size)
             do_lseek(fd, 0, os.SEEK_SET)
         finally:
             do_close(dup_fd)
@@ -325,16 +922,47 @@ def _get_etag(path_or_fd):
         path = path_or_fd
         fd = do_open(path, os.O_RDONLY)
         try:
-            etag = _read_for_etag(fd)
+            etag = _read_for_etag(fd, chunk_size)
         finally:
             do_close(fd)
 
     return etag
 
 
-def get_object_metadata(obj_path_or_fd, stats=None):
+def get_stripe_geometry(path_or_fd):
     """
-    Return metadata of object.
+    Return the (stripe_size, stripe_count) of a file striped on Lustre, read
+    from its layout. Returns None if the file has no plain Lustre layout
+    (not on Lustre, composite layout, ...).
+    """
+    try:
+        lov = do_getxattr(path_or_fd, LUSTRE_LOV_KEY, decode=False)
+    except IOError:
+        return None
+    if len(lov) < struct.calcsize(LOV_USER_MD_FORMAT):
+        return None
+    magic, _, _, stripe_size, stripe_count = struct.unpack_from(LOV_USER_MD_FORMAT, lov)
+    if magic not in (LOV_USER_MAGIC_V1, LOV_USER_MAGIC_V3) or not stripe_size:
+        return None
+    return stripe_size, stripe_count
+
+
+def get_chunk_size(fd, stats, min_size, max_size):
+    """
+    Return the natural I/O size of a file: its stripe size on Lustre, else the
+    block size reported by stat(), clamped to [min_size, max_size].
+    """
+    geometry = get_stripe_geometry(fd)
+    chunk_size = geometry[0] if geometry else stats.st_blksize
+    return max(min_size, min(chunk_size, max_size))
+
+
+def get_object_metadata(
+    obj_path_or_fd, stats=None, chunk_size=CHUNK_SIZE, compute_etag=True
+):
+    """
+    Return metadata of object. The ETag of a file is left to None if
+    compute_etag is False.
     """
     if not stats:
         if isinstance(obj_path_or_fd, int):
@@ -357,28 +985,35 @@ def get_object_metadata(obj_path_or_fd, stats=None):
             X_OBJECT_TYPE: DIR_NON_OBJECT if is_dir else FILE,
             X_CONTENT_LENGTH: 0 if is_dir else stats.st_size,
             X_MTIME: 0 if is_dir else normalize_timestamp(stats.st_mtime),
-            X_ETAG: md5().hexdigest() if is_dir else _get_etag(obj_path_or_fd),
         }
+        if is_dir:
+            metadata[X_ETAG] = md5().hexdigest()
+        elif compute_etag:
+            metadata[X_ETAG] = _get_etag(obj_path_or_fd, chunk_size)
+        else:
+            metadata[X_ETAG] = None
     return metadata
 
 
-def restore_metadata(path, metadata, meta_orig):
+def restore_metadata(path, metadata, meta_orig, stored=None):
     if meta_orig:
         meta_new = meta_orig.copy()
         meta_new.update(metadata)
     else:
         meta_new = metadata
     if meta_orig != meta_new:
-        write_metadata(path, meta_new)
+        write_metadata(path, meta_new, stored)
     return meta_new
 
 
-def create_object_metadata(obj_path_or_fd, stats=None, existing_meta={}):
+def create_object_metadata(
+    obj_path_or_fd, stats=None, existing_meta={}, chunk_size=CHUNK_SIZE, stored=None
+):
     # We must accept either a path or a file descriptor as an argument to this
     # method, as the diskfile modules uses a file descriptior and the DiskDir
     # module (for container operations) uses a path.
-    metadata_from_stat = get_object_metadata(obj_path_or_fd, stats)
-    return restore_metadata(obj_path_or_fd, metadata_from_stat, existing_meta)
+    metadata_from_stat = get_object_metadata(obj_path_or_fd, stats, chunk_size)
+    return restore_metadata(obj_path_or_fd, metadata_from_stat, existing_meta, stored)
 
 
 # The following dir_xxx calls should definitely be replaced
@@ -393,11 +1028,42 @@ def dir_is_object(metadata):
     return metadata.get(X_OBJECT_TYPE, "") == DIR_OBJECT
 
 
-def rmobjdir(dir_path):
+class ScanBudget:
+    """
+    Number of directory entries rmobjdir() may still scan, shared by the
+    calls collecting the directories left by one DELETE.
+
+    :param entries: number of entries, None for no limit
+    """
+
+    def __init__(self, entries=None):
+        self.entries = entries
+
+    def exceeded(self, count):
+        return self.entries is not None and count > self.entries
+
+    def spend(self, count):
+        if self.entries is not None:
+            self.entries -= count
+
+
+def rmobjdir(dir_path, max_entries=None):
     """
     Removes the directory as long as there are no objects stored in it. This
     works for containers also.
+
+    The subdirectories are collected depth first with scandir(), stopping at
+    the first file or object directory found: the metadata of the
+    subdirectories of a directory are read before going down any of them.
+
+    :param max_entries: maximum number of directory entries scanned, the
+                        directory is left in place once reached, or a
+                        ScanBudget shared with other calls
     """
+    if isinstance(max_entries, ScanBudget):
+        budget = max_entries
+    else:
+        budget = ScanBudget(max_entries)
     try:
         do_rmdir(dir_path)
     except OSError as err:
@@ -408,40 +1074,14 @@ def rmobjdir(dir_path):
             raise
         # Handle this non-empty directories below.
     else:
+        unlink_metadata(dir_path)
         return True
 
-    # We have a directory that is not empty, walk it to see if it is filled
+    # We have a directory that is not empty, scan it to see if it is filled
     # with empty sub-directories that are not user created objects
     # (gratuitously created as a result of other object creations).
-    for path, dirs, files in do_walk(dir_path, topdown=False):
-        for directory in dirs:
-            fullpath = os.path.join(path, directory)
-
-            try:
-                metadata = read_metadata(fullpath)
-            except IOError as err:
-                if err.errno == errno.ENOENT:
-                    # Ignore removal from another entity.
-                    continue
-                raise
-            else:
-                if dir_is_object(metadata):
-                    # Wait, this is an object created by the caller
-                    # We cannot delete
-                    return False
-
-            # Directory is not an object created by the caller
-            # so we can go ahead and delete it.
-            try:
-                do_rmdir(fullpath)
-            except OSError as err:
-                if err.errno == errno.ENOTEMPTY:
-                    # Directory is not empty, it might have objects in it
-                    return False
-                if err.errno == errno.ENOENT:
-                    # No such directory exists, already removed, ignore
-                    continue
-                raise
+    if not _rmobjsubdirs(dir_path, budget):
+        return False
 
     try:
         do_rmdir(dir_path)
@@ -454,7 +1094,117 @@ def rmobjdir(dir_path):
             return True
         raise
     else:
+        unlink_metadata(dir_path)
+        return True
+
+
+def _scan_objdir(path, fd, budget):
+    """
+    Return the names of the subdirectories of the directory path, open as
+    fd, which are not objects, None if it contains a file or an object
+    directory or more entries than left in budget.
+    """
+    names = []
+    with do_scandir(fd) as entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                # Files are objects
+                return None
+            names.append(entry.name)
+            if budget.exceeded(len(names)):
+                return None
+    budget.spend(len(names))
+
+    objdirs = []
+    for name in names:
+        try:
+            metadata = read_metadata(os.path.join(path, name))
+        except IOError as err:
+            if err.errno == errno.ENOENT:
+                # Ignore removal from another entity.
+                continue
+            raise
+        if dir_is_object(metadata):
+            # Wait, this is an object created by the caller
+            # We cannot delete
+            return None
+        objdirs.append(name)
+    return objdirs
+
+
+def _open_objdir(path, budget):
+    """
+    Open and scan a directory to empty.
+
+    :returns: its fd and the names of its subdirectories to remove, (None,
+              []) if it does not exist, None if it contains objects
+    """
+    try:
+        fd = do_open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    except OSError as err:
+        if err.errno == errno.ENOENT:
+            # Ignore removal from another entity.
+            return None, []
+        raise
+    try:
+        subdirs = _scan_objdir(path, fd, budget)
+    except BaseException:
+        do_close(fd)
+        raise
+    if subdirs is None:
+        do_close(fd)
+        return None
+    return fd, subdirs
+
+
+def _rmobjsubdirs(dir_path, budget):
+    """
+    Remove the subdirectories of dir_path, returning False as soon as a file
+    or an object directory is found or the budget is exhausted. A directory
+    is opened once, to be listed and to have its emptied subdirectories
+    removed relative to its fd.
+    """
+    opened = _open_objdir(dir_path, budget)
+    if opened is None:
+        return False
+    # Stack of the directories being emptied: path, fd and names of the
+    # subdirectories left to remove
+    stack = [(dir_path,) + opened]
+    try:
+        while stack:
+            path, fd, subdirs = stack[-1]
+            if subdirs:
+                subdir = os.path.join(path, subdirs.pop())
+                opened = _open_objdir(subdir, budget)
+                if opened is None:
+                    return False
+                if opened[0] is not None:
+                    stack.append((subdir,) + opened)
+                continue
+            stack.pop()
+            if fd is not None:
+                do_close(fd)
+            if not stack:
+                break
+
+            # Directory is not an object created by the caller and is empty so
+            # we can go ahead and delete it.
+            try:
+                do_rmdirat(stack[-1][1], os.path.basename(path), path)
+            except OSError as err:
+                if err.errno == errno.ENOTEMPTY:
+                    # Directory is not empty, it might have objects in it
+                    return False
+                if err.errno == errno.ENOENT:
+                    # No such directory exists, already removed, ignore
+                    continue
+                raise
+            unlink_metadata(path)
         return True
+    finally:
+        for _, fd, _ in stack:
+            if fd is not None:
+                do_close(fd)
 
 
 def write_pickle(obj, dest, tmp=None, pickle_protocol=0):
@@ -0,0 +1,131 @@
+""" Watchdog reporting the calls which block the eventlet hub """
+
+import os
+import sys
+import traceback
+from collections import defaultdict
+
+from eventlet import patcher, sleep, spawn
+
+from swiftonfile.swift.common.fs_utils import do_log_rl
+
+_threading = patcher.original("threading")
+_time = patcher.original("time")
+
+_FS_UTILS_FILE = do_log_rl.__code__.co_filename
+
+
+class HubWatchdog:
+    """
+    Detects the eventlet hub of a worker not running for more than threshold
+    seconds, as when a green thread is stuck in a filesystem call on a hung
+    mount, blocking every other request of the worker.
+
+    A green thread records when it last ran every threshold / 4 seconds and a
+    native thread checks it. When the hub didn't run for threshold seconds,
+    the native thread captures the stack of the thread running the hub, with
+    the innermost fs_utils call and its path. The stall is reported once the
+    hub runs again: logged through do_log_rl and counted in hub_stalls and,
+    when the path is on a device, in hub_stalls.<device>.
+
+    :param threshold: seconds the hub may not run
+    :param devices: path of the devices
+    :param logger: logger used for metrics
+    """
+
+    def __init__(self, threshold, devices, logger):
+        self.threshold = threshold
+        self.devices = devices.rstrip(os.path.sep) + os.path.sep
+        self.logger = logger
+        self.stalls = defaultdict(int)
+        self._pid = None
+        self._ident = None
+        self._beat = None
+        self._stall = None
+        self._lock = _threading.Lock()
+
+    def start(self):
+        """
+        Start the watchdog of the current process, if not already running.
+        It is called by each request, the workers being forked after the
+        application is loaded.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._pid = pid
+        self._ident = _threading.get_ident()
+        self._beat = _time.monotonic()
+        self._stall = None
+        spawn(self._heartbeat, pid)
+        _threading.Thread(
+            target=self._watch, args=(pid,), name="hub-watchdog", daemon=True
+        ).start()
+
+    def stop(self):
+        self._pid = None
+
+    def _heartbeat(self, pid):
+        while self._pid == pid:
+            now = _time.monotonic()
+            with self._lock:
+                stall, self._stall = self._stall, None
+                beat, self._beat = self._beat, now
+            if stall is not None:
+                self._report(now - beat, *stall)
+            sleep(self.threshold / 4)
+
+    def _watch(self, pid):
+        while self._pid == pid:
+            _time.sleep(self.threshold / 4)
+            with self._lock:
+                if self._stall is not None:
+                    continue
+                beat = self._beat
+            if _time.monotonic() - beat < self.threshold:
+                continue
+            stall = self._capture(sys._current_frames().get(self._ident))
+            with self._lock:
+                if self._beat == beat:
+                    self._stall = stall
+
+    def _capture(self, frame):
+        """
+        Return the stack of frame, the name of its innermost fs_utils call and
+        the path or fd it was called with.
+        """
+        if frame is None:
+            return [], None, None
+        stack = traceback.format_stack(frame)
+        while frame is not None:
+            code = frame.f_code
+            name = code.co_name.lstrip("_")
+            if code.co_filename == _FS_UTILS_FILE and name.startswith("do_"):
+                args = frame.f_locals
+                if "path" in args:
+                    return stack, name, args["path"]
+                if code.co_argcount:
+                    return stack, name, args.get(code.co_varnames[0])
+                return stack, name, None
+            frame = frame.f_back
+        return stack, None, None
+
+    def _device(self, path):
+        if isinstance(path, str) and path.startswith(self.devices):
+            return path[len(self.devices) :].split(os.path.sep, 1)[0]
+        return None
+
+    def _report(self, duration, stack, call, path):
+        device = self._device(path)
+        self.stalls[device] += 1
+        self.logger.increment("hub_stalls")
+        if device:
+            self.logger.increment("hub_stalls.%s" % device)
+        where = " in %s(%r)" % (call, path) if call else ""
+        do_log_rl(
+            "Eventlet hub blocked for %.3fs%s:\n%s",
+            duration,
+            where,
+            "".join(stack),
+            log_level="warning",
+        )
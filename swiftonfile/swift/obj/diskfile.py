@@ -17,7 +17,9 @@ import importlib
 import os
 import stat
 import errno
+import itertools
 from abc import ABC, abstractmethod
+from collections import deque
 
 try:
     from random import SystemRandom
@@ -28,15 +30,26 @@ except ImportError:  # pragma: no cover
 import logging
 import time
 from uuid import uuid4
-from eventlet import sleep
+from eventlet import sleep, spawn, tpool
+from eventlet.event import Event
+from eventlet.queue import LightQueue, PriorityQueue, Full
 from contextlib import contextmanager
 from swiftonfile.swift.common.exceptions import (
     AlreadyExistsAsFile,
     AlreadyExistsAsDir,
     DiskFileContainerDoesNotExist,
 )
-from swift.common.utils import hash_path, normalize_timestamp, fallocate, Timestamp
+from swift.common.utils import (
+    hash_path,
+    normalize_timestamp,
+    fallocate,
+    Timestamp,
+    config_true_value,
+    lock_file,
+    mkdirs,
+)
 from swift.common.exceptions import (
+    LockTimeout,
     DiskFileNotExist,
     DiskFileError,
     DiskFileNoSpace,
@@ -49,6 +62,7 @@ from swift.common.swob import multi_range_iterator
 from swift.common.utils import md5
 
 from swiftonfile.swift.common.exceptions import SwiftOnFileSystemOSError
+from swiftonfile.swift.common import devmonitor, tracing
 from swiftonfile.swift.common.fs_utils import (
     do_fstat,
     do_open,
@@ -60,23 +74,36 @@ from swiftonfile.swift.common.fs_utils import (
     do_stat,
     do_write,
     do_read,
+    do_pread,
+    do_dup,
     do_fadvise64,
     do_rename,
     do_fdatasync,
     do_lseek,
     do_mkdir,
+    do_rmdir,
+    do_scandir,
+    do_unlinkat,
+    invalidate_cached_parents,
 )
 from swiftonfile.swift.common.utils import (
     read_metadata,
+    read_metadata_stored,
     write_metadata,
     validate_object,
     create_object_metadata,
+    restore_metadata,
     rmobjdir,
+    ScanBudget,
     dir_is_object,
     get_object_metadata,
     write_pickle,
     get_user_uid_gid,
     get_group_gid,
+    get_stripe_geometry,
+    get_chunk_size,
+    rename_metadata,
+    unlink_metadata,
 )
 from swiftonfile.swift.common.utils import (
     X_CONTENT_TYPE,
@@ -100,12 +127,38 @@ from swift.obj.diskfile import get_async_dir
 
 MAX_RENAME_ATTEMPTS = 10
 MAX_OPEN_ATTEMPTS = 10
+COALESCE_READS_MAX_CHUNKS = 16
+PARALLEL_READ_MIN_SIZE = 64 * 1024 * 1024
+MAX_DISK_CHUNK_SIZE = 4 * 1024 * 1024
+ETAG_MATERIALIZER_WORKERS = 2
+ETAG_MATERIALIZER_QUEUE_SIZE = 1024
+REVALIDATION_LOCK_TIMEOUT = 60
+DIR_GC_RATE = 100
+DIR_GC_QUEUE_SIZE = 100000
+DIR_GC_MAX_ENTRIES = 10000
 
 
 def _random_sleep():
     sleep(random.uniform(0.5, 0.15))
 
 
+def _same_file(stats, other_stats):
+    # A file whose data may have changed has another inode, size or mtime
+    return (stats.st_ino, stats.st_size, stats.st_mtime_ns) == (
+        other_stats.st_ino,
+        other_stats.st_size,
+        other_stats.st_mtime_ns,
+    )
+
+
+def _stored_if_unchanged(stats, other_stats, stored):
+    # Writing the metadata bumps the ctime: the metadata stored when the
+    # file had other_stats is still the stored one if the ctime is the same
+    if stats.st_ctime_ns == other_stats.st_ctime_ns:
+        return stored
+    return None
+
+
 def make_directory(full_path, uid, gid, metadata=None):
     """
     Make a directory and change the owner ship as specified, and potentially
@@ -125,7 +178,7 @@ def make_directory(full_path, uid, gid, metadata=None):
             # FIXME: When we are confident, remove this stat() call as it is
             # not necessary.
             try:
-                stats = do_stat(full_path)
+                stats = do_stat(full_path, cached=True)
             except SwiftOnFileSystemOSError as serr:
                 # FIXME: Ideally we'd want to return an appropriate error
                 # message and code in the PUT Object REST API response.
@@ -370,6 +423,83 @@ class DiskFileManager(SwiftDiskFileManager):
     def __init__(self, conf, logger):
         super().__init__(conf, logger)
 
+        # Concurrent full GETs of the same object can share one disk read
+        self.coalesce_reads = config_true_value(conf.get("coalesce_reads", "false"))
+        self.coalesce_reads_max_chunks = int(
+            conf.get("coalesce_reads_max_chunks", COALESCE_READS_MAX_CHUNKS)
+        )
+        self.shared_reads = {}
+
+        # Large objects can be read with several reads in flight, one stripe
+        # each, to keep all the stripes of a file busy
+        self.parallel_reads = int(conf.get("parallel_reads", 0))
+        self.parallel_read_stripe_size = int(conf.get("parallel_read_stripe_size", 0))
+        self.parallel_read_min_size = int(
+            conf.get("parallel_read_min_size", PARALLEL_READ_MIN_SIZE)
+        )
+
+        # The ETag of an object changed outside of Swift can be computed while
+        # it is served by a full GET instead of before
+        self.stream_etag = config_true_value(conf.get("stream_etag", "false"))
+        # or in background, requests not waiting for it
+        self.etag_materializer = None
+        if config_true_value(conf.get("etag_materializer", "false")):
+            self.etag_materializer = EtagMaterializer(
+                self.logger,
+                int(conf.get("etag_materializer_workers", ETAG_MATERIALIZER_WORKERS)),
+                int(
+                    conf.get(
+                        "etag_materializer_queue_size", ETAG_MATERIALIZER_QUEUE_SIZE
+                    )
+                ),
+            )
+
+        # Concurrent requests finding the same object stale rebuild its
+        # metadata once per worker, and once for all the workers if
+        # revalidation_lock_dir is set
+        self.single_flight_revalidation = config_true_value(
+            conf.get("single_flight_revalidation", "false")
+        )
+        self.revalidation_lock_dir = conf.get("revalidation_lock_dir", "")
+        self.revalidation_lock_timeout = float(
+            conf.get("revalidation_lock_timeout", REVALIDATION_LOCK_TIMEOUT)
+        )
+        if self.single_flight_revalidation and self.revalidation_lock_dir:
+            mkdirs(self.revalidation_lock_dir)
+        self.revalidations = {}
+
+        # Files can be read and written in their natural I/O size (stripe
+        # size on Lustre, st_blksize elsewhere) instead of disk_chunk_size
+        self.adaptive_chunk_size = config_true_value(
+            conf.get("adaptive_chunk_size", "false")
+        )
+        self.min_disk_chunk_size = int(
+            conf.get("min_disk_chunk_size", self.disk_chunk_size)
+        )
+        self.max_disk_chunk_size = int(
+            conf.get("max_disk_chunk_size", MAX_DISK_CHUNK_SIZE)
+        )
+
+        # The garbage collection of the empty directories left by a DELETE
+        # scans at most dir_gc_max_entries entries in all, 0 for no limit
+        self.dir_gc_max_entries = (
+            int(conf.get("dir_gc_max_entries", DIR_GC_MAX_ENTRIES)) or None
+        )
+        # immediately, or in background with dir_gc_mode = deferred
+        dir_gc_mode = conf.get("dir_gc_mode", "immediate").lower()
+        if dir_gc_mode not in ("immediate", "deferred"):
+            raise ValueError(
+                "dir_gc_mode must be immediate or deferred, not %r" % dir_gc_mode
+            )
+        self.dir_collector = None
+        if dir_gc_mode == "deferred":
+            self.dir_collector = DirectoryCollector(
+                self.logger,
+                float(conf.get("dir_gc_rate", DIR_GC_RATE)),
+                int(conf.get("dir_gc_queue_size", DIR_GC_QUEUE_SIZE)),
+                self.dir_gc_max_entries,
+            )
+
         # load match fs user behavior
         match_fs_user_classname = conf.get("match_fs_user")
         self.match_fs_user = None
@@ -387,10 +517,37 @@ class DiskFileManager(SwiftDiskFileManager):
                 "Swift Object Server with root if you want to enable match_fs_user."
             )
 
+    def get_chunk_size(self, fd, stats=None):
+        """
+        Return the size of the reads and writes to do on the open file fd.
+
+        :param fd: open file descriptor
+        :param stats: stat of the file, fstat() is called if not given
+        :returns: disk_chunk_size, or the natural I/O size of the file when
+                  adaptive_chunk_size is enabled
+        """
+        if not self.adaptive_chunk_size:
+            return self.disk_chunk_size
+        if stats is None:
+            stats = do_fstat(fd)
+        chunk_size = get_chunk_size(
+            fd, stats, self.min_disk_chunk_size, self.max_disk_chunk_size
+        )
+        self.logger.increment("disk_chunk_size.%d" % chunk_size)
+        return chunk_size
+
     def get_diskfile(
         self, device, partition, account, container, obj, policy=None, **kwargs
     ):
-        dev_path = self.get_dev_path(device, self.mount_check)
+        available = None
+        if devmonitor.monitor is not None:
+            available = devmonitor.monitor.available(device)
+        if available is None:
+            dev_path = self.get_dev_path(device, self.mount_check)
+        elif available:
+            dev_path = self.get_dev_path(device, False)
+        else:
+            dev_path = None
         if not dev_path:
             raise DiskFileDeviceUnavailable()
 
@@ -443,6 +600,12 @@ class DiskFileWriter:
         # Internal attributes
         self._upload_size = 0
         self._last_sync = 0
+        # With adaptive chunk size, data is buffered to be written to disk in
+        # chunks of _chunk_size bytes
+        self._chunk_size = None
+        self._buffer = None
+        # Span of the writes, from the creation of the file to put()
+        self._write_span = None
 
     def _write_entire_chunk(self, chunk):
         bytes_per_sync = self._disk_file._mgr.bytes_per_sync
@@ -458,6 +621,12 @@ class DiskFileWriter:
                 self._last_sync = self._upload_size
 
     def open(self):
+        with tracing.span("diskfile.create", path=self._disk_file._data_file):
+            self._open()
+        self._write_span = tracing.start_span("diskfile.write")
+        return self
+
+    def _open(self):
         # Create /account/container directory structure on mount point root
         try:
             os.makedirs(self._disk_file._container_path)
@@ -544,27 +713,29 @@ class DiskFileWriter:
                             "Container dir %s does not exist", self._container_path
                         )
                         raise DiskFileContainerDoesNotExist
-                elif attempts > 1:
-                    # Got ENOENT after previously making the path. This could
-                    # also be a FUSE issue or some race condition, nap and
-                    # retry.
-                    _random_sleep()
-                    logging.warn(
-                        "DiskFile.create(): %s ... retrying in" " 0.1 secs" % gerr
-                    )
-                    attempts += 1
                 else:
-                    # It looks like the path to the object does not already
-                    # exist; don't count this as an attempt, though, since
-                    # we perform the open() system call optimistically.
-                    self._disk_file._create_dir_object(self._disk_file._obj_path)
+                    # It looks like the path to the object does not exist,
+                    # or not anymore, when it was removed meanwhile by
+                    # another worker: the cached stats of its directories
+                    # are stale. Make the path and retry, napping if it was
+                    # already made, as this could also be a FUSE issue.
+                    if attempts > 1:
+                        _random_sleep()
+                        logging.warn(
+                            "DiskFile.create(): %s ... retrying in" " 0.1 secs" % gerr
+                        )
+                    invalidate_cached_parents(self._tmppath)
+                    with tracing.span("diskfile.mkdirs"):
+                        self._disk_file._create_dir_object(self._disk_file._obj_path)
+                    attempts += 1
             else:
                 # Disable coverage (bug in python coverage)
                 break  # pragma: no cover
 
         if self._size is not None and self._size > 0:
             try:
-                fallocate(self._fd, self._size)
+                with tracing.span("diskfile.fallocate", size=self._size):
+                    fallocate(self._fd, self._size)
             except OSError as err:
                 if err.errno in (errno.ENOSPC, errno.EDQUOT):
                     raise DiskFileNoSpace()
@@ -580,17 +751,28 @@ class DiskFileWriter:
             # is not passed to DiskFile.
             do_fchown(self._fd, self._disk_file._uid, self._disk_file._gid)
 
-        return self
+        mgr = self._disk_file._mgr
+        if mgr.adaptive_chunk_size:
+            self._chunk_size = mgr.get_chunk_size(self._fd)
+            self._buffer = bytearray()
+
+    def _end_write_span(self):
+        if self._write_span is not None:
+            self._write_span.set("bytes", self.chunks_finished()[0])
+            self._write_span.end()
+            self._write_span = None
 
     def close(self):
         """
         Close the file descriptor
         """
+        self._end_write_span()
         if self._fd:
             do_close(self._fd)
             self._fd = None
         if self._tmppath:
             do_unlink(self._tmppath)
+            unlink_metadata(self._tmppath)
 
     def write(self, chunk):
         """
@@ -603,8 +785,32 @@ class DiskFileWriter:
         :returns: the total number of bytes written to an object
         """
         self._chunks_etag.update(chunk)
-        self._write_entire_chunk(chunk)
-        return self._upload_size
+        if self._buffer is None:
+            self._write_entire_chunk(chunk)
+            return self._upload_size
+        # Writes are of exactly _chunk_size bytes, aligned on the layout of
+        # the file: only the data completing the buffered chunk and the
+        # remainder are copied, the full chunks are written from a view of
+        # the data received
+        chunk_size = self._chunk_size
+        view = memoryview(chunk)
+        if self._buffer:
+            needed = chunk_size - len(self._buffer)
+            self._buffer += view[:needed]
+            if len(self._buffer) < chunk_size:
+                return self._upload_size + len(self._buffer)
+            self._flush_buffer()
+            view = view[needed:]
+        while len(view) >= chunk_size:
+            self._write_entire_chunk(view[:chunk_size])
+            view = view[chunk_size:]
+        self._buffer += view
+        return self._upload_size + len(self._buffer)
+
+    def _flush_buffer(self):
+        if self._buffer:
+            self._write_entire_chunk(self._buffer)
+            del self._buffer[:]
 
     def chunks_finished(self):
         """
@@ -612,18 +818,21 @@ class DiskFileWriter:
 
         :returns: a tuple, (upload_size, etag)
         """
-        return self._upload_size, self._chunks_etag.hexdigest()
+        buffered = len(self._buffer) if self._buffer is not None else 0
+        return self._upload_size + buffered, self._chunks_etag.hexdigest()
 
     def _finalize_put(self, metadata):
         # Write out metadata before fsync() to ensure it is also forced to
-        # disk.
-        write_metadata(self._fd, metadata)
+        # disk. The temporary file has no metadata yet.
+        with tracing.span("diskfile.write_metadata"):
+            write_metadata(self._fd, metadata, stored=b"")
 
         # We call fsync() before calling drop_cache() to lower the
         # amount of redundant work the drop cache code will perform on
         # the pages (now that after fsync the pages will be all
         # clean).
-        do_fsync(self._fd)
+        with tracing.span("diskfile.fsync"):
+            do_fsync(self._fd)
         # From the Department of the Redundancy Department, make sure
         # we call drop_cache() after fsync() to avoid redundant work
         # (pages all clean).
@@ -634,85 +843,89 @@ class DiskFileWriter:
         # swift.common.utils.renamer(), which makes the directory path and
         # adds extra stat() calls.
         df = self._disk_file
-        attempts = 1
-        while True:
-            try:
-                do_rename(self._tmppath, df._data_file)
-            except OSError as err:
-                if (
-                    err.errno in (errno.ENOENT, errno.EIO, errno.EBUSY, errno.ESTALE)
-                    and attempts < MAX_RENAME_ATTEMPTS
-                ):
-                    # Some versions of GlusterFS had rename() as non-blocking
-                    # operation. So we check for STALE and EBUSY. This was
-                    # fixed recently: http://review.gluster.org/#/c/13366/
-                    # The comment that follows is for ENOENT and EIO...
-                    # FIXME: Why either of these two error conditions is
-                    # happening is unknown at this point. This might be a
-                    # FUSE issue of some sort or a possible race
-                    # condition. So let's sleep on it, and double check
-                    # the environment after a good nap.
-                    _random_sleep()
-                    # Tease out why this error occurred. The man page for
-                    # rename reads:
-                    #   "The link named by tmppath does not exist; or, a
-                    #    directory component in data_file does not exist;
-                    #    or, tmppath or data_file is an empty string."
-                    assert len(self._tmppath) > 0 and len(df._data_file) > 0
-                    tpstats = do_stat(self._tmppath)
-                    tfstats = do_fstat(self._fd)
-                    assert tfstats
-                    if not tpstats or tfstats.st_ino != tpstats.st_ino:
-                        # Temporary file name conflict
-                        raise DiskFileError(
-                            "DiskFile.put(): temporary file, %s, was"
-                            " already renamed (targeted for %s)"
-                            % (self._tmppath, df._data_file)
-                        )
-                    else:
-                        # Data file target name now has a bad path!
-                        dfstats = do_stat(df._put_datadir)
-                        if not dfstats:
+        with tracing.span("diskfile.rename"):
+            attempts = 1
+            while True:
+                try:
+                    do_rename(self._tmppath, df._data_file)
+                except OSError as err:
+                    if (
+                        err.errno
+                        in (errno.ENOENT, errno.EIO, errno.EBUSY, errno.ESTALE)
+                        and attempts < MAX_RENAME_ATTEMPTS
+                    ):
+                        # Some versions of GlusterFS had rename() as non-blocking
+                        # operation. So we check for STALE and EBUSY. This was
+                        # fixed recently: http://review.gluster.org/#/c/13366/
+                        # The comment that follows is for ENOENT and EIO...
+                        # FIXME: Why either of these two error conditions is
+                        # happening is unknown at this point. This might be a
+                        # FUSE issue of some sort or a possible race
+                        # condition. So let's sleep on it, and double check
+                        # the environment after a good nap.
+                        _random_sleep()
+                        # Tease out why this error occurred. The man page for
+                        # rename reads:
+                        #   "The link named by tmppath does not exist; or, a
+                        #    directory component in data_file does not exist;
+                        #    or, tmppath or data_file is an empty string."
+                        assert len(self._tmppath) > 0 and len(df._data_file) > 0
+                        tpstats = do_stat(self._tmppath)
+                        tfstats = do_fstat(self._fd)
+                        assert tfstats
+                        if not tpstats or tfstats.st_ino != tpstats.st_ino:
+                            # Temporary file name conflict
                             raise DiskFileError(
-                                "DiskFile.put(): path to object, %s, no"
-                                " longer exists (targeted for %s)"
-                                % (df._put_datadir, df._data_file)
+                                "DiskFile.put(): temporary file, %s, was"
+                                " already renamed (targeted for %s)"
+                                % (self._tmppath, df._data_file)
                             )
                         else:
-                            is_dir = stat.S_ISDIR(dfstats.st_mode)
-                            if not is_dir:
+                            # Data file target name now has a bad path!
+                            dfstats = do_stat(df._put_datadir)
+                            if not dfstats:
                                 raise DiskFileError(
-                                    "DiskFile.put(): path to object, %s,"
-                                    " no longer a directory (targeted for"
-                                    " %s)" % (df._put_datadir, df._data_file)
+                                    "DiskFile.put(): path to object, %s, no"
+                                    " longer exists (targeted for %s)"
+                                    % (df._put_datadir, df._data_file)
                                 )
                             else:
-                                # Let's retry since everything looks okay
-                                logging.warn(
-                                    "DiskFile.put(): rename('%s','%s')"
-                                    " initially failed (%s) but a"
-                                    " stat('%s') following that succeeded:"
-                                    " %r"
-                                    % (
-                                        self._tmppath,
-                                        df._data_file,
-                                        str(err),
-                                        df._put_datadir,
-                                        dfstats,
+                                is_dir = stat.S_ISDIR(dfstats.st_mode)
+                                if not is_dir:
+                                    raise DiskFileError(
+                                        "DiskFile.put(): path to object, %s,"
+                                        " no longer a directory (targeted for"
+                                        " %s)" % (df._put_datadir, df._data_file)
                                     )
-                                )
-                                attempts += 1
-                                continue
+                                else:
+                                    # Let's retry since everything looks okay
+                                    logging.warn(
+                                        "DiskFile.put(): rename('%s','%s')"
+                                        " initially failed (%s) but a"
+                                        " stat('%s') following that succeeded:"
+                                        " %r"
+                                        % (
+                                            self._tmppath,
+                                            df._data_file,
+                                            str(err),
+                                            df._put_datadir,
+                                            dfstats,
+                                        )
+                                    )
+                                    attempts += 1
+                                    continue
+                    else:
+                        raise SwiftOnFileSystemOSError(
+                            err.errno,
+                            "%s, rename('%s', '%s')"
+                            % (err.strerror, self._tmppath, df._data_file),
+                        )
                 else:
-                    raise SwiftOnFileSystemOSError(
-                        err.errno,
-                        "%s, rename('%s', '%s')"
-                        % (err.strerror, self._tmppath, df._data_file),
-                    )
-            else:
-                # Disable coverage (bug in python coverage)
-                break  # pragma: no cover
+                    # Disable coverage (bug in python coverage)
+                    break  # pragma: no cover
+            rename_metadata(self._tmppath, df._data_file)
 
+    @tracing.traced("diskfile.put")
     def put(self, metadata):
         """
         Finalize writing the file on disk, and renames it from the temp file
@@ -724,6 +937,9 @@ class DiskFileWriter:
                                      name
         """
         assert self._tmppath is not None
+        if self._buffer is not None:
+            self._flush_buffer()
+        self._end_write_span()
         metadata = _adjust_metadata(self._fd, metadata)
         df = self._disk_file
 
@@ -760,6 +976,505 @@ class DiskFileWriter:
         pass
 
 
+class SharedRead:
+    """
+    A single in-progress read of an object, shared by all the readers of
+    one worker serving a full GET of that same object.
+
+    The chunks read from disk are kept in a bounded ring buffer. The first
+    reader asking for the chunk following the ring reads it from disk; the
+    other readers are served from the ring. A reader which fell behind the
+    oldest chunk of the ring gets None and has to read from its own file
+    descriptor until it catches up.
+
+    :param registry: dictionary of the shared reads in progress
+    :param key: key of this shared read in the registry
+    :param fd: file descriptor owned by this shared read
+    :param chunk_size: size of reads from disk in bytes
+    :param max_chunks: maximum number of chunks kept in the ring buffer
+    """
+
+    def __init__(self, registry, key, fd, chunk_size, max_chunks):
+        self._registry = registry
+        self.key = key
+        self._fd = fd
+        self._chunk_size = chunk_size
+        self._offsets = deque(maxlen=max_chunks)
+        self._chunks = {}
+        self._next_offset = 0
+        self._eof = False
+        self.readers = 0
+        self.disk_reads = 0
+
+    @classmethod
+    def attach(cls, registry, key, fd, chunk_size, max_chunks):
+        """
+        Attach to the shared read registered under key, starting a new one
+        reading from a duplicate of fd if there is none in progress.
+        """
+        shared_read = registry.get(key)
+        if shared_read is None:
+            shared_read = cls(registry, key, do_dup(fd), chunk_size, max_chunks)
+            registry[key] = shared_read
+        shared_read.readers += 1
+        return shared_read
+
+    def detach(self):
+        """
+        Detach a reader, closing the shared read when it was the last one.
+        """
+        self.readers -= 1
+        if self.readers > 0:
+            return
+        if self._registry.get(self.key) is self:
+            del self._registry[self.key]
+        if self._fd is not None:
+            fd, self._fd = self._fd, None
+            self._offsets.clear()
+            self._chunks.clear()
+            do_close(fd)
+
+    def get_chunk(self, offset):
+        """
+        Return the chunk starting at offset, an empty chunk at the end of
+        the file, or None if the chunk is no longer (or not) in the ring.
+        """
+        chunk = self._chunks.get(offset)
+        if chunk is not None:
+            return chunk
+        if offset != self._next_offset or self._fd is None:
+            return None
+        if self._eof:
+            return b""
+        chunk = do_pread(self._fd, self._chunk_size, offset)
+        self.disk_reads += 1
+        if not chunk:
+            self._eof = True
+            return chunk
+        if len(self._offsets) == self._offsets.maxlen:
+            del self._chunks[self._offsets[0]]
+        self._offsets.append(offset)
+        self._chunks[offset] = chunk
+        self._next_offset = offset + len(chunk)
+        return chunk
+
+
+class ReadAhead:
+    """
+    Reads a file ahead of its consumer, with up to `depth` reads of
+    `read_size` bytes in flight at a time in the eventlet thread pool. Reads
+    are issued at offsets aligned on read_size (the stripe size) and are
+    returned in order.
+
+    :param fd: open file descriptor
+    :param read_size: size of each read in bytes
+    :param depth: maximum number of reads in flight
+    :param file_size: size of the file in bytes
+    """
+
+    def __init__(self, fd, read_size, depth, file_size):
+        self._fd = fd
+        self._read_size = read_size
+        self._depth = depth
+        self._file_size = file_size
+        self._next_offset = 0
+        self._pending = deque()
+
+    def _fill(self):
+        while len(self._pending) < self._depth and self._next_offset < self._file_size:
+            offset = self._next_offset
+            self._pending.append(
+                (
+                    offset,
+                    spawn(tpool.execute, do_pread, self._fd, self._read_size, offset),
+                )
+            )
+            self._next_offset += self._read_size
+
+    def read(self, offset):
+        """
+        Return the chunk starting at offset, an empty chunk at the end of the
+        file, or None if offset is not the next offset to be read.
+        """
+        self._fill()
+        if not self._pending:
+            return b"" if offset >= self._file_size else None
+        if self._pending[0][0] != offset:
+            return None
+        _, gt = self._pending.popleft()
+        chunk = gt.wait()
+        end = min(offset + self._read_size, self._file_size)
+        while chunk and offset + len(chunk) < end:
+            # Short read, complete the chunk before the next one is returned
+            more = do_pread(self._fd, end - offset - len(chunk), offset + len(chunk))
+            if not more:
+                break
+            chunk += more
+        self._fill()
+        return chunk
+
+    def stop(self):
+        """
+        Wait for the reads in flight, so that the file descriptor can be
+        closed or used for other reads.
+        """
+        while self._pending:
+            _, gt = self._pending.popleft()
+            try:
+                gt.wait()
+            except Exception:
+                pass
+
+
+class EtagMaterializer:
+    """
+    Computes in background the ETag of objects changed outside of Swift, so
+    that requests do not have to wait for the whole object to be read.
+
+    Each device has its own bounded priority queue, served by `workers` green
+    threads which hash the files in the eventlet thread pool. Only the reads
+    and the hashing run there, the metadata being read and written in the
+    green thread: the caches it goes through are not safe to use from the
+    thread pool. Smaller files are hashed first. A file already queued is not
+    queued again, and the metadata is only written if the file did not change
+    meanwhile.
+
+    :param logger: logger used for metrics
+    :param workers: number of files hashed at the same time per device
+    :param queue_size: maximum number of files queued per device
+    """
+
+    def __init__(self, logger, workers, queue_size):
+        self._logger = logger
+        self._workers = workers
+        self._queue_size = queue_size
+        self._queues = {}
+        self._pending = set()
+        self._seq = itertools.count()
+
+    def submit(self, device, path, stats, metadata, chunk_size, stored=None):
+        """
+        Queue the computation of the ETag of a file.
+
+        :param device: device the file is on
+        :param path: path of the file
+        :param stats: stat of the file when its metadata was built
+        :param metadata: metadata of the file, written with the ETag
+        :param chunk_size: size of reads from disk in bytes
+        :param stored: metadata as stored when the file had stats, see
+                       read_metadata_stored()
+        :returns: False if the queue of the device is full
+        """
+        key = (stats.st_dev, stats.st_ino)
+        if key in self._pending:
+            return True
+        queue = self._queues.get(device)
+        if queue is None:
+            queue = self._queues[device] = PriorityQueue(self._queue_size)
+            for _ in range(self._workers):
+                spawn(self._worker, queue)
+        try:
+            queue.put_nowait(
+                (
+                    stats.st_size,
+                    next(self._seq),
+                    key,
+                    path,
+                    stats,
+                    metadata,
+                    chunk_size,
+                    stored,
+                )
+            )
+        except Full:
+            self._logger.increment("etag_materializer.dropped")
+            return False
+        self._pending.add(key)
+        self._logger.increment("etag_materializer.queued")
+        return True
+
+    def _worker(self, queue):
+        while True:
+            _, _, key, path, stats, metadata, chunk_size, stored = queue.get()
+            try:
+                persisted = self._materialize(path, stats, metadata, chunk_size, stored)
+            except Exception:
+                logging.exception("Could not compute the ETag of %s" % path)
+                self._logger.increment("etag_materializer.errors")
+            else:
+                if persisted:
+                    self._logger.increment("etag_materializer.persisted")
+                else:
+                    self._logger.increment("etag_materializer.changed")
+            finally:
+                self._pending.discard(key)
+
+    def _materialize(self, path, stats, metadata, chunk_size, stored=None):
+        fd = do_open(path, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            if not _same_file(do_fstat(fd), stats):
+                return False
+            etag = tpool.execute(_hash_file, fd, chunk_size)
+            new_stats = do_fstat(fd)
+            if not _same_file(new_stats, stats):
+                return False
+            restore_metadata(
+                fd,
+                {X_ETAG: etag},
+                metadata,
+                _stored_if_unchanged(new_stats, stats, stored),
+            )
+            return True
+        finally:
+            do_close(fd)
+
+
+def _hash_file(fd, chunk_size):
+    """Return the MD5 of the content of an open file, read from its offset."""
+    etag = md5(usedforsecurity=False)
+    while True:
+        chunk = do_read(fd, chunk_size)
+        if not chunk:
+            break
+        etag.update(chunk)
+    return etag.hexdigest()
+
+
+class DirectoryCollector:
+    """
+    Removes in background the empty parent directories left by DELETEs, so
+    that the requests do not wait for it and that the directory of many
+    deleted objects is collected once.
+
+    Each device has its own bounded queue of directories, deepest first,
+    served by one green thread collecting at most `rate` directories per
+    second, yielding between two directories. The collection runs in the
+    green thread, as the DELETEs do: the caches of fs_utils and of the
+    metadata it goes through are not safe to use from the eventlet thread
+    pool. A directory already queued is not queued again. Once a directory
+    is removed, its parent is queued, up to the container, sharing the
+    budget of directory entries of the collection it continues.
+
+    :param logger: logger used for metrics
+    :param rate: maximum number of directories collected per second per
+                 device, 0 for no limit
+    :param queue_size: maximum number of directories queued per device
+    :param max_entries: maximum number of entries scanned by the collection
+                        of a directory and of its parents
+    """
+
+    def __init__(self, logger, rate, queue_size, max_entries=None):
+        self._logger = logger
+        self._interval = 1.0 / rate if rate > 0 else 0
+        self._queue_size = queue_size
+        self._max_entries = max_entries
+        self._queues = {}
+        self._pending = set()
+        self._seq = itertools.count()
+
+    def submit(self, device, dir_path, container_path, budget=None):
+        """
+        Queue the collection of a directory and of its parents.
+
+        :param device: device the directory is on
+        :param dir_path: path of the directory
+        :param container_path: path of the container of the directory, which
+                               is never removed
+        :param budget: ScanBudget left to the collection, by default
+                       max_entries
+        :returns: False if the queue of the device is full
+        """
+        if budget is None:
+            budget = ScanBudget(self._max_entries)
+        if dir_path in self._pending:
+            return True
+        queue = self._queues.get(device)
+        if queue is None:
+            queue = self._queues[device] = PriorityQueue(self._queue_size)
+            spawn(self._worker, device, queue)
+        try:
+            queue.put_nowait(
+                (
+                    -dir_path.count(os.path.sep),
+                    next(self._seq),
+                    dir_path,
+                    container_path,
+                    budget,
+                )
+            )
+        except Full:
+            self._logger.increment("dir_gc.dropped")
+            return False
+        self._pending.add(dir_path)
+        self._logger.increment("dir_gc.queued")
+        return True
+
+    def _worker(self, device, queue):
+        while True:
+            _, _, dir_path, container_path, budget = queue.get()
+            self._pending.discard(dir_path)
+            try:
+                removed = rmobjdir(dir_path, budget)
+            except Exception:
+                logging.exception("Could not remove the directory %s" % dir_path)
+                self._logger.increment("dir_gc.errors")
+            else:
+                if removed:
+                    self._logger.increment("dir_gc.removed")
+                    parent = os.path.dirname(dir_path)
+                    if parent.startswith(container_path + os.path.sep):
+                        self.submit(device, parent, container_path, budget)
+                else:
+                    self._logger.increment("dir_gc.kept")
+            sleep(self._interval)
+
+
+def _purge_files(path):
+    """
+    Unlink the files of a directory, relative to its fd, yielding to the
+    other green threads between two files.
+
+    :returns: names of the files removed and of the subdirectories
+    """
+    fd = do_open(path, os.O_RDONLY | os.O_DIRECTORY | os.O_CLOEXEC)
+    try:
+        files = []
+        subdirs = []
+        # The directory is listed before anything is removed from it
+        with do_scandir(fd) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+        for name in files:
+            do_unlinkat(fd, name, os.path.join(path, name))
+            unlink_metadata(os.path.join(path, name))
+            sleep()
+        return files, subdirs
+    finally:
+        do_close(fd)
+
+
+def _purge_dir(path):
+    """
+    Remove an empty directory.
+
+    :returns: True if the directory was an object
+    """
+    try:
+        is_object = dir_is_object(read_metadata(path))
+        do_rmdir(path)
+    except (IOError, OSError) as err:
+        if err.errno != errno.ENOENT:
+            raise
+        # Removed by another entity
+        return False
+    unlink_metadata(path)
+    return is_object
+
+
+class SubtreePurge:
+    """
+    Removes a directory and everything below it, yielding the names of the
+    objects removed, relative to their container, as they are removed.
+
+    Directories are scanned by `workers` green threads, yielding to the
+    requests between two files or directories. They don't use the eventlet
+    thread pool: the caches of fs_utils and of the metadata the purge goes
+    through are not safe to use from it. The files of a directory are
+    unlinked relative to the fd of the directory, and directories are removed
+    bottom-up, once all their subdirectories are removed. A directory which
+    could not be emptied, for instance because of a concurrent PUT, is left
+    in place with its parents.
+
+    :param root: path of the directory to remove
+    :param container_path: path of the container of root
+    :param workers: number of directories processed at the same time
+    """
+
+    def __init__(self, root, container_path, workers=8):
+        self.root = root
+        self.container_path = container_path
+        self.workers = workers
+        self.objects = 0
+        self.directories = 0
+        self.errors = 0
+        self._queue = LightQueue()
+        self._results = LightQueue()
+        # Number of subdirectories left to remove by directory
+        self._subdirs = {}
+        self._outstanding = 0
+
+    def __iter__(self):
+        self._submit(self.root)
+        for _ in range(self.workers):
+            spawn(self._worker)
+        while True:
+            names = self._results.get()
+            if names is None:
+                return
+            yield names
+
+    def _object_name(self, path):
+        return path[len(self.container_path) + 1 :]
+
+    def _submit(self, path):
+        self._outstanding += 1
+        self._queue.put(path)
+
+    def _worker(self):
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+            try:
+                self._scan(path)
+            except Exception:
+                logging.exception("Could not purge the directory %s" % path)
+                self.errors += 1
+            finally:
+                self._outstanding -= 1
+                if not self._outstanding:
+                    for _ in range(self.workers):
+                        self._queue.put(None)
+                    self._results.put(None)
+
+    def _scan(self, path):
+        try:
+            files, subdirs = _purge_files(path)
+        except SwiftOnFileSystemOSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            # Removed by another entity
+            files, subdirs = [], []
+        if files:
+            self.objects += len(files)
+            self._results.put(
+                [self._object_name(os.path.join(path, name)) for name in files]
+            )
+        self._subdirs[path] = len(subdirs)
+        for name in subdirs:
+            self._submit(os.path.join(path, name))
+        if not subdirs:
+            self._remove(path)
+
+    def _remove(self, path):
+        while True:
+            del self._subdirs[path]
+            if _purge_dir(path):
+                self.objects += 1
+                self._results.put([self._object_name(path)])
+            self.directories += 1
+            sleep()
+            if path == self.root:
+                return
+            path = os.path.dirname(path)
+            self._subdirs[path] -= 1
+            if self._subdirs[path]:
+                return
+
+
 class DiskFileReader:
     """
     Encapsulation of the WSGI read context for servicing GET REST API
@@ -782,14 +1497,33 @@ class DiskFileReader:
     :param obj_size: size of object on disk
     :param keep_cache_size: maximum object size that will be kept in cache
     :param keep_cache: should resulting reads be kept in the buffer cache
+    :param shared_read: :class:`SharedRead` to take chunks from when
+                        reading the whole object
+    :param read_ahead: :class:`ReadAhead` to take chunks from when reading
+                       the whole object
+    :param etag_callback: called with the file descriptor and the MD5 of the
+                          object once the whole object has been read
     """
 
     def __init__(
-        self, fd, disk_chunk_size, obj_size, keep_cache_size, keep_cache=False
+        self,
+        fd,
+        disk_chunk_size,
+        obj_size,
+        keep_cache_size,
+        keep_cache=False,
+        shared_read=None,
+        read_ahead=None,
+        etag_callback=None,
     ):
         # Parameter tracking
         self._fd = fd
         self._disk_chunk_size = disk_chunk_size
+        self._obj_size = obj_size
+        self._shared_read = shared_read
+        self._read_ahead = read_ahead
+        self._etag_callback = etag_callback
+        self._etag = md5(usedforsecurity=False) if etag_callback else None
         if keep_cache:
             # Caller suggests we keep this in cache, only do it if the
             # object's size is less than the maximum.
@@ -799,6 +1533,7 @@ class DiskFileReader:
 
         # Internal Attributes
         self._suppress_file_closing = False
+        self._span = tracing.start_span("diskfile.read", size=obj_size)
 
     def __iter__(self):
         """Returns an iterator over the data file."""
@@ -807,11 +1542,13 @@ class DiskFileReader:
             bytes_read = 0
             while True:
                 if self._fd != -1:
-                    chunk = do_read(self._fd, self._disk_chunk_size)
+                    chunk = self._read_chunk(bytes_read)
                 else:
                     chunk = None
                 if chunk:
                     bytes_read += len(chunk)
+                    if self._etag is not None:
+                        self._etag.update(chunk)
                     diff = bytes_read - dropped_cache
                     if diff > (1024 * 1024):
                         self._drop_cache(dropped_cache, diff)
@@ -822,14 +1559,46 @@ class DiskFileReader:
                     # Drop cache
                     if diff > 0:
                         self._drop_cache(dropped_cache, diff)
+                    if self._etag is not None and bytes_read == self._obj_size:
+                        self._etag_callback(self._fd, self._etag.hexdigest())
                     break
         finally:
+            if self._span is not None:
+                self._span.set("bytes", bytes_read)
             # Close
             if not self._suppress_file_closing:
                 self.close()
 
+    def _read_chunk(self, offset):
+        if self._shared_read is not None:
+            chunk = self._shared_read.get_chunk(offset)
+            if chunk is not None:
+                return chunk
+            # Fell behind the other readers, read this chunk on our own
+            return do_pread(self._fd, self._disk_chunk_size, offset)
+        if self._read_ahead is not None:
+            chunk = self._read_ahead.read(offset)
+            if chunk is not None:
+                return chunk
+            return do_pread(self._fd, self._disk_chunk_size, offset)
+        return do_read(self._fd, self._disk_chunk_size)
+
+    def _stop_read_ahead(self):
+        if self._read_ahead is not None:
+            read_ahead, self._read_ahead = self._read_ahead, None
+            read_ahead.stop()
+
+    def _detach_shared_read(self):
+        if self._shared_read is not None:
+            shared_read, self._shared_read = self._shared_read, None
+            shared_read.detach()
+
     def app_iter_range(self, start, stop):
         """Returns an iterator over the data file for range (start, stop)"""
+        # Ranges are read from our own file descriptor and are not hashed
+        self._etag = None
+        self._detach_shared_read()
+        self._stop_read_ahead()
         if start or start == 0:
             do_lseek(self._fd, start, os.SEEK_SET)
         if stop is not None:
@@ -874,6 +1643,10 @@ class DiskFileReader:
         """
         Close the open file handle if present.
         """
+        if self._span is not None:
+            self._span.end()
+        self._detach_shared_read()
+        self._stop_read_ahead()
         if self._fd is not None:
             fd, self._fd = self._fd, None
             if fd > -1:
@@ -910,19 +1683,28 @@ class DiskFile:
         policy=None,
         uid=DEFAULT_UID,
         gid=DEFAULT_GID,
+        defer_etag=False,
         **kwargs,
     ):
         # Variables partition and policy is currently unused.
         self._mgr = mgr
+        # The ETag of a stale object may be computed after the request is
+        # answered, see _create_metadata_without_etag()
+        self._defer_etag = defer_etag and bool(mgr.stream_etag or mgr.etag_materializer)
+        self._unhashed_metadata = None
         self._device_path = dev_path
         self._uid = int(uid)
         self._gid = int(gid)
         self._is_dir = False
         self._metadata = None
+        # Metadata as stored when it was read, spares a read when the
+        # metadata is written back, see read_metadata_stored()
+        self._stored_metadata = None
         self._fd = None
         # This fd attribute is not used in PUT path. fd used in PUT path
         # is encapsulated inside DiskFileWriter object.
         self._stat = None
+        self._chunk_size = mgr.disk_chunk_size
         # Don't store a value for data_file until we know it exists.
         self._data_file = None
 
@@ -988,6 +1770,7 @@ class DiskFile:
             raise DiskFileNotOpen()
         return Timestamp(self._metadata.get(X_TIMESTAMP))
 
+    @tracing.traced("diskfile.open")
     def open(self, modernize=False, current_time=None):
         """
         Open the object.
@@ -1006,27 +1789,47 @@ class DiskFile:
         :raises DiskFileExpired: if the object has expired
         :returns: itself for use as a context manager
         """
+        return self._open_fd(self._open_data_file(), current_time)
+
+    def _open_data_file(self):
+        """
+        Open the data file read-only, the only lookup of its path: all the
+        other operations on the object use the returned fd.
+        """
         # Writes are always performed to a temporary file
         try:
-            self._fd = do_open(self._data_file, os.O_RDONLY | os.O_CLOEXEC)
+            return do_open(self._data_file, os.O_RDONLY | os.O_CLOEXEC, cached=True)
         except SwiftOnFileSystemOSError as err:
-            if err.errno in (errno.ENOENT, errno.ENOTDIR):
+            if err.errno in (errno.ENOENT, errno.ENOTDIR, errno.ESTALE):
                 # If the file does exist, or some part of the path does not
                 # exist, raise the expected DiskFileNotExist
                 raise DiskFileNotExist
             raise
+
+    def _open_fd(self, fd, current_time=None):
+        """
+        Finish opening the object from the fd of its data file, reusing the
+        metadata and stat already read by read_metadata().
+        """
+        self._fd = fd
         try:
             if not self._stat:
                 self._stat = do_fstat(self._fd)
             self._is_dir = stat.S_ISDIR(self._stat.st_mode)
             obj_size = self._stat.st_size
+            if not self._is_dir and self._mgr.adaptive_chunk_size:
+                # Fetched from the layout of the file only by the requests
+                # reading it, see _get_chunk_size()
+                self._chunk_size = None
 
             if not self._metadata:
-                self._metadata = read_metadata(self._fd)
+                self._metadata = read_metadata(self._fd, self._stat)
             if not validate_object(self._metadata, self._stat):
-                self._metadata = create_object_metadata(
-                    self._fd, self._stat, self._metadata
-                )
+                if self._defer_etag and not self._is_dir:
+                    self._create_metadata_without_etag(self._fd)
+                else:
+                    self._metadata = self._revalidate_metadata()
+                    self._stored_metadata = None
             assert self._metadata is not None
             self._filter_metadata()
 
@@ -1059,6 +1862,132 @@ class DiskFile:
         self._disk_file_open = True
         return self
 
+    def _get_chunk_size(self):
+        """
+        Return the size of the reads on the open file. With
+        adaptive_chunk_size, the layout of the file is only fetched on the
+        first call, so that the requests which do not read the file, such as
+        HEADs, do not pay for it.
+        """
+        if self._chunk_size is None:
+            self._chunk_size = self._mgr.get_chunk_size(self._fd, self._stat)
+        return self._chunk_size
+
+    def _revalidate_metadata(self):
+        """
+        Rebuild the stale metadata of the opened object.
+
+        With single_flight_revalidation, concurrent requests of this worker
+        for the same version of the object wait for the first one to rebuild
+        the metadata and reuse it. With revalidation_lock_dir, the workers
+        also take turns on a lock file, and reuse the metadata written by the
+        worker which held it before them.
+        """
+        mgr = self._mgr
+        if not mgr.single_flight_revalidation:
+            return create_object_metadata(
+                self._fd,
+                self._stat,
+                self._metadata,
+                self._get_chunk_size(),
+                self._stored_metadata,
+            )
+
+        key = (self._stat.st_dev, self._stat.st_ino, self._stat.st_mtime_ns)
+        event = mgr.revalidations.get(key)
+        if event is not None:
+            metadata = event.wait()
+            if metadata is not None:
+                mgr.logger.increment("revalidation.coalesced")
+                return metadata.copy()
+            # The request rebuilding the metadata failed, try on our own
+            return create_object_metadata(
+                self._fd, self._stat, self._metadata, self._get_chunk_size()
+            )
+
+        event = mgr.revalidations[key] = Event()
+        metadata = None
+        try:
+            metadata = self._revalidate_metadata_locked(key)
+        finally:
+            del mgr.revalidations[key]
+            event.send(metadata.copy() if metadata is not None else None)
+        return metadata
+
+    def _revalidate_metadata_locked(self, key):
+        mgr = self._mgr
+        if not mgr.revalidation_lock_dir:
+            return create_object_metadata(
+                self._fd,
+                self._stat,
+                self._metadata,
+                self._get_chunk_size(),
+                self._stored_metadata,
+            )
+        lock_path = os.path.join(mgr.revalidation_lock_dir, "%x.%x.%x.lock" % key)
+        try:
+            with lock_file(lock_path, timeout=mgr.revalidation_lock_timeout):
+                # Another worker may have rebuilt the metadata meanwhile
+                metadata = read_metadata(self._fd)
+                if validate_object(metadata, self._stat):
+                    mgr.logger.increment("revalidation.coalesced")
+                    return metadata
+                return create_object_metadata(
+                    self._fd, self._stat, metadata, self._get_chunk_size()
+                )
+        except LockTimeout:
+            logging.warn(
+                "Timeout waiting for the revalidation of %s by another worker"
+                % self._data_file
+            )
+            return create_object_metadata(
+                self._fd, self._stat, self._metadata, self._get_chunk_size()
+            )
+
+    def _create_metadata_without_etag(self, path_or_fd):
+        """
+        Refresh the metadata of a stale object without computing its ETag.
+        The ETag is computed by the reader while the object is served (see
+        _persist_etag()) and/or in background by the ETag materializer, which
+        both persist the metadata once the whole object is read.
+        """
+        metadata = get_object_metadata(path_or_fd, self._stat, compute_etag=False)
+        self._unhashed_metadata = (self._metadata or {}).copy()
+        self._unhashed_metadata.update(metadata)
+        self._metadata = self._unhashed_metadata.copy()
+        if self._mgr.etag_materializer:
+            self._mgr.etag_materializer.submit(
+                self._device_path,
+                self._data_file,
+                self._stat,
+                self._unhashed_metadata,
+                self._get_chunk_size(),
+                self._stored_metadata,
+            )
+
+    def _persist_etag(self, fd, etag):
+        """
+        Persist the metadata of a stale object with the ETag computed by its
+        reader, unless the file was changed while it was read.
+        """
+        try:
+            stats = do_fstat(fd)
+            if not _same_file(stats, self._stat):
+                self._mgr.logger.increment("stream_etag.changed")
+                return
+            restore_metadata(
+                fd,
+                {X_ETAG: etag},
+                self._unhashed_metadata,
+                _stored_if_unchanged(stats, self._stat, self._stored_metadata),
+            )
+        except (OSError, IOError) as err:
+            logging.warn(
+                "Could not persist the ETag of %s: %s" % (self._data_file, err)
+            )
+            return
+        self._mgr.logger.increment("stream_etag.persisted")
+
     def _is_object_expired(self, metadata, current_time=None):
         try:
             x_delete_at = int(metadata["X-Delete-At"])
@@ -1159,6 +2088,7 @@ class DiskFile:
             return False
         return True
 
+    @tracing.traced("diskfile.read_metadata")
     def read_metadata(self, current_time=None):
         """
         Return the metadata for an object without requiring the caller to open
@@ -1168,40 +2098,48 @@ class DiskFile:
         metadata = disk_file.read_metadata()
 
         The operations performed here is very similar to those made in open().
-        This is to avoid opening and closing of file (two syscalls over
-        network). IOW, this optimization addresses the case where the fd
-        returned by open() isn't going to be used i.e the file is not read (GET
-        or metadata recalculation)
+        The path of the object is resolved once, by opening the data file:
+        the metadata and the stat are then read from the fd, which is reused
+        by open() when the metadata is stale. Each resolution of a deep path
+        is a lookup of every component on network filesystems.
 
         :returns: metadata dictionary for an object
         :raises DiskFileError: this implementation will raise the same
                             errors as the `open()` method.
         """
+        fd = self._open_data_file()
         try:
-            self._metadata = read_metadata(self._data_file)
-        except (OSError, IOError) as err:
-            if err.errno in (errno.ENOENT, errno.ESTALE):
-                raise DiskFileNotExist
-            raise err
-
-        if self._metadata and self._is_object_expired(self._metadata, current_time):
-            raise DiskFileExpired(metadata=self._metadata)
-
-        try:
-            self._stat = do_stat(self._data_file)
+            # One fstat, validating both the cached metadata and the object
+            self._stat = do_fstat(fd)
             self._is_dir = stat.S_ISDIR(self._stat.st_mode)
-        except (OSError, IOError) as err:
-            if err.errno in (errno.ENOENT, errno.ESTALE):
+            self._metadata, self._stored_metadata = read_metadata_stored(fd, self._stat)
+            if self._metadata and self._is_object_expired(self._metadata, current_time):
+                raise DiskFileExpired(metadata=self._metadata)
+        except (OSError, IOError, DiskFileExpired) as err:
+            do_close(fd)
+            if getattr(err, "errno", None) in (errno.ENOENT, errno.ESTALE):
                 raise DiskFileNotExist
-            raise err
+            raise
 
         if not validate_object(self._metadata, self._stat):
-            # Metadata is stale/invalid. So open the object for reading
-            # to update Etag and other metadata.
-            with self.open():
+            if self._defer_etag and self._mgr.etag_materializer and not self._is_dir:
+                # The ETag is computed in background, answer without it
+                # meanwhile.
+                try:
+                    self._create_metadata_without_etag(fd)
+                finally:
+                    do_close(fd)
+                self._filter_metadata()
+                return self._metadata
+            # Metadata is stale/invalid. So finish to open the object to
+            # update Etag and other metadata. The object is not read
+            # afterwards, so the ETag can't be computed by its reader.
+            self._defer_etag = False
+            with self._open_fd(fd, current_time):
                 return self.get_metadata()
         else:
-            # Metadata is valid. Don't have to open the file.
+            # Metadata is valid. Don't have to read the file.
+            do_close(fd)
             self._filter_metadata()
             return self._metadata
 
@@ -1220,12 +2158,53 @@ class DiskFile:
         """
         if not self._disk_file_open:
             raise DiskFileNotOpen()
+        shared_read = None
+        if self._mgr.coalesce_reads and not self._is_dir:
+            # Concurrent GETs of the same version of this object (same inode
+            # and mtime) share the disk reads.
+            key = (
+                self._stat.st_dev,
+                self._stat.st_ino,
+                self._stat.st_mtime_ns,
+                self._stat.st_size,
+                self._get_chunk_size(),
+            )
+            if key in self._mgr.shared_reads:
+                self._mgr.logger.increment("coalesced_reads")
+            shared_read = SharedRead.attach(
+                self._mgr.shared_reads,
+                key,
+                self._fd,
+                self._get_chunk_size(),
+                self._mgr.coalesce_reads_max_chunks,
+            )
+        read_ahead = None
+        if (
+            shared_read is None
+            and self._mgr.parallel_reads > 0
+            and not self._is_dir
+            and self._obj_size >= self._mgr.parallel_read_min_size
+        ):
+            stripe_size = self._mgr.parallel_read_stripe_size
+            if not stripe_size:
+                geometry = get_stripe_geometry(self._fd)
+                stripe_size = geometry[0] if geometry else self._get_chunk_size()
+            read_ahead = ReadAhead(
+                self._fd, stripe_size, self._mgr.parallel_reads, self._obj_size
+            )
         dr = DiskFileReader(
             self._fd,
-            self._mgr.disk_chunk_size,
+            self._get_chunk_size(),
             self._obj_size,
             self._mgr.keep_cache_size,
             keep_cache=keep_cache,
+            shared_read=shared_read,
+            read_ahead=read_ahead,
+            etag_callback=(
+                self._persist_etag
+                if self._mgr.stream_etag and self._unhashed_metadata is not None
+                else None
+            ),
         )
         # At this point the reader object is now responsible for closing
         # the file pointer.
@@ -1317,7 +2296,9 @@ class DiskFile:
         """
         metadata = self._keep_sys_metadata(metadata)
         data_file = os.path.join(self._put_datadir, self._obj)
-        write_metadata(data_file, metadata)
+        # The metadata read by read_metadata() is the one written over
+        write_metadata(data_file, metadata, self._stored_metadata)
+        self._stored_metadata = None
 
     def _keep_sys_metadata(self, metadata):
         """
@@ -1330,7 +2311,10 @@ class DiskFile:
         # If metadata has been previously fetched, use that.
         # Stale metadata (outdated size/etag) would've been updated when
         # metadata is fetched for the first time.
-        orig_metadata = self._metadata or read_metadata(self._data_file)
+        if self._metadata:
+            orig_metadata = self._metadata
+        else:
+            orig_metadata, self._stored_metadata = read_metadata_stored(self._data_file)
 
         sys_keys = [
             X_CONTENT_TYPE,
@@ -1357,6 +2341,9 @@ class DiskFile:
         return metadata
 
     def _unlinkold(self):
+        # The directories left are collected scanning at most
+        # dir_gc_max_entries entries in all, whatever their depth
+        budget = ScanBudget(self._mgr.dir_gc_max_entries)
         if self._is_dir:
             # Marker, or object, directory.
             #
@@ -1371,18 +2358,29 @@ class DiskFile:
             if dir_is_object(metadata):
                 metadata[X_OBJECT_TYPE] = DIR_NON_OBJECT
                 write_metadata(self._data_file, metadata)
-            rmobjdir(self._data_file)
+            rmobjdir(self._data_file, budget)
         else:
             # Delete file object
             do_unlink(self._data_file)
+            unlink_metadata(self._data_file)
 
         # Garbage collection of non-object directories.  Now that we
         # deleted the file, determine if the current directory and any
         # parent directory may be deleted.
         dirname = os.path.dirname(self._data_file)
+        collector = self._mgr.dir_collector
+        if (
+            collector
+            and dirname.startswith(self._container_path + os.path.sep)
+            and collector.submit(
+                self._device_path, dirname, self._container_path, budget
+            )
+        ):
+            # Collected in background
+            return
         while dirname and dirname != "/" and dirname != self._container_path:
             # Try to remove any directories that are not objects.
-            if not rmobjdir(dirname):
+            if not rmobjdir(dirname, budget):
                 # If a directory with objects has been found, we can stop
                 # garabe collection
                 break
@@ -15,8 +15,10 @@
 
 """ Object Server for Gluster for Swift """
 
+import json
 import os
-from eventlet import Timeout
+import stat
+from eventlet import GreenPool, Timeout, corolocal
 
 from swift import gettext_ as _
 from swift.common.swob import (
@@ -27,12 +29,14 @@ from swift.common.swob import (
     HTTPNotFound,
     Response,
     HTTPServerError,
+    HTTPInsufficientStorage,
 )
 from swift.common.utils import (
     public,
     timing_stats,
     replication,
     config_true_value,
+    list_from_csv,
     Timestamp,
 )
 from swift.common.request_helpers import get_name_and_placement, split_and_validate_path
@@ -47,9 +51,27 @@ from swift.common.exceptions import (
     InvalidAccountInfo,
 )
 
-from swiftonfile.swift.obj.diskfile import DiskFileManager
+from swiftonfile.swift.obj.diskfile import DiskFileManager, SubtreePurge
 from swiftonfile.swift.common.constraints import check_object_creation
-from swiftonfile.swift.common import utils
+from swiftonfile.swift.common import devmonitor, fs_utils, tracing, utils
+from swiftonfile.swift.common.devmonitor import DeviceMonitor
+from swiftonfile.swift.common.fs_utils import do_stat
+from swiftonfile.swift.common.profiler import SamplingProfiler
+from swiftonfile.swift.common.shmcache import SharedMetadataCache, DEFAULT_SLOT_SIZE
+from swiftonfile.swift.common.sqlitestore import SqliteMetadataStore
+from swiftonfile.swift.common.watchdog import HubWatchdog
+
+METADATA_CACHE_PATH = "/dev/shm/swiftonfile-metadata-cache"
+SQLITE_METADATA_DIR = "/var/lib/swiftonfile/metadata"
+PURGE_WORKERS = 8
+PURGE_UPDATE_CONCURRENCY = 16
+TRACE_FILE_MAX_BYTES = 100 * 1024 * 1024
+TRACE_FILE_BACKUPS = 5
+TRACE_BUFFER_SPANS = 256
+TRACE_FLUSH_INTERVAL = 1
+PROFILE_INTERVAL = 0.01
+PROFILE_DURATION = 60
+DEVICE_MONITOR_PROBE_TIMEOUT = 10
 
 
 class SwiftOnFileDiskFileRouter:
@@ -88,9 +110,168 @@ class ObjectController(server.ObjectController):
         utils.read_pickled_metadata = config_true_value(
             conf.get("read_pickled_metadata", "no")
         )
+        metadata_format = conf.get("metadata_format", "json").lower()
+        if metadata_format not in ("json", "binary"):
+            raise ValueError(
+                "metadata_format must be json or binary, not %r" % metadata_format
+            )
+        utils.metadata_format = metadata_format
+        metadata_layout = conf.get("metadata_layout", "blob").lower()
+        if metadata_layout not in ("blob", "keys"):
+            raise ValueError(
+                "metadata_layout must be blob or keys, not %r" % metadata_layout
+            )
+        utils.metadata_layout = metadata_layout
+        devices = conf.get("devices", "/srv/node")
+        utils.metadata_stores = {}
+        for device in list_from_csv(conf.get("sqlite_metadata_devices")):
+            store = SqliteMetadataStore(
+                os.path.join(devices, device),
+                os.path.join(
+                    conf.get("sqlite_metadata_dir", SQLITE_METADATA_DIR), device
+                ),
+            )
+            utils.metadata_stores[store.device_path] = store
+        metadata_cache_size = int(conf.get("metadata_cache_size", 0))
+        if metadata_cache_size <= 0:
+            utils.metadata_cache = None
+        elif config_true_value(conf.get("metadata_cache_shared", "no")):
+            utils.metadata_cache = SharedMetadataCache(
+                conf.get("metadata_cache_path", METADATA_CACHE_PATH),
+                metadata_cache_size,
+                int(conf.get("metadata_cache_slot_size", DEFAULT_SLOT_SIZE)),
+                self.logger,
+            )
+        else:
+            utils.metadata_cache = utils.MetadataCache(metadata_cache_size, self.logger)
+
+        stat_cache_ttl = float(conf.get("stat_cache_ttl", 0))
+        stat_cache_device_ttls = {}
+        for item in list_from_csv(conf.get("stat_cache_device_ttls")):
+            device, ttl = item.rsplit(":", 1)
+            stat_cache_device_ttls[os.path.join(devices, device)] = float(ttl)
+        if stat_cache_ttl > 0 or any(
+            ttl > 0 for ttl in stat_cache_device_ttls.values()
+        ):
+            fs_utils.stat_cache = fs_utils.StatCache(
+                stat_cache_ttl,
+                stat_cache_device_ttls,
+                int(conf.get("stat_cache_size", 10000)),
+                self.logger,
+            )
+        else:
+            fs_utils.stat_cache = None
+
+        if fs_utils.dir_fd_cache is not None:
+            fs_utils.dir_fd_cache.close()
+        dir_fd_cache_size = int(conf.get("dir_fd_cache_size", 0))
+        if dir_fd_cache_size > 0:
+            fs_utils.dir_fd_cache = fs_utils.DirFdCache(devices, dir_fd_cache_size)
+        else:
+            fs_utils.dir_fd_cache = None
+
+        fs_stats_sample_rate = float(conf.get("fs_stats_sample_rate", 0))
+        if fs_stats_sample_rate > 0:
+            fs_utils.syscall_stats = fs_utils.SyscallStats(
+                self.logger,
+                devices,
+                fs_stats_sample_rate,
+                float(conf.get("fs_stats_interval", 10)),
+            )
+        else:
+            fs_utils.syscall_stats = None
+
+        if getattr(self, "hub_watchdog", None) is not None:
+            self.hub_watchdog.stop()
+        hub_stall_threshold_ms = float(conf.get("hub_stall_threshold_ms", 0))
+        if hub_stall_threshold_ms > 0:
+            self.hub_watchdog = HubWatchdog(
+                hub_stall_threshold_ms / 1000, devices, self.logger
+            )
+        else:
+            self.hub_watchdog = None
+
+        if tracing.tracer is not None:
+            tracing.tracer.close()
+        trace_file = conf.get("trace_file")
+        if trace_file:
+            tracing.tracer = tracing.Tracer(
+                trace_file,
+                float(conf.get("trace_sample_rate", 1)),
+                int(conf.get("trace_file_max_bytes", TRACE_FILE_MAX_BYTES)),
+                int(conf.get("trace_file_backups", TRACE_FILE_BACKUPS)),
+                buffer_spans=int(conf.get("trace_buffer_spans", TRACE_BUFFER_SPANS)),
+                flush_interval=float(
+                    conf.get("trace_flush_interval", TRACE_FLUSH_INTERVAL)
+                ),
+            )
+        else:
+            tracing.tracer = None
+
+        profile_dir = conf.get("profile_dir")
+        if profile_dir:
+            self.profiler = SamplingProfiler(
+                profile_dir,
+                "object-server",
+                float(conf.get("profile_interval", PROFILE_INTERVAL)),
+                float(conf.get("profile_duration", PROFILE_DURATION)),
+                float(conf.get("profile_workers", 0)),
+            )
+            self.profiler.install_signal()
+        else:
+            self.profiler = None
+
+        if devmonitor.monitor is not None:
+            devmonitor.monitor.stop()
+        device_monitor_interval = float(conf.get("device_monitor_interval", 0))
+        if device_monitor_interval > 0:
+            devmonitor.monitor = DeviceMonitor(
+                devices,
+                config_true_value(conf.get("mount_check", "true")),
+                device_monitor_interval,
+                float(
+                    conf.get(
+                        "device_monitor_probe_timeout", DEVICE_MONITOR_PROBE_TIMEOUT
+                    )
+                ),
+                self.logger,
+            )
+        else:
+            devmonitor.monitor = None
+
+        # Subtrees can be removed in one PURGE request
+        self.allow_prefix_purge = config_true_value(
+            conf.get("allow_prefix_purge", "false")
+        )
+        self.purge_workers = int(conf.get("purge_workers", PURGE_WORKERS))
+        self.purge_update_concurrency = int(
+            conf.get("purge_update_concurrency", PURGE_UPDATE_CONCURRENCY)
+        )
 
         self.swift_dir = conf.get("swift_dir", "/etc/swift")
 
+        # State of the request being served by the current green thread
+        self._request_local = corolocal.local()
+
+    def __call__(self, env, start_response):
+        if self.hub_watchdog is not None:
+            self.hub_watchdog.start()
+        if self.profiler is not None:
+            self.profiler.attach()
+        if devmonitor.monitor is not None:
+            devmonitor.monitor.start()
+        return tracing.traced_request(env, start_response, super().__call__)
+
+    def get_diskfile(
+        self, device, partition, account, container, obj, policy, **kwargs
+    ):
+        if getattr(self._request_local, "defer_etag", False):
+            kwargs["defer_etag"] = True
+        return super().get_diskfile(
+            device, partition, account, container, obj, policy, **kwargs
+        )
+
+    @tracing.traced("watcher_container_list")
     def watcher_container_list(
         self, container_path, host, partition, contdevice, subfolder=None
     ):
@@ -134,6 +315,7 @@ class ObjectController(server.ObjectController):
             )
         )
 
+    @tracing.traced("watcher_container_update")
     def watcher_container_update(
         self, op, container_path, obj, host, partition, contdevice, headers_out
     ):
@@ -176,6 +358,10 @@ class ObjectController(server.ObjectController):
             )
         )
 
+    @tracing.traced("container_update")
+    def container_update(self, *args, **kwargs):
+        return super().container_update(*args, **kwargs)
+
     @public
     @timing_stats()
     def PUT(self, request):
@@ -189,6 +375,22 @@ class ObjectController(server.ObjectController):
             if error_response:
                 return error_response
 
+            # reject up front an object larger than the free space
+            if devmonitor.monitor is not None:
+                free_bytes = devmonitor.monitor.free_bytes(device)
+                if free_bytes is not None:
+                    try:
+                        fsize = request.message_length()
+                        if fsize is None:
+                            fsize = int(
+                                request.headers.get("X-Backend-Obj-Content-Length")
+                            )
+                    except (TypeError, ValueError):
+                        fsize = None
+                    if fsize is not None and fsize > free_bytes:
+                        self.logger.increment("PUT.no_space")
+                        return HTTPInsufficientStorage(drive=device, request=request)
+
             # now call swift's PUT method
             return server.ObjectController.PUT(self, request)
         except (AlreadyExistsAsFile, AlreadyExistsAsDir):
@@ -197,6 +399,39 @@ class ObjectController(server.ObjectController):
         except InvalidAccountInfo as e:
             return HTTPConflict(request=request, body=str(e))
 
+    def _handle_deferring_etag(self, handler, request):
+        """
+        Call Swift's GET or HEAD handler. The ETag of an object changed
+        outside of Swift may be computed after the request is answered (see
+        stream_etag and etag_materializer), when the response does not depend
+        on it: no Range and no If-Match or If-None-Match condition. Such a
+        response has no ETag but a X-Etag-Pending header.
+        """
+        self._request_local.defer_etag = not any(
+            header in request.headers
+            for header in (
+                "Range",
+                "If-Match",
+                "If-None-Match",
+                "X-Backend-Etag-Is-At",
+            )
+        )
+        try:
+            resp = handler(self, request)
+        finally:
+            self._request_local.defer_etag = False
+        if resp.is_success and "Etag" not in resp.headers:
+            resp.headers["X-Etag-Pending"] = "true"
+        return resp
+
+    @public
+    def GET(self, request):
+        return self._handle_deferring_etag(server.ObjectController.GET, request)
+
+    @public
+    def HEAD(self, request):
+        return self._handle_deferring_etag(server.ObjectController.HEAD, request)
+
     @public
     @timing_stats()
     def PATCH(self, request):
@@ -346,6 +581,128 @@ class ObjectController(server.ObjectController):
 
         return HTTPServerError("status error {}".format(response.status))
 
+    @public
+    @timing_stats()
+    def PURGE(self, request):
+        """
+        Must be called as PURGE http://ip:port/device/account/container/prefix
+
+        Example:
+        curl
+            --request PURGE
+            http://localhost:6200/lustre/AUTH_696257/container1/scratch/run42
+
+        This method removes the directory prefix of the container and
+        everything below it, as a DELETE of each object would, and updates
+        the container listing. The response streams the progress as JSON
+        lines, the last one having "done" set.
+        """
+        if not self.allow_prefix_purge:
+            return HTTPNotImplemented(request=request)
+        device, account, container, prefix, policy = get_name_and_placement(
+            request, 4, 4, True
+        )
+        # The prefix must not leave the container: no empty, . or ..
+        # component
+        error_response = check_object_creation(request, prefix)
+        if error_response:
+            return error_response
+
+        container_ring = Ring(self.swift_dir, ring_name="container")
+        contpartition, updates = container_ring.get_nodes(account, container)
+        u = updates[0]  # only one container nodes (distributed by fs)
+
+        disk_file = self.get_diskfile(
+            device, contpartition, account, container, prefix, policy=policy
+        )
+        root = os.path.normpath(disk_file._data_file)
+        if not root.startswith(
+            os.path.normpath(disk_file._container_path) + os.path.sep
+        ):
+            return HTTPBadRequest(
+                body="Invalid prefix %r" % prefix,
+                request=request,
+                content_type="text/plain",
+            )
+        stats = do_stat(root)
+        if not stats or not stat.S_ISDIR(stats.st_mode):
+            return HTTPNotFound(request=request)
+
+        update_headers = HeaderKeyDict(
+            {
+                "x-timestamp": request.headers.get("x-timestamp")
+                or Timestamp.now().internal,
+                "x-trans-id": request.headers.get("x-trans-id", "-"),
+                "referer": request.as_referer(),
+                "X-Backend-Storage-Policy-Index": int(policy),
+            }
+        )
+        purge = SubtreePurge(root, disk_file._container_path, self.purge_workers)
+        return Response(
+            app_iter=self._purge_iter(
+                purge,
+                account,
+                container,
+                ":".join([u["ip"], str(u["port"])]),
+                str(contpartition),
+                u["device"],
+                update_headers,
+                device,
+                policy,
+            ),
+            content_type="application/json",
+            request=request,
+        )
+
+    def _purge_iter(
+        self,
+        purge,
+        account,
+        container,
+        host,
+        partition,
+        contdevice,
+        headers_out,
+        objdevice,
+        policy,
+    ):
+        """
+        Run a SubtreePurge, sending the container updates of the objects
+        removed, purge_update_concurrency at a time, and yield its progress.
+        """
+        pool = GreenPool(self.purge_update_concurrency)
+        for names in purge:
+            for name in names:
+                pool.spawn_n(
+                    self.async_update,
+                    "DELETE",
+                    account,
+                    container,
+                    name,
+                    host,
+                    partition,
+                    contdevice,
+                    HeaderKeyDict(headers_out),
+                    objdevice,
+                    policy,
+                )
+            yield self._purge_progress(purge, False)
+        pool.waitall()
+        yield self._purge_progress(purge, True)
+
+    def _purge_progress(self, purge, done):
+        return (
+            json.dumps(
+                {
+                    "objects": purge.objects,
+                    "directories": purge.directories,
+                    "errors": purge.errors,
+                    "done": done,
+                }
+            )
+            + "\n"
+        ).encode("utf-8")
+
     @public
     @replication
     @timing_stats(sample_rate=0.1)
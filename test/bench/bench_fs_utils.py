@@ -0,0 +1,81 @@
+""" Measure the overhead of the syscall statistics of fs_utils
+
+Usage: python test/bench/bench_fs_utils.py [iterations] [sample_rate]
+
+The cost of the timed() wrapper is measured on a function doing nothing, with
+the statistics disabled and enabled, and compared with the latency of the
+calls made by the object server. Timings are too noisy to compare the
+wrapped and unwrapped calls directly.
+"""
+
+import os
+import sys
+import tempfile
+import timeit
+
+from swift.common.utils import get_logger
+
+from swiftonfile.swift.common import fs_utils
+
+
+def bench(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) * 1e6 / number
+
+
+if __name__ == "__main__":
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sample_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "sda1", "obj")
+    os.mkdir(os.path.dirname(path))
+    open(path, "w").close()
+    logger = get_logger(
+        {"log_statsd_host": "127.0.0.1", "log_statsd_port": "9"}, "bench"
+    )
+    chunk = b"x" * 65536
+
+    def write():
+        fd = fs_utils.do_open(path, os.O_WRONLY)
+        fs_utils.do_write(fd, chunk)
+        fs_utils.do_fsync(fd)
+        fs_utils.do_close(fd)
+
+    def noop(path):
+        pass
+
+    timed_noop = fs_utils.timed("noop")(noop)
+    try:
+        base = bench(lambda: noop(path), number)
+        fs_utils.syscall_stats = None
+        disabled = bench(lambda: timed_noop(path), number) - base
+        fs_utils.syscall_stats = fs_utils.SyscallStats(logger, tmpdir, sample_rate)
+        enabled = bench(lambda: timed_noop(path), number) - base
+        fs_utils.syscall_stats = None
+        print("overhead per call")
+        print("  %-36s %8.3f us" % ("stats disabled", disabled))
+        print("  %-36s %8.3f us" % ("stats enabled", enabled))
+        print("latency and overhead of the stats (disabled, enabled)")
+        for name, func, calls, n in (
+            ("stat", lambda: fs_utils.do_stat(path), 1, number),
+            (
+                "open and close",
+                lambda: fs_utils.do_close(fs_utils.do_open(path, os.O_RDONLY)),
+                2,
+                number,
+            ),
+            ("open, write 64 KiB, fsync, close", write, 4, max(1, number // 100)),
+        ):
+            latency = bench(func, n)
+            print(
+                "  %-36s %8.3f us %7.2f%% %7.2f%%"
+                % (
+                    name,
+                    latency,
+                    disabled * calls * 100 / latency,
+                    enabled * calls * 100 / latency,
+                )
+            )
+    finally:
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+        os.rmdir(tmpdir)
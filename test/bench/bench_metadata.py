@@ -0,0 +1,53 @@
+""" Compare the cost and size of the JSON and binary metadata formats
+
+Usage: python test/bench/bench_metadata.py [iterations]
+"""
+
+import sys
+import timeit
+
+from swiftonfile.swift.common.utils import (
+    MAX_XATTR_SIZE,
+    deserialize_metadata,
+    serialize_metadata,
+)
+
+OBJECT_METADATA = {
+    "name": "/AUTH_test/container/path/to/an/object.dat",
+    "Content-Type": "application/octet-stream",
+    "Content-Length": "10485760",
+    "X-Timestamp": "1700000000.12345",
+    "X-Type": "Object",
+    "ETag": "d41d8cd98f00b204e9800998ecf8427e",
+    "X-Object-Type": "file",
+    "X-Object-PUT-Mtime": "1700000000.123456",
+}
+
+USER_METADATA = dict(OBJECT_METADATA)
+USER_METADATA.update(
+    ("X-Object-Meta-Key-%d" % i, "value %d é" % i * 40) for i in range(500)
+)
+
+
+def bench(name, metadata, number):
+    print(name)
+    for fmt in ("json", "binary"):
+        metastr = serialize_metadata(metadata, fmt)
+        encode = timeit.timeit(lambda: serialize_metadata(metadata, fmt), number=number)
+        decode = timeit.timeit(lambda: deserialize_metadata(metastr), number=number)
+        print(
+            "  %-6s %7d bytes %3d xattrs  encode %6.2f us  decode %6.2f us"
+            % (
+                fmt,
+                len(metastr),
+                -(-len(metastr) // MAX_XATTR_SIZE),
+                encode * 1e6 / number,
+                decode * 1e6 / number,
+            )
+        )
+
+
+if __name__ == "__main__":
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    bench("object metadata", OBJECT_METADATA, number)
+    bench("500 user metadata", USER_METADATA, max(1, number // 100))
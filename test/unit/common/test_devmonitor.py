@@ -0,0 +1,94 @@
+""" Tests for swiftonfile.swift.common.devmonitor """
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from eventlet import sleep
+
+from swiftonfile.swift.common import devmonitor
+from swiftonfile.swift.common.devmonitor import DeviceMonitor
+
+
+class TestDeviceMonitor(unittest.TestCase):
+    """Tests for swiftonfile.swift.common.devmonitor.DeviceMonitor"""
+
+    def setUp(self):
+        self.devices = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.devices, "sda1"))
+        self.logger = mock.Mock()
+        self.monitor = DeviceMonitor(self.devices, False, 0.05, 1, self.logger)
+
+    def tearDown(self):
+        self.monitor.stop()
+        shutil.rmtree(self.devices)
+
+    def test_probe(self):
+        self.assertIsNone(self.monitor.available("sda1"))
+        self.assertIsNone(self.monitor.free_bytes("sda1"))
+        health = self.monitor.probe("sda1")
+        st = os.statvfs(self.devices)
+        self.assertTrue(health.mounted)
+        self.assertEqual(
+            health.free_bytes // 2**20, st.f_bavail * st.f_frsize // 2**20
+        )
+        self.assertTrue(self.monitor.available("sda1"))
+        self.assertEqual(self.monitor.free_bytes("sda1"), health.free_bytes)
+        self.logger.timing.assert_called_once_with(
+            "device_probe.sda1", health.latency * 1000
+        )
+
+    def test_probe_unmounted(self):
+        self.monitor.mount_check = True
+        health = self.monitor.probe("sda1")
+        self.assertFalse(health.mounted)
+        self.assertFalse(self.monitor.available("sda1"))
+        self.assertIsNone(self.monitor.free_bytes("sda1"))
+        self.assertFalse(self.monitor.probe("missing").mounted)
+
+    def test_probe_error(self):
+        with mock.patch("os.statvfs", side_effect=OSError(5, "EIO")):
+            health = self.monitor.probe("sda1")
+        self.assertFalse(health.mounted)
+        self.assertFalse(self.monitor.available("sda1"))
+
+    def test_no_inodes(self):
+        st = os.statvfs_result((4096, 4096, 100, 50, 50, 10, 0, 0, 0, 255))
+        with mock.patch("os.statvfs", return_value=st):
+            self.monitor.probe("sda1")
+        self.assertEqual(self.monitor.free_bytes("sda1"), 0)
+        # Not counting inodes
+        st = os.statvfs_result((4096, 4096, 100, 50, 50, 0, 0, 0, 0, 255))
+        with mock.patch("os.statvfs", return_value=st):
+            self.monitor.probe("sda1")
+        self.assertEqual(self.monitor.free_bytes("sda1"), 50 * 4096)
+
+    def test_stale(self):
+        self.monitor.probe("sda1")
+        self.monitor.health["sda1"].checked -= self.monitor.max_age
+        self.assertIsNone(self.monitor.available("sda1"))
+        self.assertIsNone(self.monitor.free_bytes("sda1"))
+
+    def test_hung_probe(self):
+        self.monitor.probe("sda1")
+        self.monitor._probing = "sda1"
+        self.monitor._probe_start = devmonitor.time.monotonic()
+        self.assertTrue(self.monitor.available("sda1"))
+        self.monitor._probe_start -= 2
+        self.assertFalse(self.monitor.available("sda1"))
+        self.assertIsNone(self.monitor.available("sdb1"))
+
+    def test_probe_all(self):
+        self.monitor.probe("gone")
+        self.monitor.probe_all()
+        self.assertEqual(list(self.monitor.health), ["sda1"])
+
+    def test_start(self):
+        self.monitor.start()
+        sleep(0.01)
+        self.assertTrue(self.monitor.available("sda1"))
+        os.rmdir(os.path.join(self.devices, "sda1"))
+        sleep(0.1)
+        self.assertIsNone(self.monitor.available("sda1"))
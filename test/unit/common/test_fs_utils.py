@@ -237,6 +237,280 @@ class TestFsUtils(unittest.TestCase):
             os.close(fd)
             os.remove(tmpfile)
 
+    def test_do_pread(self):
+        fd, tmpfile = mkstemp()
+        try:
+            os.write(fd, b"0123456789")
+            assert fs.do_pread(fd, 4, 3) == b"3456"
+            assert fs.do_pread(fd, 4, 8) == b"89"
+            assert fs.do_pread(fd, 4, 10) == b""
+        finally:
+            os.close(fd)
+            os.remove(tmpfile)
+
+    def test_do_pread_err(self):
+        fd, tmpfile = mkstemp()
+        try:
+            fd1 = os.open(tmpfile, os.O_WRONLY)
+            try:
+                fs.do_pread(fd1, 4, 0)
+            except SwiftOnFileSystemOSError:
+                pass
+            else:
+                self.fail("SwiftOnFileSystemOSError expected")
+            finally:
+                os.close(fd1)
+        finally:
+            os.close(fd)
+            os.remove(tmpfile)
+
+    def test_do_getxattr_into(self):
+        fd, tmpfile = mkstemp()
+        try:
+            try:
+                fs.do_setxattr(fd, "user.test", b"value")
+            except IOError as err:
+                if err.errno == errno.EOPNOTSUPP:
+                    raise SkipTest("xattrs are not supported")
+                raise
+            assert "user.test" in fs.do_listxattr(fd)
+            for path in (fd, tmpfile):
+                buf = bytearray(10)
+                assert fs.do_getxattr_into(path, "user.test", buf, 2) == 5
+                assert buf == b"\0\0value\0\0\0"
+            try:
+                fs.do_getxattr_into(fd, "user.test", bytearray(3))
+            except IOError as err:
+                assert err.errno == errno.ERANGE
+            else:
+                self.fail("IOError expected")
+            try:
+                fs.do_getxattr_into(fd, "user.missing", bytearray(3))
+            except IOError as err:
+                assert err.errno == errno.ENODATA
+            else:
+                self.fail("IOError expected")
+        finally:
+            os.close(fd)
+            os.remove(tmpfile)
+
+    def test_stat_cache(self):
+        logger = Mock()
+        cache = fs.StatCache(10, {"/dev/b": 0}, size=2, logger=logger)
+        assert cache.get("/dev/a/x") == (False, None)
+        cache.set("/dev/a/x", None)
+        cache.set("/dev/b/x", "stats")
+        assert cache.get("/dev/a/x") == (True, None)
+        # Device without cache
+        assert cache.get("/dev/b/x") == (False, None)
+        assert (cache.hits, cache.misses) == (1, 2)
+        logger.increment.assert_called_with("stat_cache.misses")
+        # LRU eviction
+        cache.set("/dev/a/y", "y")
+        cache.set("/dev/a/z", "z")
+        assert cache.get("/dev/a/x") == (False, None)
+        assert cache.get("/dev/a/y") == (True, "y")
+        cache.invalidate("/dev/a/y")
+        assert cache.get("/dev/a/y") == (False, None)
+        # Expiry
+        with patch.object(fs.time, "monotonic", return_value=1e12):
+            assert cache.get("/dev/a/z") == (False, None)
+
+    def test_do_stat_cached(self):
+        tmpdir = mkdtemp()
+        path = os.path.join(tmpdir, "file")
+        fs.stat_cache = fs.StatCache(60)
+        try:
+            assert fs.get_cached_stat(path) == (False, None)
+            assert fs.do_stat(path, cached=True) is None
+            assert fs.get_cached_stat(path) == (True, None)
+            # Negative entries fail do_open without a syscall
+            with patch("os.open") as mock_open:
+                try:
+                    fs.do_open(path, os.O_RDONLY, cached=True)
+                except SwiftOnFileSystemOSError as err:
+                    assert err.errno == errno.ENOENT
+                else:
+                    self.fail("SwiftOnFileSystemOSError expected")
+                assert not mock_open.called
+            # Creating the file invalidates the entry
+            fd = fs.do_open(path, os.O_WRONLY | os.O_CREAT)
+            os.close(fd)
+            assert fs.get_cached_stat(path) == (False, None)
+            stats = fs.do_stat(path, cached=True)
+            with patch.object(fs, "_do_stat") as mock_stat:
+                assert fs.do_stat(path, cached=True) is stats
+                assert not mock_stat.called
+            other = os.path.join(tmpdir, "other")
+            fs.do_rename(path, other)
+            assert fs.get_cached_stat(path) == (False, None)
+            fs.do_stat(other, cached=True)
+            fs.do_unlink(other)
+            assert fs.get_cached_stat(other) == (False, None)
+            # do_open records missing paths
+            self.assertRaises(
+                SwiftOnFileSystemOSError, fs.do_open, path, os.O_RDONLY, cached=True
+            )
+            assert fs.get_cached_stat(path) == (True, None)
+            fs.do_mkdir(path)
+            assert fs.get_cached_stat(path) == (False, None)
+            fs.set_cached_stat(path, None)
+            fs.do_rmdir(path)
+            assert fs.get_cached_stat(path) == (False, None)
+            # ENOENT below cached directories
+            fs.do_stat(tmpdir, cached=True)
+            fs.do_stat(path, cached=True)
+            fs.invalidate_cached_parents(os.path.join(path, "file"))
+            assert fs.get_cached_stat(tmpdir) == (False, None)
+            assert fs.get_cached_stat(path) == (False, None)
+        finally:
+            fs.stat_cache = None
+            shutil.rmtree(tmpdir)
+
+    def test_syscall_stats(self):
+        tmpdir = mkdtemp()
+        logger = Mock()
+        stats = fs.SyscallStats(logger, tmpdir)
+        fs.syscall_stats = stats
+        try:
+            device_path = os.path.join(tmpdir, "sda1")
+            fs.do_mkdir(device_path)
+            path = os.path.join(device_path, "missing")
+            self.assertRaises(SwiftOnFileSystemOSError, fs.do_open, path, os.O_RDONLY)
+            fd, tmpfile = mkstemp(dir=tmpdir)
+            fs.do_fstat(fd)
+            os.close(fd)
+            assert not fs.do_ismount(device_path)
+            assert list(fs.do_walk(device_path)) == [(device_path, [], [])]
+            eio = OSError(errno.EIO, os.strerror(errno.EIO))
+            with patch("os.stat", side_effect=[eio, eio, os.stat(tmpfile)]):
+                with patch.object(fs, "sleep"):
+                    assert fs.do_stat(device_path)
+            # Nothing is sent before the interval elapsed
+            assert not logger.update_stats.called
+            with patch.object(fs.time, "monotonic", return_value=1):
+                stats._histograms[("stat", None)] = [0, 2, 1, 0, 0, 0, 0, 500]
+                stats.flush()
+            assert stats._next_flush == 11
+            sent = dict(call[0] for call in logger.update_stats.call_args_list)
+            assert sent["fs.mkdir.sda1.latency.le_inf"] == 1
+            assert sent["fs.mkdir.sda1.latency.count"] == 1
+            assert sent["fs.open.sda1.latency.count"] == 1
+            assert sent["fs.open.sda1.errors.ENOENT"] == 1
+            assert sent["fs.fstat.latency.count"] == 1
+            assert sent["fs.ismount.sda1.latency.count"] == 1
+            assert sent["fs.walk.sda1.latency.count"] == 1
+            assert sent["fs.stat.sda1.latency.count"] == 1
+            assert sent["fs.stat.sda1.eio_retries"] == 2
+            assert "fs.stat.latency.le_10us" not in sent
+            assert sent["fs.stat.latency.le_100us"] == 2
+            assert sent["fs.stat.latency.le_1000us"] == 3
+            assert sent["fs.stat.latency.le_inf"] == 3
+            assert sent["fs.stat.latency.sum_us"] == 500
+            # The counts of the sampled calls are scaled
+            logger.reset_mock()
+            stats.sample_rate = 0.5
+            with patch.object(fs.random, "random", side_effect=[0.2, 0.7]):
+                fs.do_stat(device_path)
+                fs.do_stat(device_path)
+            stats.flush()
+            logger.update_stats.assert_any_call("fs.stat.sda1.latency.count", 2)
+            # The calls of other threads are recorded, not flushed by them
+            logger.reset_mock()
+            stats.sample_rate = 1
+            stats._next_flush = 0
+            thread = fs._threading.Thread(target=fs.do_stat, args=(device_path,))
+            thread.start()
+            thread.join()
+            assert not logger.update_stats.called
+            stats.flush()
+            logger.update_stats.assert_any_call("fs.stat.sda1.latency.count", 1)
+            # Nothing is recorded without syscall_stats
+            fs.syscall_stats = None
+            fs.do_stat(device_path)
+            assert not stats._histograms
+        finally:
+            fs.syscall_stats = None
+            shutil.rmtree(tmpdir)
+
+    def test_dir_fd_cache(self):
+        tmpdir = mkdtemp()
+        container = os.path.join(tmpdir, "sda1", "AUTH_a", "c")
+        os.makedirs(os.path.join(container, "dir"))
+        cache = fs.DirFdCache(tmpdir, size=1)
+        fs.dir_fd_cache = cache
+        try:
+            assert cache.lookup(container) == (None, container)
+            assert cache.lookup(container + "/") == (None, container + "/")
+            fd, name = cache.lookup(os.path.join(container, "dir", "obj"))
+            assert name == "dir/obj"
+            assert list(cache._fds) == [container]
+            assert cache.lookup(os.path.join(container, "obj")) == (fd, "obj")
+
+            path = os.path.join(container, "dir", "obj")
+            with patch("os.open", wraps=os.open) as mock_open:
+                fs.do_close(fs.do_open(path, os.O_WRONLY | os.O_CREAT))
+            mock_open.assert_called_once_with(
+                "dir/obj", os.O_WRONLY | os.O_CREAT, 0o777, dir_fd=fd
+            )
+            assert fs.do_stat(path).st_size == 0
+            fs.do_rename(path, os.path.join(container, "obj"))
+            fs.do_mkdir(os.path.join(container, "dir2"))
+            fs.do_rmdir(os.path.join(container, "dir"))
+            assert sorted(os.listdir(container)) == ["dir2", "obj"]
+            fs.do_unlink(os.path.join(container, "obj"))
+            assert fs.do_stat(os.path.join(container, "obj")) is None
+
+            # The container is replaced behind our back
+            shutil.rmtree(container)
+            os.makedirs(container)
+            path = os.path.join(container, "obj")
+            fs.do_close(fs.do_open(path, os.O_WRONLY | os.O_CREAT))
+            assert os.listdir(container) == ["obj"]
+            assert list(cache._fds) == []
+            assert cache.lookup(path) != (None, path)
+            # The least recently used fd is closed
+            other = os.path.join(tmpdir, "sda1", "AUTH_a", "c2")
+            os.mkdir(other)
+            cache.lookup(os.path.join(other, "obj"))
+            assert list(cache._fds) == [other]
+            # Removing a container closes its fd
+            fs.do_rmdir(other)
+            assert list(cache._fds) == []
+        finally:
+            fs.dir_fd_cache = None
+            cache.close()
+            shutil.rmtree(tmpdir)
+
+    def test_dir_fd_cache_other_thread(self):
+        tmpdir = mkdtemp()
+        container = os.path.join(tmpdir, "sda1", "AUTH_a", "c")
+        os.makedirs(os.path.join(container, "dir"))
+        path = os.path.join(container, "dir", "obj")
+        cache = fs.DirFdCache(tmpdir)
+        try:
+            cache.lookup(path)
+            # Another thread uses the full path and never closes an fd
+            with patch("os.close") as mock_close:
+                results = []
+                thread = fs._threading.Thread(
+                    target=lambda: results.append(
+                        (cache.lookup(path), cache.invalidate(container))
+                    )
+                )
+                thread.start()
+                thread.join()
+            assert results == [((None, path), None)]
+            assert not mock_close.called
+            assert list(cache._fds) == [container]
+            # Its invalidations are done by the next lookup of the hub thread
+            assert cache.lookup(tmpdir) == (None, tmpdir)
+            assert not cache._invalidated
+            assert list(cache._fds) == []
+        finally:
+            cache.close()
+            shutil.rmtree(tmpdir)
+
     def test_do_write_DiskFileNoSpace(self):
         def mock_os_write_enospc(fd, msg):
             raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
@@ -483,6 +757,24 @@ class TestFsUtils(unittest.TestCase):
             os.close(fd)
             shutil.rmtree(tmpdir)
 
+    def test_do_rmdirat(self):
+        tmpdir = mkdtemp()
+        dir_fd = os.open(tmpdir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            subdir = mkdtemp(dir=tmpdir)
+            open(os.path.join(subdir, "f"), "w").close()
+            name = os.path.basename(subdir)
+            with self.assertRaises(SwiftOnFileSystemOSError) as ctx:
+                fs.do_rmdirat(dir_fd, name, subdir)
+            assert ctx.exception.errno == errno.ENOTEMPTY
+            assert subdir in str(ctx.exception)
+            os.unlink(os.path.join(subdir, "f"))
+            fs.do_rmdirat(dir_fd, name, subdir)
+            assert not os.path.exists(subdir)
+        finally:
+            os.close(dir_fd)
+            shutil.rmtree(tmpdir)
+
     def test_chown_dir(self):
         tmpdir = mkdtemp()
         try:
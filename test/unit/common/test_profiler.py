@@ -0,0 +1,95 @@
+""" Tests for swiftonfile.swift.common.profiler """
+
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+import mock
+
+from swiftonfile.swift.common.profiler import SamplingProfiler
+
+
+def busy(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    """Tests for swiftonfile.swift.common.profiler.SamplingProfiler"""
+
+    def setUp(self):
+        self.td = tempfile.mkdtemp()
+        self.profiler = SamplingProfiler(self.td, "test", 0.001, 60)
+
+    def tearDown(self):
+        self.profiler.stop()
+        signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+        shutil.rmtree(self.td)
+
+    def _read(self, path):
+        samples = {}
+        with open(path) as f:
+            for line in f:
+                stack, count = line.rsplit(" ", 1)
+                samples[stack] = int(count)
+        return samples
+
+    def test_start_stop(self):
+        self.profiler.start()
+        busy(0.2)
+        path = self.profiler.stop()
+        assert not self.profiler.running
+        assert os.path.basename(path).startswith("test-%d-" % os.getpid())
+        assert path.endswith(".collapsed")
+        samples = self._read(path)
+        assert sum(samples.values()) > 10
+        stacks = [stack.split(";") for stack in samples]
+        assert any(stack[-1].endswith(":busy") for stack in stacks)
+        assert any(stack[-2].endswith(":test_start_stop") for stack in stacks)
+        assert self.profiler.stop() is None
+
+    def test_duration(self):
+        self.profiler.duration = 0.1
+        self.profiler.start()
+        busy(0.3)
+        assert not self.profiler.running
+        assert len(os.listdir(self.td)) == 1
+
+    def test_continuous(self):
+        self.profiler.duration = 0.1
+        with mock.patch("time.strftime", side_effect=["1", "2", "3", "4", "5"]):
+            self.profiler.start(continuous=True)
+            busy(0.35)
+            assert self.profiler.running
+            self.profiler.stop()
+        assert len(os.listdir(self.td)) >= 3
+
+    def test_signal(self):
+        self.profiler.install_signal()
+        os.kill(os.getpid(), signal.SIGUSR2)
+        assert self.profiler.running
+        busy(0.05)
+        os.kill(os.getpid(), signal.SIGUSR2)
+        assert not self.profiler.running
+        assert len(os.listdir(self.td)) == 1
+
+    def test_attach(self):
+        self.profiler.attach()
+        assert not self.profiler.running
+        self.profiler.fraction = 1
+        self.profiler.attach()
+        # Once per process
+        assert not self.profiler.running
+        self.profiler._pid = None
+        self.profiler.attach()
+        assert self.profiler.running
+        assert self.profiler._continuous
+
+    def test_write_error(self):
+        self.profiler.output_dir = os.path.join(self.td, "missing")
+        self.profiler.start()
+        assert self.profiler.stop() is None
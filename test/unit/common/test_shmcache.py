@@ -0,0 +1,137 @@
+""" Tests for swiftonfile.swift.common.shmcache """
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+
+import mock
+
+from swiftonfile.swift.common import shmcache
+from swiftonfile.swift.common.shmcache import SharedMetadataCache
+
+FakeStat = namedtuple(
+    "FakeStat", ["st_dev", "st_ino", "st_mtime_ns", "st_ctime_ns", "st_size"]
+)
+
+
+def _stat(ino, ctime=1, dev=1):
+    return FakeStat(dev, ino, 1, ctime, 10)
+
+
+class TestSharedMetadataCache(unittest.TestCase):
+    """Tests for swiftonfile.swift.common.shmcache.SharedMetadataCache"""
+
+    def setUp(self):
+        self.td = tempfile.mkdtemp()
+        self.path = os.path.join(self.td, "cache")
+
+    def tearDown(self):
+        shutil.rmtree(self.td)
+
+    def test_get_set(self):
+        cache = SharedMetadataCache(self.path, 16, 256)
+        assert cache.size == 16
+        assert os.path.getsize(self.path) == 64 + 64 + 16 * 256
+        assert cache.get(_stat(1)) is None
+        cache.set(_stat(1), {"ETag": "x", "Content-Length": 10})
+        assert cache.get(_stat(1)) == {"ETag": "x", "Content-Length": 10}
+        # The file changed
+        assert cache.get(_stat(1, ctime=2)) is None
+        assert cache.get(_stat(1, dev=2)) is None
+        cache.set(_stat(1, ctime=2), {"ETag": "y"})
+        assert cache.get(_stat(1, ctime=2)) == {"ETag": "y"}
+        assert (cache.hits, cache.misses, cache.evictions) == (2, 3, 0)
+        cache.invalidate(_stat(1, ctime=2))
+        assert cache.get(_stat(1, ctime=2)) is None
+        cache.close()
+
+    def test_shared(self):
+        cache1 = SharedMetadataCache(self.path, 16, 256)
+        cache2 = SharedMetadataCache(self.path, 16, 256)
+        cache1.set(_stat(1), {"ETag": "x"})
+        assert cache2.get(_stat(1)) == {"ETag": "x"}
+        cache2.set(_stat(1, ctime=2), {"ETag": "y"})
+        assert cache1.get(_stat(1)) is None
+        assert cache1.get(_stat(1, ctime=2)) == {"ETag": "y"}
+        cache1.close()
+        cache2.close()
+
+    def test_other_geometry(self):
+        cache1 = SharedMetadataCache(self.path, 16, 256)
+        cache1.set(_stat(1), {"ETag": "x"})
+        cache2 = SharedMetadataCache(self.path, 16, 512)
+        assert cache2.get(_stat(1)) is None
+        cache2.set(_stat(1), {"ETag": "y"})
+        # The first cache still uses the replaced file
+        assert cache1.get(_stat(1)) == {"ETag": "x"}
+        cache3 = SharedMetadataCache(self.path, 16, 512)
+        assert cache3.get(_stat(1)) == {"ETag": "y"}
+        cache1.close()
+        cache2.close()
+        cache3.close()
+
+    def test_clock_eviction(self):
+        logger = mock.Mock()
+        cache = SharedMetadataCache(self.path, shmcache.WAYS, 256, logger)
+        for ino in range(1, shmcache.WAYS + 1):
+            cache.set(_stat(ino), {"ino": ino})
+        # Entries are referenced when set, the clock clears all of them and
+        # replaces the first one
+        cache.set(_stat(100), {"ino": 100})
+        assert cache.evictions == 1
+        logger.increment.assert_called_with("metadata_cache.evictions")
+        assert cache.get(_stat(1)) is None
+        # The second entry is referenced again, the third is replaced
+        assert cache.get(_stat(2)) == {"ino": 2}
+        cache.set(_stat(101), {"ino": 101})
+        assert cache.get(_stat(2)) == {"ino": 2}
+        assert cache.get(_stat(3)) is None
+        assert cache.get(_stat(100)) == {"ino": 100}
+        assert cache.get(_stat(101)) == {"ino": 101}
+        cache.close()
+
+    def test_set_too_large(self):
+        cache = SharedMetadataCache(self.path, 8, 128)
+        cache.set(_stat(1), {"a": "b" * 128})
+        assert cache.get(_stat(1)) is None
+        cache.close()
+
+    def test_set_locked(self):
+        cache = SharedMetadataCache(self.path, 8, 256)
+        err = OSError(errno.EAGAIN, "locked")
+        with mock.patch.object(shmcache.fcntl, "lockf", side_effect=err):
+            cache.set(_stat(1), {"ETag": "x"})
+        assert cache.get(_stat(1)) is None
+        # The lock of the set is released
+        cache.set(_stat(1), {"ETag": "x"})
+        assert cache.get(_stat(1)) == {"ETag": "x"}
+        cache.close()
+
+    def test_set_locked_by_thread(self):
+        # fcntl locks don't exclude the threads of a process
+        cache = SharedMetadataCache(self.path, 8, 256)
+        set_index = cache._set_index((1, 1))
+        thread = shmcache._threading.Thread(target=cache._lock, args=(set_index,))
+        thread.start()
+        thread.join()
+        cache.set(_stat(1), {"ETag": "x"})
+        cache.invalidate(_stat(1))
+        assert cache.get(_stat(1)) is None
+        cache._unlock(set_index)
+        cache.set(_stat(1), {"ETag": "x"})
+        assert cache.get(_stat(1)) == {"ETag": "x"}
+        cache.close()
+
+    def test_get_while_written(self):
+        cache = SharedMetadataCache(self.path, 8, 256)
+        cache.set(_stat(1), {"ETag": "x"})
+        offset = cache._slot_offsets(cache._set_index((1, 1)))[0]
+        seq = shmcache.SEQ.unpack_from(cache._mmap, offset)[0]
+        shmcache.SEQ.pack_into(cache._mmap, offset, seq + 1)
+        assert cache.get(_stat(1)) is None
+        shmcache.SEQ.pack_into(cache._mmap, offset, seq + 2)
+        assert cache.get(_stat(1)) == {"ETag": "x"}
+        cache.close()
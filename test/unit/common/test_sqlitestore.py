@@ -0,0 +1,166 @@
+""" Tests for swiftonfile.swift.common.sqlitestore """
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from swiftonfile.swift.common import utils
+from swiftonfile.swift.common.sqlitestore import SqliteMetadataStore
+
+
+class TestSqliteMetadataStore(unittest.TestCase):
+    """Tests for swiftonfile.swift.common.sqlitestore.SqliteMetadataStore"""
+
+    def setUp(self):
+        self.td = tempfile.mkdtemp()
+        self.device_path = os.path.join(self.td, "sda1")
+        self.db_dir = os.path.join(self.td, "db")
+        self.container_path = os.path.join(self.device_path, "AUTH_a", "c")
+        os.makedirs(os.path.join(self.container_path, "dir"))
+        self.store = SqliteMetadataStore(self.device_path, self.db_dir)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.td)
+
+    def _create(self, name):
+        path = os.path.join(self.container_path, name)
+        with open(path, "w") as f:
+            f.write("data")
+        return path
+
+    def test_read_write_clean(self):
+        path = self._create("dir/obj")
+        assert self.store.read(path) == {}
+        self.store.write(path, {"ETag": "x", "Content-Length": 4})
+        assert self.store.read(path) == {"ETag": "x", "Content-Length": 4}
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            assert self.store.read(fd) == {"ETag": "x", "Content-Length": 4}
+            self.store.write(fd, {"ETag": "y"})
+        finally:
+            os.close(fd)
+        assert self.store.read(path) == {"ETag": "y"}
+        assert os.path.exists(os.path.join(self.db_dir, "AUTH_a", "c.db"))
+        self.store.clean(path)
+        assert self.store.read(path) == {}
+
+    def test_account_and_container(self):
+        account_path = os.path.dirname(self.container_path)
+        self.store.write(account_path, {"a": "1"})
+        self.store.write(self.container_path, {"c": "1"})
+        assert self.store.read(account_path) == {"a": "1"}
+        assert self.store.read(self.container_path + "/") == {"c": "1"}
+        assert os.path.exists(os.path.join(self.db_dir, "AUTH_a.db"))
+
+    def test_replaced_file(self):
+        path = self._create("obj")
+        self.store.write(path, {"ETag": "x"})
+        tmp = self._create("tmp")
+        os.rename(tmp, path)
+        assert self.store.read(path) == {}
+
+    def test_missing_file(self):
+        path = os.path.join(self.container_path, "missing")
+        try:
+            self.store.read(path)
+        except OSError as err:
+            assert err.errno == errno.ENOENT
+        else:
+            self.fail("OSError expected")
+
+    def test_unresolved_fd(self):
+        fd = os.open(self._create("obj"), os.O_RDONLY)
+        try:
+            with mock.patch(
+                "swiftonfile.swift.common.sqlitestore.get_filename_from_fd",
+                return_value=None,
+            ):
+                try:
+                    self.store.read(fd)
+                except IOError as err:
+                    assert err.errno == errno.ENOENT
+                else:
+                    self.fail("IOError expected")
+        finally:
+            os.close(fd)
+
+    def _keys(self):
+        conn = self.store._connect(os.path.join(self.db_dir, "AUTH_a", "c.db"))
+        return [row["path"] for row in conn.execute("SELECT path FROM metadata")]
+
+    def test_removed_directories(self):
+        os.makedirs(os.path.join(self.container_path, "dir", "sub"))
+        utils.metadata_stores = {self.store.device_path: self.store}
+        try:
+            for name in ("dir", "dir/sub"):
+                utils.write_metadata(os.path.join(self.container_path, name), {})
+            assert sorted(self._keys()) == ["dir", "dir/sub"]
+            assert utils.rmobjdir(os.path.join(self.container_path, "dir"))
+            assert self._keys() == []
+        finally:
+            utils.metadata_stores = {}
+
+    def test_renamed(self):
+        tmp = self._create(".obj.tmp")
+        self.store.write(tmp, {"ETag": "x"})
+        path = os.path.join(self.container_path, "dir", "obj")
+        os.rename(tmp, path)
+        self.store.renamed(tmp, path)
+        assert self.store.read(path) == {"ETag": "x"}
+        os.makedirs(os.path.join(self.device_path, "AUTH_a", "c2"))
+        other = os.path.join(self.device_path, "AUTH_a", "c2", "obj")
+        os.rename(path, other)
+        self.store.renamed(path, other)
+        assert self.store.read(other) == {"ETag": "x"}
+        os.rename(other, path)
+        self.store.renamed(other, path)
+        self.store.unlinked(path)
+        assert self.store.read(path) == {}
+
+    def test_max_connections(self):
+        self.store.max_connections = 1
+        for container in ("c1", "c2"):
+            path = os.path.join(self.device_path, "AUTH_a", container)
+            os.mkdir(path)
+            self.store.write(path, {"c": container})
+        assert len(self.store._connections) == 1
+        path = os.path.join(self.device_path, "AUTH_a", "c1")
+        assert self.store.read(path) == {"c": "c1"}
+
+    def test_abstract(self):
+        class IncompleteStore(utils.MetadataStore):
+            def read(self, path_or_fd, stats=None):
+                return {}
+
+        self.assertRaises(TypeError, IncompleteStore)
+
+    def test_metadata_stores(self):
+        path = self._create("obj")
+        other = os.path.join(self.td, "other")
+        open(other, "w").close()
+        utils.metadata_stores = {self.store.device_path: self.store}
+        try:
+            assert utils.get_metadata_store(path) is self.store
+            assert utils.get_metadata_store(other) is utils.xattr_metadata_store
+            utils.write_metadata(path, {"ETag": "x"})
+            assert utils.read_metadata(path) == {"ETag": "x"}
+            assert not os.listxattr(path)
+            tmp = self._create(".obj.tmp")
+            fd = os.open(tmp, os.O_RDONLY)
+            try:
+                assert utils.get_metadata_store(fd) is self.store
+                utils.write_metadata(fd, {"ETag": "y"})
+            finally:
+                os.close(fd)
+            os.rename(tmp, path)
+            utils.rename_metadata(tmp, path)
+            assert utils.read_metadata(path) == {"ETag": "y"}
+            utils.clean_metadata(path)
+            assert utils.read_metadata(path) == {}
+        finally:
+            utils.metadata_stores = {}
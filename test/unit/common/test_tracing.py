@@ -0,0 +1,157 @@
+""" Tests for swiftonfile.swift.common.tracing """
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from eventlet import sleep
+
+from swiftonfile.swift.common import tracing
+from swiftonfile.swift.common.tracing import Tracer
+
+
+class TestTracer(unittest.TestCase):
+    """Tests for swiftonfile.swift.common.tracing.Tracer"""
+
+    def setUp(self):
+        self.td = tempfile.mkdtemp()
+        self.path = os.path.join(self.td, "trace.ndjson")
+        self.tracer = Tracer(self.path)
+        tracing.tracer = self.tracer
+
+    def tearDown(self):
+        tracing.tracer = None
+        self.tracer.close()
+        shutil.rmtree(self.td)
+
+    def _spans(self):
+        self.tracer.flush()
+        with open(self.tracer.worker_path) as f:
+            return [json.loads(line) for line in f]
+
+    def _app(self, env, start_response):
+        with tracing.span("step", key="value"):
+            with tracing.span("substep"):
+                pass
+        self.read_span = tracing.start_span("read")
+        start_response("201 Created", [])
+        return [b"body"]
+
+    def _request(self, trans_id="tx1"):
+        env = {"REQUEST_METHOD": "PUT", "PATH_INFO": "/sda1/p/a/c/o"}
+        if trans_id:
+            env["HTTP_X_TRANS_ID"] = trans_id
+        resp = tracing.traced_request(env, lambda *args: None, self._app)
+        body = list(resp)
+        if hasattr(resp, "close"):
+            resp.close()
+        return body
+
+    def test_request(self):
+        assert self._request() == [b"body"]
+        self.read_span.end()
+        spans = {span["name"]: span for span in self._spans()}
+        step, substep = spans["step"], spans["substep"]
+        read, root = spans["read"], spans["PUT"]
+        trace_id = tracing.md5(b"tx1").hexdigest()
+        for span in spans.values():
+            assert span["traceId"] == trace_id
+            assert int(span["endTimeUnixNano"]) >= int(span["startTimeUnixNano"])
+        assert root["parentSpanId"] == ""
+        assert root["kind"] == "SPAN_KIND_SERVER"
+        assert step["parentSpanId"] == root["spanId"]
+        assert substep["parentSpanId"] == step["spanId"]
+        assert read["parentSpanId"] == root["spanId"]
+        assert step["attributes"] == [{"key": "key", "value": {"stringValue": "value"}}]
+        assert {"key": "http.status_code", "value": {"intValue": "201"}} in root[
+            "attributes"
+        ]
+        assert {
+            "key": "service.name",
+            "value": {"stringValue": "object-server"},
+        } in root["resource"]["attributes"]
+        # Nothing is traced outside of a request
+        with tracing.span("other"):
+            assert tracing.start_span("other") is None
+        assert len(self._spans()) == 4
+
+    def test_sampling(self):
+        self.tracer.sample_rate = 0.5
+        traced = set()
+        for i in range(100):
+            trans_id = "tx%d" % i
+            self._request(trans_id)
+            if self.tracer.sampled(tracing.md5(trans_id.encode()).hexdigest()):
+                traced.add(tracing.md5(trans_id.encode()).hexdigest())
+        assert 20 < len(traced) < 80
+        assert set(span["traceId"] for span in self._spans()) == traced
+        self.tracer.sample_rate = 0
+        self._request(None)
+        assert len(self._spans()) == len(traced) * 3
+
+    def test_error(self):
+        @tracing.traced("failing")
+        def failing():
+            raise OSError(2, "No such file or directory")
+
+        def app(env, start_response):
+            failing()
+
+        env = {"REQUEST_METHOD": "GET", "HTTP_X_TRANS_ID": "tx1"}
+        self.assertRaises(OSError, tracing.traced_request, env, None, app)
+        failing_span, root = self._spans()
+        assert failing_span["parentSpanId"] == root["spanId"]
+        for span in (failing_span, root):
+            assert span["status"] == {
+                "code": "STATUS_CODE_ERROR",
+                "message": "FileNotFoundError: [Errno 2] No such file or directory",
+            }
+
+    def test_rotation(self):
+        self.tracer.close()
+        self.tracer = Tracer(self.path, max_bytes=1000, backups=2, buffer_spans=1)
+        tracing.tracer = self.tracer
+        for i in range(20):
+            self._request()
+        assert self.tracer.worker_path == os.path.join(
+            self.td, "trace.%d.ndjson" % os.getpid()
+        )
+        assert os.path.exists(self.tracer.worker_path + ".2")
+        assert not os.path.exists(self.tracer.worker_path + ".3")
+
+    def test_worker_file(self):
+        self._request()
+        self.tracer.flush()
+        self._request("tx2")
+        # A forked worker writes to its own file, without the spans buffered
+        # by its parent
+        with mock.patch("os.getpid", return_value=1):
+            self._request("tx3")
+            assert self.tracer.worker_path == os.path.join(self.td, "trace.1.ndjson")
+            spans = self._spans()
+        assert set(span["traceId"] for span in spans) == {
+            tracing.md5(b"tx3").hexdigest()
+        }
+        assert {"key": "process.pid", "value": {"intValue": "1"}} in spans[0][
+            "resource"
+        ]["attributes"]
+        assert len(self._spans()) == 3
+
+    def test_buffer(self):
+        self.tracer.close()
+        self.tracer = Tracer(self.path, buffer_spans=5, flush_interval=0.01)
+        tracing.tracer = self.tracer
+        self._request()
+        # Buffered
+        assert not os.path.exists(self.tracer.worker_path)
+        self._request("tx2")
+        # Written at once when 5 spans are buffered
+        with open(self.tracer.worker_path) as f:
+            assert len(f.readlines()) == 5
+        # The others after flush_interval
+        sleep(0.05)
+        with open(self.tracer.worker_path) as f:
+            assert len(f.readlines()) == 6
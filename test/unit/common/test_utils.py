@@ -25,9 +25,11 @@ import hashlib
 import shutil
 import mock
 import uuid
+import struct
 from collections import defaultdict
 from mock import patch, Mock
-from swiftonfile.swift.common import utils
+from swiftonfile.swift.common import fs_utils, utils
+from swiftonfile.swift.common.shmcache import SharedMetadataCache
 from swiftonfile.swift.common.utils import (
     deserialize_metadata,
     serialize_metadata,
@@ -51,6 +53,7 @@ _xattr_rem_err = {}
 _xattr_set = None
 _xattr_get = None
 _xattr_remove = None
+_xattr_list = None
 
 
 def _xkey(path, key):
@@ -85,6 +88,12 @@ def _getxattr(path, key, *args, **kwargs):
     return ret_val
 
 
+def _listxattr(path, *args, **kwargs):
+    _xattr_op_cnt["list"] += 1
+    prefix = _xkey(path, "")
+    return [xkey[len(prefix) :] for xkey in _xattrs if xkey.startswith(prefix)]
+
+
 def _removexattr(path, key, *args, **kwargs):
     _xattr_op_cnt["remove"] += 1
     xkey = _xkey(path, key)
@@ -118,11 +127,16 @@ def _initxattr():
     _xattr_get = xattr.getxattr
     global _xattr_remove
     _xattr_remove = xattr.removexattr
+    global _xattr_list
+    _xattr_list = xattr.listxattr
 
     # Monkey patch the calls we use with our internal unit test versions
     xattr.setxattr = _setxattr
     xattr.getxattr = _getxattr
     xattr.removexattr = _removexattr
+    xattr.listxattr = _listxattr
+    # Read the xattrs of fds through xattr.getxattr too
+    fs_utils._fgetxattr = False
 
 
 def _destroyxattr():
@@ -133,6 +147,9 @@ def _destroyxattr():
     xattr.getxattr = _xattr_get
     global _xattr_remove
     xattr.removexattr = _xattr_remove
+    global _xattr_list
+    xattr.listxattr = _xattr_list
+    fs_utils._fgetxattr = None
     # Destroy the stored values and
     global _xattrs
     _xattrs = None
@@ -314,7 +331,19 @@ class TestUtils(unittest.TestCase):
         assert not expected_p
         res_d = utils.read_metadata(path)
         assert res_d == expected_d, "Expected %r, result %r" % (expected_d, res_d)
-        assert _xattr_op_cnt["get"] == 4, "%r" % _xattr_op_cnt
+        assert _xattr_op_cnt["get"] == 3, "%r" % _xattr_op_cnt
+        assert _xattr_op_cnt["list"] == 1, "%r" % _xattr_op_cnt
+
+    def test_read_metadata_one_chunk(self):
+        path = "/tmp/foo/r"
+        expected_d = {"a": "\u00e9" * 10}
+        _xattrs[_xkey(path, utils.METADATA_KEY)] = serialize_metadata(expected_d)
+        # A trailing chunk of a former larger metadata is not read
+        _xattrs[_xkey(path, utils.METADATA_KEY + "1")] = b"}"
+        res_d = utils.read_metadata(path)
+        assert res_d == expected_d, "Expected %r, result %r" % (expected_d, res_d)
+        assert _xattr_op_cnt["get"] == 1, "%r" % _xattr_op_cnt
+        assert _xattr_op_cnt["list"] == 0, "%r" % _xattr_op_cnt
 
     def test_read_metadata_multiple_one_missing(self):
         path = "/tmp/foo/r"
@@ -327,7 +356,264 @@ class TestUtils(unittest.TestCase):
         assert len(expected_p) <= utils.MAX_XATTR_SIZE
         res_d = utils.read_metadata(path)
         assert res_d == {}
-        assert _xattr_op_cnt["get"] == 3, "%r" % _xattr_op_cnt
+        assert _xattr_op_cnt["get"] == 2, "%r" % _xattr_op_cnt
+
+    def test_metadata_cache(self):
+        tf = tempfile.NamedTemporaryFile()
+        utils.metadata_cache = utils.MetadataCache(10)
+        try:
+            utils.write_metadata(tf.name, {"a": "b"}, stored=b"")
+            assert _xattr_op_cnt["set"] == 1
+            # Written through the cache
+            md = utils.read_metadata(tf.name)
+            assert md == {"a": "b"}
+            assert _xattr_op_cnt["get"] == 0
+            md["c"] = "d"
+            assert utils.read_metadata(tf.file.fileno()) == {"a": "b"}
+            assert utils.metadata_cache.hits == 2
+            # A change of the file invalidates its entry
+            os.utime(tf.name, (0, 0))
+            assert utils.read_metadata(tf.name) == {"a": "b"}
+            assert _xattr_op_cnt["get"] == 1
+            assert utils.metadata_cache.misses == 1
+            assert utils.read_metadata(tf.name) == {"a": "b"}
+            assert _xattr_op_cnt["get"] == 1
+            utils.clean_metadata(tf.name)
+            assert utils.read_metadata(tf.name) == {}
+            assert utils.metadata_cache.misses == 2
+        finally:
+            utils.metadata_cache = None
+
+    def test_metadata_cache_eviction(self):
+        tfs = [tempfile.NamedTemporaryFile() for _ in range(3)]
+        logger = Mock()
+        utils.metadata_cache = utils.MetadataCache(2, logger)
+        try:
+            for tf in tfs:
+                utils.write_metadata(tf.name, {"name": tf.name}, stored=b"")
+            assert utils.metadata_cache.evictions == 1
+            logger.increment.assert_called_with("metadata_cache.evictions")
+            assert utils.read_metadata(tfs[2].name) == {"name": tfs[2].name}
+            assert utils.read_metadata(tfs[0].name) == {"name": tfs[0].name}
+            assert utils.metadata_cache.hits == 1
+            assert utils.metadata_cache.misses == 1
+            assert _xattr_op_cnt["get"] == 1
+        finally:
+            utils.metadata_cache = None
+
+    def test_metadata_cache_no_file(self):
+        utils.metadata_cache = utils.MetadataCache(2)
+        try:
+            path = "/tmp/foo/nocache"
+            utils.write_metadata(path, {"a": "b"}, stored=b"")
+            assert utils.read_metadata(path) == {"a": "b"}
+            assert _xattr_op_cnt["get"] == 1
+            assert utils.metadata_cache.misses == 0
+        finally:
+            utils.metadata_cache = None
+
+    def test_write_metadata_delta(self):
+        path = "/tmp/foo/w"
+        orig_d = {"a": "y" * 150000, "b": "x"}
+        utils.write_metadata(path, orig_d)
+        assert _xattr_op_cnt["set"] == 3, "%r" % _xattr_op_cnt
+        # Only the last chunk changed
+        orig_d["b"] = "z"
+        utils.write_metadata(path, orig_d)
+        assert _xattr_op_cnt["set"] == 4, "%r" % _xattr_op_cnt
+        assert _xattr_op_cnt["remove"] == 0, "%r" % _xattr_op_cnt
+        assert utils.read_metadata(path) == orig_d
+        # The leftover chunks are removed
+        utils.write_metadata(path, {"b": "z"})
+        assert _xattr_op_cnt["set"] == 5, "%r" % _xattr_op_cnt
+        assert _xattr_op_cnt["remove"] == 2, "%r" % _xattr_op_cnt
+        assert list(_xattrs) == [_xkey(path, utils.METADATA_KEY)]
+        # Unchanged metadata is not written
+        utils.write_metadata(
+            path, {"b": "z"}, stored=_xattrs[_xkey(path, utils.METADATA_KEY)]
+        )
+        assert _xattr_op_cnt["set"] == 5, "%r" % _xattr_op_cnt
+
+    def test_read_metadata_stored(self):
+        path = "/tmp/foo/w"
+        orig_d = {"a": "y" * 150000, "b": "x"}
+        utils.write_metadata(path, orig_d, stored=b"")
+        md, stored = utils.read_metadata_stored(path)
+        assert md == orig_d
+        assert stored == serialize_metadata(orig_d)
+        # Written back without reading the metadata again
+        _xattr_op_cnt.clear()
+        md["b"] = "z"
+        utils.write_metadata(path, md, stored)
+        assert _xattr_op_cnt == {"set": 1}, "%r" % _xattr_op_cnt
+        assert utils.read_metadata(path) == md
+        # Nothing stored
+        assert utils.read_metadata_stored("/tmp/foo/none") == ({}, b"")
+
+    def test_read_metadata_stored_cache(self):
+        tf = tempfile.NamedTemporaryFile()
+        utils.metadata_cache = utils.MetadataCache(10)
+        try:
+            utils.write_metadata(tf.name, {"a": "b"}, stored=b"")
+            md, stored = utils.read_metadata_stored(tf.name)
+            assert md == {"a": "b"}
+            assert stored == serialize_metadata(md)
+            assert _xattr_op_cnt["get"] == 0
+        finally:
+            utils.metadata_cache = None
+
+    def test_read_metadata_stored_shared_cache(self):
+        tf = tempfile.NamedTemporaryFile()
+        td = tempfile.mkdtemp()
+        utils.metadata_cache = SharedMetadataCache(os.path.join(td, "cache"), 16)
+        try:
+            utils.write_metadata(tf.name, {"a": "b"}, stored=b"")
+            # The metadata as stored is not shared
+            assert utils.read_metadata_stored(tf.name) == ({"a": "b"}, None)
+            assert _xattr_op_cnt["get"] == 0
+        finally:
+            utils.metadata_cache.close()
+            utils.metadata_cache = None
+            shutil.rmtree(td)
+
+    def test_write_metadata_full_last_chunk(self):
+        path = "/tmp/foo/w"
+        # A leftover chunk after a full last chunk would be read
+        _xattrs[_xkey(path, utils.METADATA_KEY + "1")] = b"}"
+        orig_d = {"a": "y" * (utils.MAX_XATTR_SIZE - 8)}
+        assert len(serialize_metadata(orig_d)) == utils.MAX_XATTR_SIZE
+        utils.write_metadata(path, orig_d, stored=b"")
+        assert _xattr_op_cnt["remove"] == 1, "%r" % _xattr_op_cnt
+        assert utils.read_metadata(path) == orig_d
+
+    def test_metadata_keys_layout(self):
+        path = "/tmp/foo/k"
+        sys_xkey = _xkey(path, utils.METADATA_SYS_KEY)
+        color_xkey = _xkey(path, utils.METADATA_USER_KEY_PREFIX + "X-Object-Meta-Color")
+        md = {
+            utils.X_TIMESTAMP: "1",
+            "X-Object-Meta-Color": "red",
+            "X-Object-Meta-Size": "big",
+        }
+        utils.metadata_layout = "keys"
+        try:
+            utils.write_metadata(path, md)
+            assert sorted(_xattrs) == sorted(
+                [
+                    sys_xkey,
+                    color_xkey,
+                    _xkey(path, utils.METADATA_USER_KEY_PREFIX + "X-Object-Meta-Size"),
+                ]
+            )
+            assert _xattrs[color_xkey] == b"red"
+            assert _xattr_op_cnt["set"] == 3, "%r" % _xattr_op_cnt
+            read_md, stored = utils.read_metadata_stored(path)
+            assert read_md == md
+            # Only the changed keys are written, diffed against the metadata
+            # as read
+            _xattr_op_cnt.clear()
+            md = {utils.X_TIMESTAMP: "1", "X-Object-Meta-Color": "blue"}
+            utils.write_metadata(path, md, stored)
+            assert _xattr_op_cnt == {"set": 1, "remove": 1}, "%r" % _xattr_op_cnt
+            assert sorted(_xattrs) == [color_xkey, sys_xkey]
+            assert utils.read_metadata(path) == md
+            # Unknown stored metadata: the xattrs are listed and all set
+            _xattr_op_cnt.clear()
+            utils.write_metadata(path, md)
+            assert _xattr_op_cnt == {"list": 1, "set": 2}, "%r" % _xattr_op_cnt
+            assert utils.read_metadata(path) == md
+            # The blob layout is migrated
+            _xattrs.clear()
+            _xattrs[_xkey(path, utils.METADATA_KEY)] = serialize_metadata(md)
+            read_md, stored = utils.read_metadata_stored(path)
+            assert read_md == md
+            _xattr_op_cnt.clear()
+            utils.write_metadata(path, md, stored)
+            assert _xattr_op_cnt == {"set": 2, "remove": 1}, "%r" % _xattr_op_cnt
+            assert sorted(_xattrs) == [color_xkey, sys_xkey]
+        finally:
+            utils.metadata_layout = "blob"
+        # Both layouts are read and migrated back
+        read_md, stored = utils.read_metadata_stored(path)
+        assert read_md == md
+        _xattr_op_cnt.clear()
+        utils.write_metadata(path, md, stored)
+        assert _xattr_op_cnt == {"set": 1, "remove": 2}, "%r" % _xattr_op_cnt
+        assert list(_xattrs) == [_xkey(path, utils.METADATA_KEY)]
+        assert utils.read_metadata(path) == md
+
+    def test_metadata_keys_layout_invalid(self):
+        path = "/tmp/foo/k"
+        _xattrs[_xkey(path, utils.METADATA_SYS_KEY)] = b"{"
+        _xattrs[_xkey(path, utils.METADATA_USER_KEY_PREFIX + "X-Object-Meta-A")] = b"a"
+        assert utils.read_metadata(path) == {}
+        assert not _xattrs
+
+    def test_binary_metadata(self):
+        orig_d = {
+            utils.X_CONTENT_TYPE: "text/plain",
+            utils.X_CONTENT_LENGTH: 12,
+            utils.X_ETAG: "d41d8cd98f00b204e9800998ecf8427e",
+            "X-Object-Meta-\u00e9t\u00e9": "\u2603",
+            "size": 2**70,
+            "ratio": 0.5,
+            "flag": True,
+            "none": None,
+            "list": [1, "a"],
+        }
+        metastr = utils.serialize_binary_metadata(orig_d)
+        assert metastr.startswith(utils.BINARY_METADATA_MAGIC)
+        # Well-known keys are stored as one byte
+        assert b"Content-Type" not in metastr
+        res_d = deserialize_metadata(metastr)
+        assert res_d == orig_d
+        assert list(res_d) == list(orig_d)
+        assert type(res_d[utils.X_CONTENT_LENGTH]) is int
+        assert len(metastr) < len(serialize_metadata(orig_d, "json"))
+
+    def test_binary_metadata_invalid(self):
+        metastr = utils.serialize_binary_metadata({"a": "b" * 10})
+        assert deserialize_metadata(metastr[:-1]) == {}
+        assert deserialize_metadata(metastr[:5] + b"\xff") == {}
+        assert deserialize_metadata(metastr[:4] + b"\x03" + metastr[5:]) == {}
+        assert deserialize_metadata(metastr[:7] + b"\x01x") == {}
+        # The number of chunks does not match
+        assert deserialize_metadata(metastr[:5] + b"\x02\x00" + metastr[7:]) == {}
+
+    def test_binary_metadata_version_1(self):
+        orig_d = {utils.X_CONTENT_LENGTH: 12, "a": "b"}
+        metastr = utils.serialize_binary_metadata(orig_d)
+        assert metastr[4:7] == b"\x02\x01\x00"
+        assert deserialize_metadata(metastr[:4] + b"\x01" + metastr[7:]) == orig_d
+
+    def test_write_metadata_binary(self):
+        path = "/tmp/foo/w"
+        xkey = _xkey(path, utils.METADATA_KEY)
+        orig_d = {"a": "y" * 150000, utils.X_CONTENT_LENGTH: 150000}
+        _xattrs[xkey] = serialize_metadata({"a": "b"})
+        # JSON metadata is still read, and migrated when written
+        assert utils.read_metadata(path) == {"a": "b"}
+        utils.metadata_format = "binary"
+        try:
+            utils.write_metadata(path, orig_d)
+        finally:
+            utils.metadata_format = "json"
+        assert _xattrs[xkey].startswith(utils.BINARY_METADATA_MAGIC)
+        assert _xattr_op_cnt["set"] == 3
+        # The number of chunks is read from the first one, not listed
+        _xattr_op_cnt.clear()
+        assert utils.read_metadata(path) == orig_d
+        assert _xattr_op_cnt == {"get": 3}, "%r" % _xattr_op_cnt
+        # Version 1 binary metadata have their chunks listed
+        metastr = utils.serialize_binary_metadata(orig_d)
+        metastr = metastr[:4] + b"\x01" + metastr[7:]
+        for i in range(3):
+            _xattrs[_xkey(path, "%s%s" % (utils.METADATA_KEY, i or ""))] = metastr[
+                i * utils.MAX_XATTR_SIZE : (i + 1) * utils.MAX_XATTR_SIZE
+            ]
+        _xattr_op_cnt.clear()
+        assert utils.read_metadata(path) == orig_d
+        assert _xattr_op_cnt == {"get": 3, "list": 1}, "%r" % _xattr_op_cnt
 
     def test_restore_metadata_none(self):
         # No initial metadata
@@ -622,6 +908,53 @@ class TestUtils(unittest.TestCase):
         finally:
             shutil.rmtree(td)
 
+    def test_get_stripe_geometry(self):
+        path = "/tmp/foo/lustre"
+        lov = struct.pack(
+            utils.LOV_USER_MD_FORMAT,
+            utils.LOV_USER_MAGIC_V1,
+            0,
+            b"\0" * 16,
+            1024 * 1024,
+            4,
+        )
+        _xattrs[_xkey(path, utils.LUSTRE_LOV_KEY)] = lov + b"\0" * 24
+        assert utils.get_stripe_geometry(path) == (1024 * 1024, 4)
+
+    def test_get_stripe_geometry_not_lustre(self):
+        path = "/tmp/foo/notlustre"
+        assert utils.get_stripe_geometry(path) is None
+        # Composite layouts have another magic
+        _xattrs[_xkey(path, utils.LUSTRE_LOV_KEY)] = struct.pack(
+            utils.LOV_USER_MD_FORMAT, 0x0BD60BD0, 0, b"\0" * 16, 0, 0
+        )
+        assert utils.get_stripe_geometry(path) is None
+        _xattrs[_xkey(path, utils.LUSTRE_LOV_KEY)] = b"\0" * 4
+        assert utils.get_stripe_geometry(path) is None
+
+    def test_get_chunk_size(self):
+        stats = Mock(st_blksize=4096)
+        with patch.object(utils, "get_stripe_geometry", return_value=None):
+            assert utils.get_chunk_size(1, stats, 65536, 4194304) == 65536
+            stats.st_blksize = 1024 * 1024
+            assert utils.get_chunk_size(1, stats, 65536, 4194304) == 1024 * 1024
+        with patch.object(utils, "get_stripe_geometry", return_value=(2097152, 8)):
+            assert utils.get_chunk_size(1, stats, 65536, 4194304) == 2097152
+            assert utils.get_chunk_size(1, stats, 65536, 1048576) == 1048576
+
+    def test_read_for_etag_chunk_size(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, b"x" * 100)
+            os.lseek(fd, 0, os.SEEK_SET)
+            with patch.object(utils, "do_read", wraps=utils.do_read) as m_read:
+                etag = utils._read_for_etag(fd, 64)
+            assert etag == hashlib.md5(b"x" * 100).hexdigest()
+            assert [c.args[1] for c in m_read.call_args_list] == [64, 64, 64]
+        finally:
+            os.close(fd)
+            os.unlink(path)
+
 
 class TestUtilsDirObjects(unittest.TestCase):
     def setUp(self):
@@ -701,6 +1034,10 @@ class TestUtilsDirObjects(unittest.TestCase):
                 raise OSError(13, "foo")
             return {}
 
+        # Remove the files, the collection stops at the first file found
+        for f in self.files:
+            os.unlink(os.path.join(self.rootdir, f))
+
         _orig_rm = utils.read_metadata
         utils.read_metadata = _mock_rm
         try:
@@ -713,6 +1050,39 @@ class TestUtilsDirObjects(unittest.TestCase):
         finally:
             utils.read_metadata = _orig_rm
 
+    def test_rmobjdir_stops_at_first_file(self):
+        with mock.patch.object(utils, "read_metadata") as mock_rm:
+            self.assertFalse(utils.rmobjdir(self.rootdir))
+        # The files of the top directory are found first
+        self.assertFalse(mock_rm.called)
+        for d in self.dirs:
+            assert os.path.isdir(os.path.join(self.rootdir, d))
+
+    def test_rmobjdir_max_entries(self):
+        for f in self.files:
+            os.unlink(os.path.join(self.rootdir, f))
+        os.makedirs(os.path.join(self.rootdir, "dir4", "dir5"))
+        # The five directories have to be scanned
+        self.assertFalse(utils.rmobjdir(self.rootdir, max_entries=4))
+        assert os.path.isdir(self.rootdir)
+        self.assertTrue(utils.rmobjdir(self.rootdir, max_entries=5))
+        assert not os.path.exists(self.rootdir)
+
+    def test_rmobjdir_budget(self):
+        for f in self.files:
+            os.unlink(os.path.join(self.rootdir, f))
+        os.makedirs(os.path.join(self.rootdir, "dir4", "dir5"))
+        # dir2 and dir3 are scanned to remove dir1, then dir4 and dir5 to
+        # remove the root
+        budget = utils.ScanBudget(3)
+        self.assertTrue(utils.rmobjdir(os.path.join(self.rootdir, "dir1"), budget))
+        assert budget.entries == 1
+        self.assertFalse(utils.rmobjdir(self.rootdir, budget))
+        assert os.path.isdir(self.rootdir)
+        budget = utils.ScanBudget()
+        self.assertTrue(utils.rmobjdir(self.rootdir, budget))
+        assert budget.entries is None
+
     def test_rmobjdir_metadata_enoent(self):
         def _mock_rm(path):
             print("_mock_rm-metadata_enoent(%s)" % path)
@@ -754,12 +1124,16 @@ class TestUtilsDirObjects(unittest.TestCase):
 
         utils.do_rmdir = _mock_rm
         try:
-            try:
+            with mock.patch.object(
+                utils, "do_rmdirat", side_effect=lambda fd, name, path: _mock_rm(path)
+            ) as mock_rmdirat:
                 self.assertTrue(utils.rmobjdir(self.rootdir))
-            except OSError:
-                self.fail("Unexpected OSError")
-            else:
-                pass
+            # Removed relative to the fd of their parent, deepest first
+            assert [c[0][1:] for c in mock_rmdirat.call_args_list] == [
+                ("dir3", os.path.join(self.rootdir, "dir1/dir2/dir3")),
+                ("dir2", os.path.join(self.rootdir, "dir1/dir2")),
+                ("dir1", os.path.join(self.rootdir, "dir1")),
+            ]
         finally:
             utils.do_rmdir = _orig_rm
 
@@ -781,14 +1155,19 @@ class TestUtilsDirObjects(unittest.TestCase):
 
         utils.do_rmdir = _mock_rm
         try:
-            try:
-                utils.rmobjdir(self.rootdir)
-            except OSError:
-                pass
-            else:
-                self.fail("Expected OSError")
+            with mock.patch.object(
+                utils, "do_rmdirat", side_effect=lambda fd, name, path: _mock_rm(path)
+            ):
+                with self.assertRaises(OSError):
+                    utils.rmobjdir(self.rootdir)
         finally:
             utils.do_rmdir = _orig_rm
+        # The directories opened were closed
+        assert not [
+            fd
+            for fd in os.listdir("/proc/self/fd")
+            if os.path.realpath("/proc/self/fd/" + fd).startswith(self.rootdir)
+        ]
 
     def test_rmobjdir_files_left_in_top_dir(self):
         seen = [0]
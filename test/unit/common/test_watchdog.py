@@ -0,0 +1,66 @@
+""" Tests for swiftonfile.swift.common.watchdog """
+
+import os
+import sys
+import time
+import unittest
+
+import mock
+from eventlet import sleep
+
+from swiftonfile.swift.common import fs_utils
+from swiftonfile.swift.common.watchdog import HubWatchdog
+
+
+class TestHubWatchdog(unittest.TestCase):
+    """Tests for swiftonfile.swift.common.watchdog.HubWatchdog"""
+
+    def setUp(self):
+        self.logger = mock.Mock()
+        self.watchdog = HubWatchdog(0.05, "/srv/node", self.logger)
+
+    def tearDown(self):
+        self.watchdog.stop()
+
+    def test_stall(self):
+        def blocking_stat(func, path):
+            time.sleep(0.3)
+            return os.stat("/")
+
+        self.watchdog.start()
+        sleep(0.1)
+        assert not self.logger.increment.called
+        with mock.patch.object(fs_utils, "_call_at", blocking_stat):
+            with mock.patch("swiftonfile.swift.common.watchdog.do_log_rl") as mock_log:
+                # Blocks the hub
+                fs_utils.do_stat("/srv/node/sda1/AUTH_a/c/o")
+                sleep(0.1)
+        self.logger.increment.assert_has_calls(
+            [mock.call("hub_stalls"), mock.call("hub_stalls.sda1")]
+        )
+        assert self.watchdog.stalls == {"sda1": 1}
+        mock_log.assert_called_once()
+        args = mock_log.call_args[0]
+        assert args[1] >= 0.3
+        assert args[2] == " in do_stat('/srv/node/sda1/AUTH_a/c/o')"
+        assert "blocking_stat" in args[3]
+
+    def test_start(self):
+        with mock.patch("swiftonfile.swift.common.watchdog.spawn") as mock_spawn:
+            with mock.patch.object(self.watchdog, "_watch"):
+                self.watchdog.start()
+                self.watchdog.start()
+                assert mock_spawn.call_count == 1
+                # The workers are forked
+                self.watchdog._pid = -1
+                self.watchdog.start()
+                assert mock_spawn.call_count == 2
+
+    def test_capture(self):
+        def outside():
+            return self.watchdog._capture(sys._getframe())
+
+        stack, call, path = outside()
+        assert call is None and path is None
+        assert "outside" in "".join(stack)
+        assert self.watchdog._capture(None) == ([], None, None)
@@ -23,10 +23,12 @@ import tempfile
 import shutil
 import mock
 import time
-from eventlet import tpool
+from eventlet import sleep, spawn, tpool
 from mock import Mock, patch
 from hashlib import md5
 from copy import deepcopy
+from contextlib import contextmanager
+from swift.common.utils import lock_file
 from swiftonfile.swift.common.exceptions import AlreadyExistsAsDir, AlreadyExistsAsFile
 from swift.common.exceptions import (
     DiskFileNoSpace,
@@ -38,6 +40,7 @@ from swift.common.exceptions import (
 
 from swiftonfile.swift.common.exceptions import SwiftOnFileSystemOSError
 import swiftonfile.swift.common.utils
+from swiftonfile.swift.common import fs_utils
 from swiftonfile.swift.common.utils import normalize_timestamp
 import swiftonfile.swift.obj.diskfile
 from swiftonfile.swift.obj import diskfile
@@ -45,6 +48,10 @@ from swiftonfile.swift.obj.diskfile import (
     DiskFileWriter,
     DiskFileManager,
     DiskFileReader,
+    ReadAhead,
+    DirectoryCollector,
+    SubtreePurge,
+    EtagMaterializer,
     UserMappingDiskFileBehavior,
     GroupMappingDiskFileBehavior,
 )
@@ -73,7 +80,7 @@ def _mapit(filename_or_fd):
     return stats.st_ino
 
 
-def _mock_read_metadata(filename_or_fd):
+def _mock_read_metadata(filename_or_fd, stats=None):
     global _metadata
     ino = _mapit(filename_or_fd)
     if ino in _metadata:
@@ -83,7 +90,11 @@ def _mock_read_metadata(filename_or_fd):
     return md
 
 
-def _mock_write_metadata(filename_or_fd, metadata):
+def _mock_read_metadata_stored(filename_or_fd, stats=None):
+    return _mock_read_metadata(filename_or_fd), None
+
+
+def _mock_write_metadata(filename_or_fd, metadata, stored=None):
     global _metadata
     ino = _mapit(filename_or_fd)
     _metadata[ino] = metadata
@@ -610,6 +621,8 @@ class TestDiskFile(unittest.TestCase):
         self._saved_df_rm = swiftonfile.swift.obj.diskfile.read_metadata
         swiftonfile.swift.obj.diskfile.write_metadata = _mock_write_metadata
         swiftonfile.swift.obj.diskfile.read_metadata = _mock_read_metadata
+        self._saved_df_rms = swiftonfile.swift.obj.diskfile.read_metadata_stored
+        swiftonfile.swift.obj.diskfile.read_metadata_stored = _mock_read_metadata_stored
         self._saved_ut_wm = swiftonfile.swift.common.utils.write_metadata
         self._saved_ut_rm = swiftonfile.swift.common.utils.read_metadata
         swiftonfile.swift.common.utils.write_metadata = _mock_write_metadata
@@ -633,6 +646,7 @@ class TestDiskFile(unittest.TestCase):
         _destroyxattr()
         swiftonfile.swift.obj.diskfile.write_metadata = self._saved_df_wm
         swiftonfile.swift.obj.diskfile.read_metadata = self._saved_df_rm
+        swiftonfile.swift.obj.diskfile.read_metadata_stored = self._saved_df_rms
         swiftonfile.swift.common.utils.write_metadata = self._saved_ut_wm
         swiftonfile.swift.common.utils.read_metadata = self._saved_ut_rm
         swiftonfile.swift.obj.diskfile.do_fsync = self._saved_do_fsync
@@ -783,7 +797,7 @@ class TestDiskFile(unittest.TestCase):
         gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
 
         # ENOENT
-        def do_open(a, b):
+        def do_open(a, b, cached=False):
             e = SwiftOnFileSystemOSError()
             e.errno = errno.E2BIG
             raise e
@@ -797,7 +811,7 @@ class TestDiskFile(unittest.TestCase):
                 self.fail("SwiftOnFileSystemOSError waited")
 
         # OTHER
-        def do_open(a, b):
+        def do_open(a, b, cached=False):
             e = SwiftOnFileSystemOSError()
             e.errno = errno.ENOENT
             raise e
@@ -880,6 +894,193 @@ class TestDiskFile(unittest.TestCase):
             assert gdf._disk_file_open is True
         assert gdf._disk_file_open is False
 
+    def test_open_stream_etag(self):
+        conf = dict(stream_etag="true")
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z", defer_etag=True)
+        with gdf.open():
+            assert gdf.get_metadata()["ETag"] is None
+            assert gdf.get_metadata()["Content-Length"] == 256
+            reader = gdf.reader()
+        # Nothing is persisted before the object is read
+        assert _metadata == {}
+        assert b"".join(reader) == b"y" * 256
+        md = _metadata[_mapit(gdf._data_file)]
+        assert md["ETag"] == md5(b"y" * 256).hexdigest()
+        assert md[diskfile.X_TYPE] == "Object"
+        assert self.lg.get_increment_counts() == {"stream_etag.persisted": 1}
+
+    def test_open_stream_etag_changed(self):
+        conf = dict(stream_etag="true")
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z", defer_etag=True)
+        with gdf.open():
+            reader = gdf.reader()
+        os.utime(gdf._data_file, (0, 0))
+        assert b"".join(reader) == b"y" * 256
+        assert _metadata == {}
+        assert self.lg.get_increment_counts() == {"stream_etag.changed": 1}
+
+    def test_open_stream_etag_range(self):
+        conf = dict(stream_etag="true")
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z", defer_etag=True)
+        with gdf.open():
+            reader = gdf.reader()
+        assert b"".join(reader.app_iter_range(0, 256)) == b"y" * 256
+        assert _metadata == {}
+
+    def test_read_metadata_stream_etag(self):
+        conf = dict(stream_etag="true")
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z", defer_etag=True)
+        md = gdf.read_metadata()
+        assert md["ETag"] == md5(b"y" * 256).hexdigest()
+
+    def test_read_metadata_etag_materializer(self):
+        conf = dict(etag_materializer="true")
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z", defer_etag=True)
+        with mock.patch.object(diskfile, "create_object_metadata") as mock_create:
+            md = gdf.read_metadata()
+        assert not mock_create.called
+        assert md["ETag"] is None
+        assert md["Content-Length"] == 256
+        assert _metadata == {}
+        # A second request does not queue the file again
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z", defer_etag=True)
+        gdf.read_metadata()
+        assert self.lg.get_increment_counts() == {"etag_materializer.queued": 1}
+        # Only the hashing runs in the thread pool
+        with mock.patch.object(
+            diskfile.tpool, "execute", side_effect=lambda f, *a: f(*a)
+        ) as mock_execute:
+            sleep(0)
+        self.assertEqual(
+            [call[0][0] for call in mock_execute.call_args_list],
+            [diskfile._hash_file],
+        )
+        md = _metadata[_mapit(gdf._data_file)]
+        assert md["ETag"] == md5(b"y" * 256).hexdigest()
+        assert self.lg.get_increment_counts() == {
+            "etag_materializer.queued": 1,
+            "etag_materializer.persisted": 1,
+        }
+        md = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z").read_metadata()
+        assert md["ETag"] == md5(b"y" * 256).hexdigest()
+
+    def test_etag_materializer_changed(self):
+        materializer = EtagMaterializer(self.lg, 1, 1)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        stats = os.stat(gdf._data_file)
+        assert materializer.submit("vol0", gdf._data_file, stats, {}, 64)
+        other = os.stat(self.td)
+        # The queue of the device is full
+        assert not materializer.submit("vol0", self.td, other, {}, 64)
+        os.utime(gdf._data_file, (0, 0))
+        sleep(0)
+        assert _metadata == {}
+        assert self.lg.get_increment_counts()["etag_materializer.changed"] == 1
+        assert self.lg.get_increment_counts()["etag_materializer.dropped"] == 1
+
+    def test_read_metadata_single_flight(self):
+        conf = dict(single_flight_revalidation="true")
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        orig_create_object_metadata = diskfile.create_object_metadata
+        calls = []
+
+        def mock_create_object_metadata(*args):
+            calls.append(args)
+            # Let the other requests come in
+            sleep(0.01)
+            return orig_create_object_metadata(*args)
+
+        with mock.patch.object(
+            diskfile, "create_object_metadata", mock_create_object_metadata
+        ):
+            gts = [
+                spawn(
+                    self._get_diskfile("vol0", "p57", "ufo47", "bar", "z").read_metadata
+                )
+                for _ in range(3)
+            ]
+            mds = [gt.wait() for gt in gts]
+        assert len(calls) == 1
+        etag = md5(b"y" * 256).hexdigest()
+        assert all(md["ETag"] == etag for md in mds)
+        assert mds[0] is not mds[1]
+        assert self.lg.get_increment_counts() == {"revalidation.coalesced": 2}
+        assert self.mgr.revalidations == {}
+
+    def test_read_metadata_single_flight_lock_dir(self):
+        lock_dir = os.path.join(self.td, "locks")
+        conf = dict(single_flight_revalidation="true", revalidation_lock_dir=lock_dir)
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        assert os.path.isdir(lock_dir)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        stats = os.stat(gdf._data_file)
+        other_worker_md = {
+            "X-Type": "Object",
+            "X-Object-Type": "file",
+            "Content-Length": 256,
+            "X-Object-PUT-Mtime": normalize_timestamp(stats.st_mtime),
+            "ETag": "other worker etag",
+            "X-Timestamp": normalize_timestamp(stats.st_ctime),
+            "Content-Type": "application/octet-stream",
+        }
+        lock_paths = []
+
+        @contextmanager
+        def mock_lock_file(path, **kwargs):
+            lock_paths.append(path)
+            # The lock was held by another worker which rebuilt the metadata
+            _metadata[_mapit(gdf._data_file)] = other_worker_md
+            yield
+
+        with mock.patch.object(diskfile, "lock_file", mock_lock_file):
+            with mock.patch.object(diskfile, "create_object_metadata") as m_create:
+                md = gdf.read_metadata()
+        assert not m_create.called
+        assert md["ETag"] == "other worker etag"
+        assert lock_paths == [
+            os.path.join(
+                lock_dir,
+                "%x.%x.%x.lock" % (stats.st_dev, stats.st_ino, stats.st_mtime_ns),
+            )
+        ]
+
+    def test_read_metadata_single_flight_lock_timeout(self):
+        conf = dict(
+            single_flight_revalidation="true",
+            revalidation_lock_dir=os.path.join(self.td, "locks"),
+            revalidation_lock_timeout=0.01,
+        )
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        stats = os.stat(gdf._data_file)
+        lock_path = os.path.join(
+            self.td,
+            "locks",
+            "%x.%x.%x.lock" % (stats.st_dev, stats.st_ino, stats.st_mtime_ns),
+        )
+        with lock_file(lock_path):
+            md = gdf.read_metadata()
+        assert md["ETag"] == md5(b"y" * 256).hexdigest()
+
     def test_read_metadata_optimize_open_close(self):
         the_path = os.path.join(self.td, "vol0", "ufo47", "bar")
         the_file = os.path.join(the_path, "z")
@@ -904,17 +1105,41 @@ class TestDiskFile(unittest.TestCase):
         assert not gdf._is_dir
 
         # Case 1
-        # Ensure that reading metadata for non-GET requests
-        # does not incur opening and closing the file when
+        # Ensure that reading metadata for non-GET requests resolves the
+        # path of the file once and uses the fd for everything else when
         # metadata is NOT stale.
-        mock_open = Mock()
-        mock_close = Mock()
-        with mock.patch("swiftonfile.swift.obj.diskfile.do_open", mock_open):
-            with mock.patch("swiftonfile.swift.obj.diskfile.do_close", mock_close):
-                md = gdf.read_metadata()
-                self.assertEqual(md, init_md)
-        self.assertFalse(mock_open.called)
-        self.assertFalse(mock_close.called)
+        calls = []
+
+        def spy(name, func):
+            def wrapper(*args, **kwargs):
+                calls.append((name, args[0]))
+                return func(*args, **kwargs)
+
+            return wrapper
+
+        with nested(
+            mock.patch.object(os, "open", spy("open", os.open)),
+            mock.patch.object(os, "stat", spy("stat", os.stat)),
+            mock.patch.object(os, "fstat", spy("fstat", os.fstat)),
+            mock.patch.object(os, "close", spy("close", os.close)),
+            mock.patch.object(
+                diskfile,
+                "read_metadata_stored",
+                spy("read_metadata_stored", lambda fd, stats=None: (init_md, None)),
+            ),
+        ):
+            md = gdf.read_metadata()
+        self.assertEqual(md, init_md)
+        fd = calls[1][1]
+        self.assertEqual(
+            calls,
+            [
+                ("open", the_file),
+                ("fstat", fd),
+                ("read_metadata_stored", fd),
+                ("close", fd),
+            ],
+        )
 
         # Case 2
         # Ensure that reading metadata for non-GET requests
@@ -931,15 +1156,15 @@ class TestDiskFile(unittest.TestCase):
         self.assertEqual(md["ETag"], md5(b"12345678").hexdigest())
 
     def test_read_metadata_exception(self):
-        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
 
         # ENOENT
-        def read_metadata(a):
+        def read_metadata_stored(a, stats=None):
             e = OSError()
             e.errno = errno.ENOENT
             raise e
 
-        with mock.patch.object(diskfile, "read_metadata", read_metadata):
+        with mock.patch.object(diskfile, "read_metadata_stored", read_metadata_stored):
             try:
                 gdf.read_metadata()
             except DiskFileNotExist:
@@ -948,12 +1173,12 @@ class TestDiskFile(unittest.TestCase):
                 self.fail("DiskFileNotExist waited")
 
         # Other
-        def read_metadata(a):
+        def read_metadata_stored(a, stats=None):
             e = OSError()
             e.errno = errno.ENOEXEC
             raise e
 
-        with mock.patch.object(diskfile, "read_metadata", read_metadata):
+        with mock.patch.object(diskfile, "read_metadata_stored", read_metadata_stored):
             try:
                 gdf.read_metadata()
             except OSError:
@@ -962,16 +1187,18 @@ class TestDiskFile(unittest.TestCase):
                 self.fail("OSError waited")
 
     def test_read_metadata_stat_exception(self):
-        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
 
-        with mock.patch.object(diskfile, "read_metadata", return_value=None):
-            # ENOENT
-            def do_stat(a):
+        with mock.patch.object(
+            diskfile, "read_metadata_stored", return_value=(None, None)
+        ):
+            # ESTALE
+            def do_fstat(a):
                 e = OSError()
-                e.errno = errno.ENOENT
+                e.errno = errno.ESTALE
                 raise e
 
-            with mock.patch.object(diskfile, "do_stat", do_stat):
+            with mock.patch.object(diskfile, "do_fstat", do_fstat):
                 try:
                     gdf.read_metadata()
                 except DiskFileNotExist:
@@ -980,12 +1207,12 @@ class TestDiskFile(unittest.TestCase):
                     self.fail("DiskFileNotExist waited")
 
             # Other
-            def do_stat(a):
+            def do_fstat(a):
                 e = OSError()
                 e.errno = errno.ENOPKG
                 raise e
 
-            with mock.patch.object(diskfile, "do_stat", do_stat):
+            with mock.patch.object(diskfile, "do_fstat", do_fstat):
                 try:
                     gdf.read_metadata()
                 except OSError:
@@ -993,6 +1220,168 @@ class TestDiskFile(unittest.TestCase):
                 else:
                     self.fail("OSError waited")
 
+    def test_read_metadata_stat_cache(self):
+        os.makedirs(os.path.join(self.td, "vol0", "ufo47", "bar"))
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        fs_utils.stat_cache = fs_utils.StatCache(60)
+        try:
+            self.assertRaises(DiskFileNotExist, gdf.read_metadata)
+            # The missing object is answered by the stat cache
+            with mock.patch.object(diskfile, "read_metadata_stored") as mock_read:
+                self.assertRaises(DiskFileNotExist, gdf.read_metadata)
+                self.assertRaises(DiskFileNotExist, gdf.open)
+            self.assertFalse(mock_read.called)
+            # Until it is created
+            with gdf.create() as dw:
+                dw.write(b"1234")
+                dw.put(
+                    {
+                        "ETag": md5(b"1234").hexdigest(),
+                        "X-Timestamp": normalize_timestamp(1),
+                        "Content-Type": "text/plain",
+                    }
+                )
+            gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+            self.assertEqual(gdf.read_metadata()["Content-Length"], 4)
+        finally:
+            fs_utils.stat_cache = None
+
+    def test_create_stat_cache_removed_dir(self):
+        # Directories removed by another worker while their stats are cached
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "dir/z")
+        fs_utils.stat_cache = fs_utils.StatCache(60)
+        try:
+            for _ in range(2):
+                with gdf.create() as dw:
+                    dw.write(b"1234")
+                    dw.put(
+                        {
+                            "ETag": md5(b"1234").hexdigest(),
+                            "X-Timestamp": normalize_timestamp(1),
+                            "Content-Type": "text/plain",
+                        }
+                    )
+                self.assertTrue(os.path.exists(gdf._data_file))
+                fs_utils.do_stat(os.path.dirname(gdf._data_file), cached=True)
+                shutil.rmtree(os.path.dirname(gdf._data_file))
+        finally:
+            fs_utils.stat_cache = None
+
+    def test_create_enoent_attempts(self):
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "dir/z")
+        with mock.patch.object(
+            diskfile,
+            "do_open",
+            side_effect=SwiftOnFileSystemOSError(errno.ENOENT, "ENOENT"),
+        ), mock.patch.object(gdf, "_create_dir_object") as mock_create, mock.patch(
+            "swiftonfile.swift.obj.diskfile.sleep"
+        ):
+            with self.assertRaises(diskfile.DiskFileError):
+                with gdf.create():
+                    pass
+        self.assertEqual(mock_create.call_count, diskfile.MAX_OPEN_ATTEMPTS - 1)
+
+    def test_dir_collector(self):
+        container = os.path.join(self.td, "vol0", "ufo47", "bar")
+        os.makedirs(os.path.join(container, "a", "b", "c"))
+        os.makedirs(os.path.join(container, "a", "d"))
+        open(os.path.join(container, "a", "d", "obj"), "w").close()
+        collector = DirectoryCollector(self.lg, 0, 2)
+        c = os.path.join(container, "a", "b", "c")
+        assert collector.submit("vol0", c, container)
+        # Already queued
+        assert collector.submit("vol0", c, container)
+        assert collector.submit("vol0", os.path.join(container, "a"), container)
+        # The queue of the device is full
+        assert not collector.submit("vol0", os.path.join(container, "x"), container)
+        # Collected in the green thread, not in the thread pool
+        with mock.patch.object(diskfile.tpool, "execute") as mock_execute:
+            for _ in range(3):
+                sleep(0)
+        assert not mock_execute.called
+        # The deepest directories are collected first: a/b/c and a/b are
+        # removed, a is not queued again and is kept
+        assert os.listdir(container) == ["a"]
+        assert os.listdir(os.path.join(container, "a")) == ["d"]
+        assert self.lg.get_increment_counts() == {
+            "dir_gc.queued": 3,
+            "dir_gc.dropped": 1,
+            "dir_gc.removed": 2,
+            "dir_gc.kept": 1,
+        }
+
+    def test_unlinkold_deferred(self):
+        conf = dict(dir_gc_mode="deferred")
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "a/b/z")
+        with mock.patch.object(gdf._mgr.dir_collector, "submit") as submit:
+            gdf._unlinkold()
+        submit.assert_called_once_with(
+            gdf._device_path,
+            os.path.dirname(gdf._data_file),
+            gdf._container_path,
+            mock.ANY,
+        )
+        assert not os.path.exists(gdf._data_file)
+        # The queue is full, the directories are collected at once
+        with mock.patch.object(
+            gdf._mgr.dir_collector, "submit", return_value=False
+        ) as submit:
+            gdf._unlinkold()
+        assert not os.path.exists(os.path.dirname(gdf._put_datadir))
+        self.assertRaises(
+            ValueError, DiskFileManager, dict(dir_gc_mode="later"), self.lg
+        )
+
+    def test_subtree_purge(self):
+        container = os.path.join(self.td, "vol0", "ufo47", "bar")
+        root = os.path.join(container, "scratch")
+        for d in ("a/b/c", "a/d", "e"):
+            os.makedirs(os.path.join(root, d))
+        for f in ("f1", "a/f2", "a/b/f3", "a/b/c/f4", "e/f5"):
+            open(os.path.join(root, f), "w").close()
+        _metadata[_mapit(os.path.join(root, "a", "d"))] = {X_OBJECT_TYPE: DIR_OBJECT}
+        open(os.path.join(container, "other"), "w").close()
+        purge = SubtreePurge(root, container, workers=2)
+        # Not in the thread pool
+        with mock.patch.object(diskfile.tpool, "execute") as mock_execute:
+            names = sorted(name for batch in purge for name in batch)
+        assert not mock_execute.called
+        assert names == [
+            "scratch/a/b/c/f4",
+            "scratch/a/b/f3",
+            "scratch/a/d",
+            "scratch/a/f2",
+            "scratch/e/f5",
+            "scratch/f1",
+        ]
+        assert (purge.objects, purge.directories, purge.errors) == (6, 6, 0)
+        assert os.listdir(container) == ["other"]
+
+    def test_subtree_purge_not_empty(self):
+        container = os.path.join(self.td, "vol0", "ufo47", "bar")
+        root = os.path.join(container, "scratch")
+        os.makedirs(os.path.join(root, "a", "b"))
+        os.makedirs(os.path.join(root, "c"))
+        open(os.path.join(root, "a", "b", "f1"), "w").close()
+        orig_purge_files = diskfile._purge_files
+
+        def _purge_files(path):
+            result = orig_purge_files(path)
+            if path.endswith("b"):
+                # Concurrent PUT
+                open(os.path.join(path, "new"), "w").close()
+            return result
+
+        with mock.patch.object(diskfile, "_purge_files", _purge_files):
+            purge = SubtreePurge(root, container)
+            assert [name for batch in purge for name in batch] == ["scratch/a/b/f1"]
+        # The parents of the directory which was not emptied are kept
+        assert (purge.objects, purge.directories, purge.errors) == (1, 1, 1)
+        assert os.listdir(os.path.join(root, "a", "b")) == ["new"]
+        assert os.listdir(root) == ["a"]
+
     def test__unlinkold(self):
         gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
         gdf._is_dir = False
@@ -1007,6 +1396,56 @@ class TestDiskFile(unittest.TestCase):
             with mock.patch.object(diskfile, "rmobjdir", return_value=True) as rmobjdir:
                 gdf._unlinkold()
                 rmobjdir.assert_called()
+            gdf._mgr.dir_gc_max_entries = 10
+            with mock.patch.object(
+                diskfile, "rmobjdir", return_value=False
+            ) as rmobjdir:
+                gdf._unlinkold()
+                rmobjdir.assert_called_once_with("/fake/path", mock.ANY)
+                assert rmobjdir.call_args[0][1].entries == 10
+
+    def test_unlinkold_budget(self):
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        gdf._is_dir = False
+        gdf._container_path = "/fake"
+        gdf._data_file = "/fake/a/b/c/z"
+        assert gdf._mgr.dir_gc_max_entries == diskfile.DIR_GC_MAX_ENTRIES == 10000
+        with mock.patch.object(diskfile, "do_unlink"), mock.patch.object(
+            diskfile, "rmobjdir", return_value=True
+        ) as rmobjdir:
+            gdf._unlinkold()
+        # One budget for all the parents
+        assert [c[0][0] for c in rmobjdir.call_args_list] == [
+            "/fake/a/b/c",
+            "/fake/a/b",
+            "/fake/a",
+        ]
+        budgets = set(id(c[0][1]) for c in rmobjdir.call_args_list)
+        assert len(budgets) == 1
+        assert (
+            DiskFileManager(dict(dir_gc_max_entries="0"), self.lg).dir_gc_max_entries
+            is None
+        )
+
+    def test_unlinkold_budget_exhausted(self):
+        container = os.path.join(self.td, "vol0", "ufo47", "bar")
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "a/b/c/z")
+        gdf._is_dir = False
+        gdf._container_path = container
+        # c is removed at once, b holds d and f, then a holds e: 3 entries
+        # are scanned in all
+        for d in ("a/b/c", "a/b/d", "a/b/f", "a/e"):
+            os.makedirs(os.path.join(container, d))
+        gdf._mgr.dir_gc_max_entries = 2
+        with mock.patch.object(diskfile, "do_unlink"):
+            gdf._unlinkold()
+        assert os.listdir(os.path.join(container, "a")) == ["e"]
+        for d in ("a/b/c", "a/b/d", "a/b/f"):
+            os.makedirs(os.path.join(container, d))
+        gdf._mgr.dir_gc_max_entries = 3
+        with mock.patch.object(diskfile, "do_unlink"):
+            gdf._unlinkold()
+        assert os.listdir(container) == []
 
     def test_delete_error(self):
         gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
@@ -1141,6 +1580,173 @@ class TestDiskFile(unittest.TestCase):
         for chunk in chunks:
             assert len(chunk) == 64, repr(chunks)
 
+    def test_reader_coalesce_reads(self):
+        conf = dict(disk_chunk_size=64, coalesce_reads="true")
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        readers = []
+        for _ in range(3):
+            gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+            with gdf.open():
+                readers.append(gdf.reader())
+        assert len(self.mgr.shared_reads) == 1
+        shared_read = list(self.mgr.shared_reads.values())[0]
+        assert shared_read.readers == 3
+        assert all(r._shared_read is shared_read for r in readers)
+
+        iterators = [iter(r) for r in readers]
+        chunks = [[], [], []]
+        with mock.patch.object(
+            diskfile, "do_pread", side_effect=diskfile.do_pread
+        ) as mock_pread:
+            for _ in range(4):
+                for i, it in enumerate(iterators):
+                    chunks[i].append(next(it))
+            for it in iterators:
+                self.assertRaises(StopIteration, next, it)
+        for c in chunks:
+            assert b"".join(c) == b"y" * 256
+        # 4 chunks and the end of file, read once for the 3 readers
+        assert mock_pread.call_count == 5
+        assert self.mgr.shared_reads == {}
+        assert shared_read._fd is None
+        assert self.lg.get_increment_counts() == {"coalesced_reads": 2}
+
+    def test_reader_coalesce_reads_slow_reader(self):
+        conf = dict(
+            disk_chunk_size=64, coalesce_reads="true", coalesce_reads_max_chunks=1
+        )
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        with gdf.open():
+            fast = gdf.reader()
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        with gdf.open():
+            slow = gdf.reader()
+        fast_it = iter(fast)
+        fast_chunks = [next(fast_it), next(fast_it)]
+        # The first chunk left the ring, the slow reader reads it itself
+        slow_chunks = list(slow)
+        fast_chunks.extend(fast_it)
+        assert b"".join(fast_chunks) == b"y" * 256
+        assert b"".join(slow_chunks) == b"y" * 256
+        assert self.mgr.shared_reads == {}
+
+    def test_reader_coalesce_reads_range(self):
+        conf = dict(disk_chunk_size=64, coalesce_reads="true")
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        with gdf.open():
+            reader = gdf.reader()
+        assert len(self.mgr.shared_reads) == 1
+        chunks = list(reader.app_iter_range(10, 20))
+        assert b"".join(chunks) == b"y" * 10
+        assert reader._shared_read is None
+        assert self.mgr.shared_reads == {}
+
+    def test_reader_parallel_reads(self):
+        conf = dict(
+            disk_chunk_size=64,
+            parallel_reads=3,
+            parallel_read_stripe_size=100,
+            parallel_read_min_size=200,
+        )
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        preads = []
+
+        def mock_pread(fd, n, offset):
+            preads.append((n, offset))
+            return os.pread(fd, n, offset)
+
+        with mock.patch("swiftonfile.swift.obj.diskfile.do_pread", mock_pread):
+            with gdf.open():
+                reader = gdf.reader()
+            assert reader._read_ahead is not None
+            chunks = list(reader)
+        assert b"".join(chunks) == b"y" * 256
+        assert preads == [(100, 0), (100, 100), (100, 200)]
+        assert reader._read_ahead is None
+        assert reader._fd is None
+
+    def test_reader_parallel_reads_small_file(self):
+        conf = dict(parallel_reads=3, parallel_read_min_size=1024)
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        with gdf.open():
+            reader = gdf.reader()
+        assert reader._read_ahead is None
+        reader.close()
+
+    def test_reader_parallel_reads_stripe_from_layout(self):
+        conf = dict(parallel_reads=2, parallel_read_min_size=0)
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        with mock.patch(
+            "swiftonfile.swift.obj.diskfile.get_stripe_geometry",
+            return_value=(128, 2),
+        ):
+            with gdf.open():
+                reader = gdf.reader()
+        assert reader._read_ahead._read_size == 128
+        chunks = list(reader.app_iter_range(10, 20))
+        assert b"".join(chunks) == b"y" * 10
+        assert reader._read_ahead is None
+
+    def test_read_ahead_short_read(self):
+        fd = os.open(os.devnull, os.O_RDONLY)
+        calls = []
+
+        def mock_pread(fd, n, offset):
+            calls.append((n, offset))
+            return b"x" * min(n, 10)
+
+        try:
+            with mock.patch("swiftonfile.swift.obj.diskfile.do_pread", mock_pread):
+                read_ahead = ReadAhead(fd, 25, 1, 40)
+                assert read_ahead.read(0) == b"x" * 25
+                assert read_ahead.read(10) is None
+                assert read_ahead.read(25) == b"x" * 15
+                assert read_ahead.read(40) == b""
+        finally:
+            os.close(fd)
+        assert calls == [(25, 0), (15, 10), (5, 20), (25, 25), (5, 35)]
+
+    def test_reader_adaptive_chunk_size(self):
+        conf = dict(
+            adaptive_chunk_size="true",
+            min_disk_chunk_size=16,
+            max_disk_chunk_size=128,
+        )
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        gdf = self._create_and_get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        with mock.patch(
+            "swiftonfile.swift.common.utils.get_stripe_geometry",
+            return_value=(1024 * 1024, 4),
+        ):
+            with gdf.open():
+                reader = gdf.reader()
+        assert reader._disk_chunk_size == 128
+        chunks = list(reader)
+        # The layout is not fetched by requests not reading the object
+        with mock.patch.object(
+            diskfile, "get_chunk_size"
+        ) as mock_get_chunk_size, mock.patch.object(
+            diskfile, "validate_object", return_value=True
+        ):
+            with gdf.open():
+                gdf.get_metadata()
+        assert not mock_get_chunk_size.called
+        assert [len(chunk) for chunk in chunks] == [128, 128]
+        assert self.lg.get_increment_counts() == {"disk_chunk_size.128": 1}
+
     def test_reader_larger_file(self):
         closed = [False]
         fd = [-1]
@@ -1485,6 +2091,55 @@ class TestDiskFile(unittest.TestCase):
         assert os.path.exists(gdf._data_file)
         assert not os.path.exists(tmppath)
 
+    def test_put_adaptive_chunk_size(self):
+        conf = dict(adaptive_chunk_size="true", min_disk_chunk_size=8)
+        conf.update(self.conf)
+        self.mgr = DiskFileManager(conf, self.lg)
+        the_cont = os.path.join(self.td, "vol0", "ufo47", "bar")
+        os.makedirs(the_cont)
+        gdf = self._get_diskfile("vol0", "p57", "ufo47", "bar", "z")
+        writes = []
+
+        def mock_write(fd, chunk):
+            writes.append(len(chunk))
+            return os.write(fd, chunk)
+
+        metadata = {
+            "X-Timestamp": "1234",
+            "Content-Type": "file",
+            "ETag": md5(b"1234\n" * 5).hexdigest(),
+            "Content-Length": "25",
+        }
+        with mock.patch(
+            "swiftonfile.swift.obj.diskfile.get_chunk_size", return_value=10
+        ), mock.patch("swiftonfile.swift.obj.diskfile.do_write", mock_write):
+            with gdf.create() as dw:
+                for _ in range(5):
+                    dw.write(b"1234\n")
+                assert dw.chunks_finished()[0] == 25
+                dw.put(metadata)
+        assert writes == [10, 10, 5]
+        with open(gdf._data_file, "rb") as f:
+            assert f.read() == b"1234\n" * 5
+        assert self.lg.get_increment_counts() == {"disk_chunk_size.10": 1}
+
+        # The writes stay aligned whatever the size of the data received
+        del writes[:]
+        data = b"x" * 7 + b"y" * 25 + b"z" * 3
+        metadata["ETag"] = md5(data).hexdigest()
+        metadata["Content-Length"] = "35"
+        with mock.patch(
+            "swiftonfile.swift.obj.diskfile.get_chunk_size", return_value=10
+        ), mock.patch("swiftonfile.swift.obj.diskfile.do_write", mock_write):
+            with gdf.create() as dw:
+                assert dw.write(data[:7]) == 7
+                assert dw.write(data[7:32]) == 32
+                assert dw.write(data[32:]) == 35
+                dw.put(metadata)
+        assert writes == [10, 10, 10, 5]
+        with open(gdf._data_file, "rb") as f:
+            assert f.read() == data
+
     def test_put_ENOSPC(self):
         the_cont = os.path.join(self.td, "vol0", "ufo47", "bar")
         os.makedirs(the_cont)
@@ -1814,7 +2469,7 @@ class TestDiskFile(unittest.TestCase):
             else:
                 self.fail("Expecting DiskFileNotExist")
             _m_do_fstat.assert_called_once_with(999)
-            _m_rmd.assert_called_once_with(999)
+            _m_rmd.assert_called_once_with(999, _m_do_fstat.return_value)
             _m_do_close.assert_called_once_with(999)
             self.assertFalse(gdf._fd)
             # Make sure ENOENT failure is logged
@@ -1898,7 +2553,7 @@ class TestDiskFile(unittest.TestCase):
 
         with mock.patch.object(diskfile, "do_mkdir", mock_mkdir):
             # raise ENOENT
-            def mock_stat(path):
+            def mock_stat(path, cached=False):
                 e = SwiftOnFileSystemOSError()
                 e.errno = errno.ENOENT
                 raise e
@@ -1940,7 +2595,7 @@ class TestDiskFile(unittest.TestCase):
 
         with mock.patch.object(diskfile, "do_mkdir", mock_mkdir):
             # raise ENOENT
-            def mock_stat(path):
+            def mock_stat(path, cached=False):
                 e = SwiftOnFileSystemOSError()
                 e.errno = errno.ENOENT
                 raise e
@@ -1954,7 +2609,7 @@ class TestDiskFile(unittest.TestCase):
                     self.fail("DiskFileError waited")
 
             # raise EIO
-            def mock_stat(path):
+            def mock_stat(path, cached=False):
                 e = SwiftOnFileSystemOSError()
                 e.errno = errno.EIO
                 raise e
@@ -17,8 +17,10 @@
 
 from tempfile import mkdtemp
 from shutil import rmtree
+import json
 import mock
 import os
+import signal
 
 from swift.common.swob import Request
 
@@ -209,6 +211,370 @@ class TestObjectController(unittest.TestCase):
                 else:
                     self.fail("ConnectionTimeout waited")
 
+    def test_setup_metadata_cache(self):
+        with get_controller() as controller:
+            self.assertIsNone(object_server.utils.metadata_cache)
+            controller.setup({"metadata_cache_size": "10"})
+            try:
+                self.assertEqual(object_server.utils.metadata_cache.size, 10)
+            finally:
+                object_server.utils.metadata_cache = None
+
+    def test_setup_shared_metadata_cache(self):
+        with get_controller() as controller:
+            path = os.path.join(controller._diskfile_router.manager_cls.devices, "c")
+            controller.setup(
+                {
+                    "metadata_cache_size": "10",
+                    "metadata_cache_shared": "yes",
+                    "metadata_cache_path": path,
+                }
+            )
+            try:
+                cache = object_server.utils.metadata_cache
+                self.assertIsInstance(cache, object_server.SharedMetadataCache)
+                self.assertEqual(cache.path, path)
+                self.assertEqual(cache.size, 16)
+                cache.close()
+            finally:
+                object_server.utils.metadata_cache = None
+
+    def test_setup_metadata_format(self):
+        with get_controller() as controller:
+            self.assertEqual(object_server.utils.metadata_format, "json")
+            controller.setup({"metadata_format": "Binary"})
+            try:
+                self.assertEqual(object_server.utils.metadata_format, "binary")
+            finally:
+                object_server.utils.metadata_format = "json"
+            self.assertRaises(ValueError, controller.setup, {"metadata_format": "xml"})
+
+    def test_setup_metadata_layout(self):
+        with get_controller() as controller:
+            self.assertEqual(object_server.utils.metadata_layout, "blob")
+            controller.setup({"metadata_layout": "keys"})
+            try:
+                self.assertEqual(object_server.utils.metadata_layout, "keys")
+            finally:
+                object_server.utils.metadata_layout = "blob"
+            self.assertRaises(ValueError, controller.setup, {"metadata_layout": "a"})
+
+    def test_setup_sqlite_metadata_devices(self):
+        with get_controller() as controller:
+            devices = controller._diskfile_router.manager_cls.devices
+            controller.setup(
+                {
+                    "devices": devices,
+                    "sqlite_metadata_devices": "sda1, sdb1",
+                    "sqlite_metadata_dir": os.path.join(devices, "db"),
+                }
+            )
+            try:
+                stores = object_server.utils.metadata_stores
+                self.assertEqual(
+                    sorted(stores),
+                    [
+                        os.path.join(devices, "sda1", ""),
+                        os.path.join(devices, "sdb1", ""),
+                    ],
+                )
+                store = stores[os.path.join(devices, "sda1", "")]
+                self.assertIsInstance(store, object_server.SqliteMetadataStore)
+                self.assertEqual(store.db_dir, os.path.join(devices, "db", "sda1"))
+            finally:
+                object_server.utils.metadata_stores = {}
+
+    def test_setup_stat_cache(self):
+        with get_controller() as controller:
+            self.assertIsNone(object_server.fs_utils.stat_cache)
+            controller.setup({"stat_cache_device_ttls": "sda1:0"})
+            self.assertIsNone(object_server.fs_utils.stat_cache)
+            devices = controller._diskfile_router.manager_cls.devices
+            controller.setup(
+                {
+                    "devices": devices,
+                    "stat_cache_ttl": "2",
+                    "stat_cache_device_ttls": "sda1:0.5, sdb1:0",
+                    "stat_cache_size": "100",
+                }
+            )
+            try:
+                cache = object_server.fs_utils.stat_cache
+                self.assertEqual(cache.ttl, 2)
+                self.assertEqual(cache.size, 100)
+                self.assertEqual(
+                    cache.device_ttls,
+                    {
+                        os.path.join(devices, "sda1", ""): 0.5,
+                        os.path.join(devices, "sdb1", ""): 0,
+                    },
+                )
+            finally:
+                object_server.fs_utils.stat_cache = None
+
+    def test_setup_dir_fd_cache(self):
+        with get_controller() as controller:
+            self.assertIsNone(object_server.fs_utils.dir_fd_cache)
+            devices = controller._diskfile_router.manager_cls.devices
+            controller.setup({"devices": devices, "dir_fd_cache_size": "10"})
+            try:
+                cache = object_server.fs_utils.dir_fd_cache
+                self.assertEqual(cache.devices, os.path.join(devices, ""))
+                self.assertEqual(cache.size, 10)
+                with mock.patch.object(cache, "close") as mock_close:
+                    controller.setup({})
+                mock_close.assert_called_once_with()
+                self.assertIsNone(object_server.fs_utils.dir_fd_cache)
+            finally:
+                object_server.fs_utils.dir_fd_cache = None
+
+    def test_setup_syscall_stats(self):
+        with get_controller() as controller:
+            self.assertIsNone(object_server.fs_utils.syscall_stats)
+            devices = controller._diskfile_router.manager_cls.devices
+            controller.setup({"devices": devices, "fs_stats_sample_rate": "0.5"})
+            try:
+                stats = object_server.fs_utils.syscall_stats
+                self.assertIs(stats.logger, controller.logger)
+                self.assertEqual(stats.devices, os.path.join(devices, ""))
+                self.assertEqual(stats.sample_rate, 0.5)
+                self.assertEqual(stats.interval, 10)
+                controller.setup({})
+                self.assertIsNone(object_server.fs_utils.syscall_stats)
+            finally:
+                object_server.fs_utils.syscall_stats = None
+
+    def test_profiler(self):
+        with get_controller() as controller:
+            self.assertIsNone(controller.profiler)
+            devices = controller._diskfile_router.manager_cls.devices
+            with mock.patch("signal.signal") as mock_signal:
+                controller.setup(
+                    {"devices": devices, "profile_dir": devices, "profile_workers": "1"}
+                )
+            profiler = controller.profiler
+            mock_signal.assert_called_once_with(signal.SIGUSR2, profiler._toggle)
+            self.assertEqual(profiler.output_dir, devices)
+            self.assertEqual(profiler.interval, 0.01)
+            self.assertEqual(profiler.duration, 60)
+            self.assertEqual(profiler.fraction, 1)
+            req = Request.blank("/sda1/p/a/c/o", environ={"REQUEST_METHOD": "HEAD"})
+            with mock.patch.object(profiler, "start") as mock_start:
+                req.get_response(controller)
+            mock_start.assert_called_once_with(continuous=True)
+            controller.setup({})
+            self.assertIsNone(controller.profiler)
+
+    def test_hub_watchdog(self):
+        with get_controller() as controller:
+            self.assertIsNone(controller.hub_watchdog)
+            devices = controller._diskfile_router.manager_cls.devices
+            controller.setup({"devices": devices, "hub_stall_threshold_ms": "200"})
+            watchdog = controller.hub_watchdog
+            self.assertEqual(watchdog.threshold, 0.2)
+            req = Request.blank("/sda1/p/a/c/o", environ={"REQUEST_METHOD": "HEAD"})
+            # The watchdog is started by the requests
+            with mock.patch.object(watchdog, "start") as mock_start:
+                req.get_response(controller)
+            mock_start.assert_called_once_with()
+            with mock.patch.object(watchdog, "stop") as mock_stop:
+                controller.setup({})
+            mock_stop.assert_called_once_with()
+            self.assertIsNone(controller.hub_watchdog)
+
+    def test_device_monitor(self):
+        with get_controller() as controller:
+            devices = controller._diskfile_router.manager_cls.devices
+            os.mkdir(os.path.join(devices, "sda1"))
+            controller.setup(
+                {
+                    "devices": devices,
+                    "mount_check": "false",
+                    "device_monitor_interval": "30",
+                }
+            )
+            monitor = object_server.devmonitor.monitor
+            try:
+                self.assertEqual(monitor.interval, 30)
+                self.assertEqual(monitor.probe_timeout, 10)
+                self.assertFalse(monitor.mount_check)
+                req = Request.blank("/sda1/0/a/c/o", environ={"REQUEST_METHOD": "HEAD"})
+                # Not probing in background
+                patcher = mock.patch.object(monitor, "start")
+                mock_start = patcher.start()
+                req.get_response(controller)
+                mock_start.assert_called_once_with()
+                self.assertTrue(monitor.probe("sda1").free_bytes)
+                monitor.health["sda1"].free_bytes = 10
+
+                def put(size):
+                    return Request.blank(
+                        "/sda1/0/a/c/o",
+                        environ={"REQUEST_METHOD": "PUT"},
+                        headers={
+                            "X-Timestamp": "1",
+                            "Content-Type": "text/plain",
+                            "Content-Length": str(size),
+                        },
+                    )
+
+                # Rejected before the body is read
+                req = put(11)
+                req.environ["wsgi.input"] = None
+                resp = req.get_response(controller)
+                self.assertEqual(resp.status_int, 507)
+                req = put(4)
+                req.body = b"data"
+                self.assertEqual(req.get_response(controller).status_int, 201)
+
+                # An unavailable device is not checked
+                monitor.health["sda1"].mounted = False
+                with mock.patch.object(
+                    controller._diskfile_router.manager_cls, "get_dev_path"
+                ) as mock_get_dev_path:
+                    resp = Request.blank("/sda1/0/a/c/o").get_response(controller)
+                self.assertEqual(resp.status_int, 507)
+                mock_get_dev_path.assert_not_called()
+            finally:
+                mock.patch.stopall()
+                controller.setup({})
+            self.assertIsNone(object_server.devmonitor.monitor)
+
+    def test_tracing(self):
+        with get_controller() as controller:
+            devices = controller._diskfile_router.manager_cls.devices
+            trace_file = os.path.join(devices, "trace.ndjson")
+            controller.setup(
+                {"devices": devices, "mount_check": "false", "trace_file": trace_file}
+            )
+            try:
+                req = Request.blank(
+                    "/sda1/0/a/c/o",
+                    environ={"REQUEST_METHOD": "PUT"},
+                    headers={
+                        "X-Timestamp": "1",
+                        "Content-Type": "text/plain",
+                        "X-Trans-Id": "tx1",
+                    },
+                    body=b"data",
+                )
+                resp = req.get_response(controller)
+                self.assertEqual(resp.status_int, 201)
+                self.assertEqual(resp.body, b"")
+                req = Request.blank("/sda1/0/a/c/o", headers={"X-Trans-Id": "tx2"})
+                resp = req.get_response(controller)
+                self.assertEqual(resp.body, b"data")
+            finally:
+                object_server.tracing.tracer.close()
+                object_server.tracing.tracer = None
+            # The file of the worker
+            trace_file = os.path.join(devices, "trace.%d.ndjson" % os.getpid())
+            with open(trace_file) as f:
+                spans = [json.loads(line) for line in f]
+            names = {}
+            for span in spans:
+                names.setdefault(span["traceId"], []).append(span["name"])
+            put_trace, get_trace = list(names)
+            self.assertEqual(put_trace, object_server.tracing.md5(b"tx1").hexdigest())
+            for name in (
+                "PUT",
+                "diskfile.create",
+                "diskfile.write",
+                "diskfile.put",
+                "diskfile.write_metadata",
+                "diskfile.fsync",
+                "diskfile.rename",
+                "container_update",
+            ):
+                self.assertIn(name, names[put_trace])
+            self.assertEqual(
+                names[get_trace], ["diskfile.open", "diskfile.read", "GET"]
+            )
+            root = spans[-1]
+            self.assertEqual(spans[-2]["parentSpanId"], root["spanId"])
+            self.assertIn(
+                {"key": "http.status_code", "value": {"intValue": "200"}},
+                root["attributes"],
+            )
+
+    def test_PURGE(self):
+        with get_controller() as controller:
+            mock_ring = mock.MagicMock()
+            mock_ring.get_nodes.return_value = (
+                0,
+                [{"device": "device", "ip": "127.0.0.1", "port": 7777}],
+            )
+            req = Request.blank(
+                "/sda1/AUTH_a/c/scratch",
+                environ={"REQUEST_METHOD": "PURGE"},
+                headers={"X-Timestamp": "1"},
+            )
+            # Disabled by default
+            self.assertEqual(controller.PURGE(req).status_int, 501)
+
+            devices = controller._diskfile_router.manager_cls.devices
+            controller.setup(
+                {
+                    "devices": devices,
+                    "mount_check": "false",
+                    "allow_prefix_purge": "yes",
+                    "purge_workers": "2",
+                }
+            )
+            root = os.path.join(devices, "sda1", "AUTH_a", "c", "scratch")
+            with mock.patch.object(object_server, "Ring", return_value=mock_ring):
+                self.assertEqual(controller.PURGE(req).status_int, 404)
+                os.makedirs(os.path.join(root, "a"))
+                open(os.path.join(root, "f1"), "w").close()
+                open(os.path.join(root, "a", "f2"), "w").close()
+                with mock.patch.object(controller, "async_update") as mock_update:
+                    resp = req.get_response(controller)
+                    self.assertEqual(resp.status_int, 200)
+                    lines = [json.loads(line) for line in resp.body.splitlines()]
+            self.assertEqual(
+                lines[-1], {"objects": 2, "directories": 2, "errors": 0, "done": True}
+            )
+            self.assertFalse(os.path.exists(root))
+            updated = sorted(call[0][3] for call in mock_update.call_args_list)
+            self.assertEqual(updated, ["scratch/a/f2", "scratch/f1"])
+            args = mock_update.call_args[0]
+            self.assertEqual(args[:3], ("DELETE", "AUTH_a", "c"))
+            self.assertEqual(args[4:7], ("127.0.0.1:7777", "0", "device"))
+            self.assertEqual(args[7]["x-timestamp"], "1")
+            self.assertEqual(args[8], "sda1")
+
+    def test_PURGE_bad_prefix(self):
+        with get_controller() as controller:
+            mock_ring = mock.MagicMock()
+            mock_ring.get_nodes.return_value = (
+                0,
+                [{"device": "device", "ip": "127.0.0.1", "port": 7777}],
+            )
+            devices = controller._diskfile_router.manager_cls.devices
+            controller.setup(
+                {
+                    "devices": devices,
+                    "mount_check": "false",
+                    "allow_prefix_purge": "yes",
+                }
+            )
+            keep = os.path.join(devices, "sda1", "AUTH_a", "other", "keep.txt")
+            os.makedirs(os.path.dirname(keep))
+            os.makedirs(os.path.join(devices, "sda1", "AUTH_a", "c", "x"))
+            open(keep, "w").close()
+            with mock.patch.object(object_server, "Ring", return_value=mock_ring):
+                for prefix in ("..", ".", "x/..", "x/../../..", "x//y", "x/./y"):
+                    req = Request.blank(
+                        "/sda1/AUTH_a/c/" + prefix,
+                        environ={"REQUEST_METHOD": "PURGE"},
+                        headers={"X-Timestamp": "1"},
+                    )
+                    # Request.blank normalizes the path
+                    req.environ["PATH_INFO"] = "/sda1/AUTH_a/c/" + prefix
+                    resp = req.get_response(controller)
+                    self.assertEqual(resp.status_int, 400, prefix)
+            self.assertTrue(os.path.exists(keep))
+
     def test_REPLICATE(self):
         with get_controller() as controller:
             req = Request.blank(
@@ -436,6 +802,54 @@ class TestObjectController(unittest.TestCase):
                                 update_headers,
                             )
 
+    def test_GET_defer_etag(self):
+        defer_etag = []
+
+        def mock_GET(controller, request):
+            defer_etag.append(controller._request_local.defer_etag)
+            return object_server.HTTPOk()
+
+        with get_controller() as controller:
+            with mock.patch.object(
+                object_server.server.ObjectController, "GET", mock_GET
+            ):
+                for headers in ({}, {"Range": "bytes=0-1"}, {"If-Match": "x"}):
+                    req = Request.blank(
+                        "/device/partition/account/container/obj", headers=headers
+                    )
+                    resp = req.get_response(controller)
+                    self.assertEqual(resp.status_int, 200)
+                    self.assertEqual(resp.headers["X-Etag-Pending"], "true")
+                    self.assertFalse(controller._request_local.defer_etag)
+        self.assertEqual(defer_etag, [True, False, False])
+
+    def test_HEAD_defer_etag(self):
+        def mock_HEAD(controller, request):
+            self.assertTrue(controller._request_local.defer_etag)
+            return object_server.HTTPOk(headers={"Etag": "x"})
+
+        with get_controller() as controller:
+            with mock.patch.object(
+                object_server.server.ObjectController, "HEAD", mock_HEAD
+            ):
+                req = Request.blank(
+                    "/device/partition/account/container/obj",
+                    environ={"REQUEST_METHOD": "HEAD"},
+                )
+                resp = req.get_response(controller)
+                self.assertEqual(resp.status_int, 200)
+                self.assertNotIn("X-Etag-Pending", resp.headers)
+
+    def test_get_diskfile_defer_etag(self):
+        with get_controller() as controller:
+            router = mock.MagicMock()
+            controller._diskfile_router = router
+            controller._request_local.defer_etag = True
+            controller.get_diskfile("dev", "p", "a", "c", "o", policy=0)
+            router[0].get_diskfile.assert_called_with(
+                "dev", "p", "a", "c", "o", 0, defer_etag=True
+            )
+
     def test_LIST(self):
         with get_controller() as controller:
             mock_ring = mock.MagicMock()
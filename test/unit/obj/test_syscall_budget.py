@@ -0,0 +1,373 @@
+""" Syscall budgets of the DiskFile operations of the object server requests
+
+Each scenario runs the DiskFile calls made by an object server request on a
+tmpfs device, counting the calls reaching the os and xattr modules and the
+ctypes functions, and checks them against the budget of the scenario. A
+change adding syscalls to a hot path fails here: raise the budget if it is
+worth it, lower it when a change saves syscalls. Run with -s to print the
+report of each scenario.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from hashlib import md5
+
+import mock
+import xattr
+from eventlet import tpool
+from swift.common.exceptions import DiskFileNotExist
+from swift.common.utils import Timestamp
+
+from swiftonfile.swift.common import fs_utils, utils
+from swiftonfile.swift.obj import diskfile
+from swiftonfile.swift.obj.diskfile import DiskFileManager
+from test.unit import FakeLogger
+
+OS_CALLS = (
+    "chown",
+    "close",
+    "fchown",
+    "fdatasync",
+    "fstat",
+    "fsync",
+    "listdir",
+    "lseek",
+    "lstat",
+    "mkdir",
+    "open",
+    "pread",
+    "read",
+    "readlink",
+    "rename",
+    "rmdir",
+    "scandir",
+    "stat",
+    "statvfs",
+    "unlink",
+    "write",
+)
+XATTR_CALLS = ("getxattr", "listxattr", "removexattr", "setxattr")
+
+BODY = b"x" * 1000
+
+
+def _counting(counts, name, func):
+    def wrapper(*args, **kwargs):
+        counts[name] += 1
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+@contextmanager
+def count_syscalls():
+    """Count the calls made through os, xattr and the ctypes functions."""
+    counts = Counter()
+    with ExitStack() as stack:
+        for name in OS_CALLS:
+            stack.enter_context(
+                mock.patch.object(os, name, _counting(counts, name, getattr(os, name)))
+            )
+        for name in XATTR_CALLS:
+            stack.enter_context(
+                mock.patch.object(
+                    xattr, name, _counting(counts, name, getattr(xattr, name))
+                )
+            )
+        if fs_utils._fgetxattr:
+            stack.enter_context(
+                mock.patch.object(
+                    fs_utils,
+                    "_fgetxattr",
+                    _counting(counts, "fgetxattr", fs_utils._fgetxattr),
+                )
+            )
+        stack.enter_context(
+            mock.patch.object(
+                diskfile,
+                "fallocate",
+                _counting(counts, "fallocate", diskfile.fallocate),
+            )
+        )
+        stack.enter_context(
+            mock.patch.object(
+                diskfile,
+                "do_fadvise64",
+                _counting(counts, "fadvise64", diskfile.do_fadvise64),
+            )
+        )
+        yield counts
+
+
+class TestSyscallBudget(unittest.TestCase):
+    """Syscall budgets of the DiskFile operations"""
+
+    def setUp(self):
+        self._orig_tpool_exc = tpool.execute
+        tpool.execute = lambda f, *args, **kwargs: f(*args, **kwargs)
+        shm = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        self.td = tempfile.mkdtemp(dir=shm)
+        os.makedirs(os.path.join(self.td, "sda1", "a", "c"))
+        conf = dict(devices=self.td, mount_check=False)
+        self.mgr = DiskFileManager(conf, FakeLogger())
+        # Loads the ctypes fgetxattr, counted once loaded
+        fd = os.open(self.td, os.O_RDONLY)
+        try:
+            fs_utils.do_getxattr_into(fd, "user.missing", bytearray(1))
+        except (IOError, OSError):
+            pass
+        finally:
+            os.close(fd)
+
+    def tearDown(self):
+        tpool.execute = self._orig_tpool_exc
+        shutil.rmtree(self.td)
+
+    def _diskfile(self, obj):
+        return self.mgr.get_diskfile("sda1", "0", "a", "c", obj)
+
+    def _put(self, obj, body=BODY):
+        df = self._diskfile(obj)
+        try:
+            df.read_metadata()
+        except DiskFileNotExist:
+            pass
+        metadata = {
+            "name": "/a/c/%s" % obj,
+            "X-Timestamp": Timestamp(time.time()).internal,
+            "Content-Type": "application/octet-stream",
+            "ETag": md5(body).hexdigest(),
+            "Content-Length": str(len(body)),
+        }
+        writer = df.writer(size=len(body))
+        try:
+            writer.open()
+            writer.write(body)
+            writer.put(metadata)
+            writer.commit(Timestamp(metadata["X-Timestamp"]))
+        finally:
+            writer.close()
+
+    def _head(self, obj):
+        return self._diskfile(obj).read_metadata()
+
+    def _get(self, obj):
+        df = self._diskfile(obj)
+        with df.open():
+            df.get_metadata()
+            reader = df.reader()
+        return b"".join(reader)
+
+    def _post(self, obj):
+        df = self._diskfile(obj)
+        df.read_metadata()
+        df.write_metadata(
+            {
+                "X-Timestamp": Timestamp(time.time()).internal,
+                "X-Object-Meta-Color": "blue",
+            }
+        )
+
+    def _delete(self, obj):
+        df = self._diskfile(obj)
+        df.read_metadata()
+        df.delete(Timestamp(time.time()))
+
+    def assertBudget(self, name, func, budget):
+        with count_syscalls() as counts:
+            func()
+        counts = dict(counts)
+        print(
+            "\n%s: %d syscalls\n%s"
+            % (
+                name,
+                sum(counts.values()),
+                "\n".join(
+                    "  %-12s %3d (budget %d)" % (call, count, budget.get(call, 0))
+                    for call, count in sorted(counts.items())
+                ),
+            )
+        )
+        over = dict(
+            (call, count)
+            for call, count in counts.items()
+            if count > budget.get(call, 0)
+        )
+        self.assertFalse(over, "%s is over its syscall budget: %s" % (name, over))
+
+    # The mkdir calls of every scenario include the two of DiskFile(), making
+    # the account and container directories of the object
+
+    def test_small_put(self):
+        self.assertBudget(
+            "small PUT",
+            lambda: self._put("obj"),
+            dict(
+                mkdir=3,
+                stat=3,
+                open=2,
+                close=1,
+                fstat=1,
+                fallocate=1,
+                write=1,
+                setxattr=1,
+                fsync=1,
+                fadvise64=1,
+                rename=1,
+            ),
+        )
+
+    def test_overwrite(self):
+        self._put("obj")
+        self.assertBudget(
+            "overwrite PUT",
+            lambda: self._put("obj"),
+            dict(
+                mkdir=3,
+                stat=3,
+                open=2,
+                close=2,
+                fstat=2,
+                fgetxattr=1,
+                fallocate=1,
+                write=1,
+                setxattr=1,
+                fsync=1,
+                fadvise64=1,
+                rename=1,
+            ),
+        )
+
+    def test_nested_put(self):
+        self.assertBudget(
+            "nested PUT",
+            lambda: self._put("d1/d2/d3/obj"),
+            dict(
+                mkdir=8,
+                stat=3,
+                open=3,
+                close=1,
+                fstat=1,
+                fallocate=1,
+                write=1,
+                setxattr=1,
+                fsync=1,
+                fadvise64=1,
+                rename=1,
+            ),
+        )
+
+    def test_head(self):
+        self._put("obj")
+        self.assertBudget(
+            "HEAD",
+            lambda: self._head("obj"),
+            dict(mkdir=2, stat=2, open=1, close=1, fstat=1, fgetxattr=1),
+        )
+
+    def test_head_metadata_cache(self):
+        self._put("obj")
+        utils.metadata_cache = utils.MetadataCache(10)
+        try:
+            self._head("obj")
+            # The fstat of the object validates the cached metadata
+            self.assertBudget(
+                "HEAD with the metadata cache",
+                lambda: self._head("obj"),
+                dict(mkdir=2, stat=2, open=1, close=1, fstat=1),
+            )
+            self.assertEqual(utils.metadata_cache.hits, 1)
+        finally:
+            utils.metadata_cache = None
+
+    def test_head_stale(self):
+        self._put("obj")
+        # Modified outside of Swift
+        with open(os.path.join(self.td, "sda1", "a", "c", "obj"), "ab") as f:
+            f.write(b"y")
+        self.assertBudget(
+            "HEAD of a stale object",
+            lambda: self._head("obj"),
+            dict(
+                mkdir=2,
+                stat=2,
+                open=1,
+                close=2,
+                fstat=1,
+                fgetxattr=2,
+                lseek=1,
+                read=2,
+                setxattr=1,
+            ),
+        )
+
+    def test_post(self):
+        self._put("obj")
+        self.assertBudget(
+            "POST",
+            lambda: self._post("obj"),
+            dict(mkdir=2, stat=2, open=1, close=1, fstat=1, fgetxattr=1, setxattr=1),
+        )
+
+    def test_post_keys_layout(self):
+        utils.metadata_layout = "keys"
+        try:
+            self._put("obj")
+            self._post("obj")
+            # The changed keys are found from the metadata read by the POST
+            self.assertBudget(
+                "POST with the keys layout",
+                lambda: self._post("obj"),
+                dict(
+                    mkdir=2,
+                    stat=2,
+                    open=1,
+                    close=1,
+                    fstat=1,
+                    listxattr=1,
+                    getxattr=2,
+                    setxattr=1,
+                ),
+            )
+        finally:
+            utils.metadata_layout = "blob"
+
+    def test_get(self):
+        self._put("obj")
+        self.assertBudget(
+            "GET",
+            lambda: self._get("obj"),
+            dict(
+                mkdir=2,
+                stat=2,
+                open=1,
+                close=1,
+                fstat=1,
+                fgetxattr=1,
+                read=2,
+                fadvise64=1,
+            ),
+        )
+
+    def test_delete(self):
+        self._put("d1/d2/obj")
+        self.assertBudget(
+            "DELETE with GC",
+            lambda: self._delete("d1/d2/obj"),
+            dict(
+                mkdir=2,
+                stat=2,
+                open=1,
+                close=1,
+                fstat=1,
+                fgetxattr=1,
+                unlink=1,
+                rmdir=2,
+            ),
+        )
+        self.assertEqual(os.listdir(os.path.join(self.td, "sda1", "a", "c")), [])